@@ -1,8 +1,16 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
-from models import db, ContactMessage, User, Build
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify, Response, stream_with_context
+from models import db, ContactMessage, User, Build, Order
+from utils import BUILD_CATEGORIES, encode_keyset_cursor, decode_keyset_cursor
+from sqlalchemy import tuple_
 from functools import wraps
 from auth import login_required
+from db_metrics import get_endpoint_stats
+from admin_stats import get_admin_stats
+from user_cache import get_user_principal
+from message_search import search_messages
+from order_export import EXPORT_FORMATS, parse_date_range, validate_statuses, iter_orders, stream_export
 import logging
+from datetime import timedelta
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -11,8 +19,7 @@ def admin_required(f):
     @wraps(f)
     @login_required  # First ensure the user is logged in
     def decorated_function(*args, **kwargs):
-        user_id = session.get('user_id')
-        user = User.query.get(user_id)
+        user = get_user_principal(session.get('user_id'))
         
         # For simplicity, we're assuming admin is user with ID 1
         # In a real app, you would have a role or is_admin field
@@ -23,11 +30,11 @@ def admin_required(f):
             return redirect(url_for('index'))
     return decorated_function
 
+INBOX_PAGE_SIZE = 10
+
 @admin_bp.route('/admin/messages')
 @admin_required
 def view_messages():
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
     filter_type = request.args.get('filter', 'all')
     
     # Base query
@@ -39,14 +46,61 @@ def view_messages():
     elif filter_type == 'read':
         query = query.filter_by(is_read=True)
     
-    # Get messages with pagination
-    messages = query.order_by(
-        ContactMessage.created_at.desc()
-    ).paginate(page=page, per_page=per_page)
+    # Totals come from the maintained counters instead of a COUNT over the inbox
+    stats = get_admin_stats()
+    totals = {
+        'all': stats['messages'],
+        'unread': stats['unread_messages'],
+        'read': stats['messages'] - stats['unread_messages']
+    }
+    
+    # Full-text search: ranked matches with highlighting instead of the date-ordered pages
+    search_query = request.args.get('q', '').strip()
+    if search_query:
+        is_read = {'unread': False, 'read': True}.get(filter_type)
+        messages, highlights = search_messages(search_query, is_read=is_read)
+        return render_template(
+            'admin/messages.html',
+            messages=messages,
+            highlights=highlights,
+            search_query=search_query,
+            filter_type=filter_type,
+            total=totals.get(filter_type, totals['all']),
+            unread_total=totals['unread']
+        )
+    
+    # Keyset pagination on (created_at, id): ?after= pages to older messages, ?before= to newer ones
+    key = tuple_(ContactMessage.created_at, ContactMessage.id)
+    after = decode_keyset_cursor(request.args.get('after', ''))
+    before = decode_keyset_cursor(request.args.get('before', '')) if after is None else None
+    
+    if before is not None:
+        messages = query.filter(key > before).order_by(
+            ContactMessage.created_at.asc(), ContactMessage.id.asc()
+        ).limit(INBOX_PAGE_SIZE + 1).all()
+        has_newer = len(messages) > INBOX_PAGE_SIZE
+        messages = messages[:INBOX_PAGE_SIZE][::-1]
+        has_older = True
+    else:
+        if after is not None:
+            query = query.filter(key < after)
+        messages = query.order_by(
+            ContactMessage.created_at.desc(), ContactMessage.id.desc()
+        ).limit(INBOX_PAGE_SIZE + 1).all()
+        has_older = len(messages) > INBOX_PAGE_SIZE
+        messages = messages[:INBOX_PAGE_SIZE]
+        has_newer = after is not None
     
     return render_template(
         'admin/messages.html',
-        messages=messages
+        messages=messages,
+        highlights=None,
+        search_query='',
+        filter_type=filter_type,
+        total=totals.get(filter_type, totals['all']),
+        unread_total=totals['unread'],
+        older_cursor=encode_keyset_cursor(messages[-1]) if messages and has_older else None,
+        newer_cursor=encode_keyset_cursor(messages[0]) if messages and has_newer else None
     )
 
 @admin_bp.route('/admin/messages/<int:message_id>')
@@ -77,11 +131,12 @@ def mark_replied(message_id):
 @admin_bp.route('/admin/dashboard')
 @admin_required
 def dashboard():
-    # Get counts for dashboard
-    message_count = ContactMessage.query.count()
-    unread_message_count = ContactMessage.query.filter_by(is_read=False).count()
-    user_count = User.query.count()
-    build_count = Build.query.count()
+    # Get counts for dashboard (maintained counters, see admin_stats.py)
+    stats = get_admin_stats()
+    message_count = stats['messages']
+    unread_message_count = stats['unread_messages']
+    user_count = stats['users']
+    build_count = stats['builds']
     
     # Get latest messages
     latest_messages = ContactMessage.query.order_by(
@@ -95,4 +150,51 @@ def dashboard():
         user_count=user_count,
         build_count=build_count,
         latest_messages=latest_messages
-    )
\ No newline at end of file
+    )
+
+@admin_bp.route('/admin/metrics')
+@admin_required
+def metrics():
+    """Per-endpoint SQL statistics for this worker process."""
+    return jsonify({'sql': get_endpoint_stats()})
+
+@admin_bp.route('/admin/orders/component/<category>/<component_id>')
+@admin_required
+def orders_with_component(category, component_id):
+    """Support lookup: the most recent orders whose build uses a given component."""
+    if category not in BUILD_CATEGORIES:
+        return jsonify({'error': 'Unknown category'}), 404
+    
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    orders = Order.query.filter(Order.contains_component(category, component_id)) \
+        .order_by(Order.created_at.desc()).limit(limit).all()
+    
+    return jsonify({'orders': [{
+        'order_number': order.order_number,
+        'status': order.status,
+        'email': order.email,
+        'total_amount': order.total_amount,
+        'created_at': order.created_at.isoformat()
+    } for order in orders]})
+
+@admin_bp.route('/admin/orders/export')
+@admin_required
+def export_orders():
+    """Stream orders as CSV or NDJSON (?format=), filtered by ?from= and ?to= (YYYY-MM-DD) and ?status=."""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unknown format '{export_format}'"}), 400
+    try:
+        start, end = parse_date_range(request.args.get('from'), request.args.get('to'))
+        statuses = validate_statuses(request.args.getlist('status'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # No Content-Length, so the body is sent chunked as it is generated
+    filename = f"orders-{start.date() if start else 'all'}-{(end - timedelta(days=1)).date() if end else 'now'}.{export_format}"
+    response = Response(stream_with_context(stream_export(iter_orders(start, end, statuses), export_format)),
+                        mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy hold the stream back
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,119 @@
+"""
+Admin dashboard counters.
+
+The admin_stat table holds one row per dashboard counter so the dashboard and
+inbox read a handful of rows instead of running COUNT(*) over whole tables.
+Mapper events adjust the counters inside the same transaction as the change
+(inserts, deletes and is_read flips); recount_admin_stats() reconciles them with
+exact counts, since bulk Query.update()/delete() and raw SQL bypass the events.
+
+Run the recount periodically with `flask --app main recount-stats` (also part
+of `flask --app main init-db`).
+"""
+import logging
+from sqlalchemy import event, func, inspect, select
+from models import db, AdminStat, ContactMessage, User, Build
+
+# Exact count query for each counter
+STAT_QUERIES = {
+    'messages': lambda: db.session.query(func.count(ContactMessage.id)),
+    'unread_messages': lambda: db.session.query(func.count(ContactMessage.id)).filter(ContactMessage.is_read == False),  # noqa: E712
+    'users': lambda: db.session.query(func.count(User.id)),
+    'builds': lambda: db.session.query(func.count(Build.id)),
+}
+
+
+def _adjust(connection, name, delta):
+    # Relative UPDATE so concurrent writers never overwrite each other's changes
+    stats = AdminStat.__table__
+    connection.execute(
+        stats.update().where(stats.c.name == name).values(value=stats.c.value + delta)
+    )
+
+
+def _recount(connection, name, count_query):
+    # For when a change can't be turned into a delta; counts rows as this transaction sees them
+    stats = AdminStat.__table__
+    connection.execute(
+        stats.update().where(stats.c.name == name).values(value=count_query.scalar_subquery())
+    )
+
+
+@event.listens_for(ContactMessage, 'after_insert')
+def _message_inserted(mapper, connection, target):
+    _adjust(connection, 'messages', 1)
+    if not target.is_read:
+        _adjust(connection, 'unread_messages', 1)
+
+
+@event.listens_for(ContactMessage, 'after_delete')
+def _message_deleted(mapper, connection, target):
+    _adjust(connection, 'messages', -1)
+    if not target.is_read:
+        _adjust(connection, 'unread_messages', -1)
+
+
+@event.listens_for(ContactMessage, 'after_update')
+def _message_updated(mapper, connection, target):
+    history = inspect(target).attrs.is_read.history
+    if not history.has_changes():
+        return
+    if not history.deleted:
+        # The old value was never loaded (e.g. is_read set on an expired message), so
+        # whether this changed anything is unknown
+        messages = ContactMessage.__table__
+        _recount(connection, 'unread_messages',
+                 select(func.count()).select_from(messages).where(messages.c.is_read == False))  # noqa: E712
+        return
+    if bool(history.deleted[0]) != bool(target.is_read):
+        _adjust(connection, 'unread_messages', -1 if target.is_read else 1)
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, target):
+    _adjust(connection, 'users', 1)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _adjust(connection, 'users', -1)
+
+
+@event.listens_for(Build, 'after_insert')
+def _build_inserted(mapper, connection, target):
+    _adjust(connection, 'builds', 1)
+
+
+@event.listens_for(Build, 'after_delete')
+def _build_deleted(mapper, connection, target):
+    _adjust(connection, 'builds', -1)
+
+
+def recount_admin_stats():
+    """Replace every counter with an exact count. Returns {name: (old value, new value)}."""
+    changes = {}
+    for name, count_query in STAT_QUERIES.items():
+        value = count_query().scalar()
+        stat = db.session.get(AdminStat, name)
+        if stat is None:
+            stat = AdminStat(name=name, value=value)
+            db.session.add(stat)
+            changes[name] = (None, value)
+        elif stat.value != value:
+            changes[name] = (stat.value, value)
+            stat.value = value
+    db.session.commit()
+
+    drifted = {name: change for name, change in changes.items() if change[0] is not None}
+    if drifted:
+        logging.warning(f"Admin stats drifted and were corrected: {drifted}")
+    return changes
+
+
+def get_admin_stats():
+    """{name: value} for every counter; recounts first if a counter row is missing."""
+    stats = {stat.name: stat.value for stat in AdminStat.query.all()}
+    if len(stats) < len(STAT_QUERIES):
+        recount_admin_stats()
+        stats = {stat.name: stat.value for stat in AdminStat.query.all()}
+    return stats
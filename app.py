@@ -1,10 +1,16 @@
 import os
 import logging
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response
+import hashlib
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, get_flashed_messages, make_response, g
+from flask.sessions import SecureCookieSessionInterface
 from models import db, User, Build, PreBuiltConfig, ContactMessage
 from werkzeug.middleware.proxy_fix import ProxyFix
-from flask_login import LoginManager
-from utils import load_component_data, load_compatibility_rules, check_compatibility, calculate_total_price
+from flask_login import LoginManager, current_user
+from user_cache import get_user_principal
+from build_summaries import get_row_config, get_summaries
+from inventory import apply_stock, get_category_stock, is_in_stock, STOCK_SNAPSHOT_TTL
+from utils import load_component_data, load_compatibility_rules, check_compatibility, calculate_total_price, get_component_by_id, encode_build_code, decode_build_code, get_cached_fragment, apply_selection, get_builder_state, BUILD_CODE_CATEGORIES
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -12,7 +18,7 @@ logging.basicConfig(level=logging.DEBUG)
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-key-for-testing")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)  # needed for url_for to generate with https and for per-IP login limits
 
 # Configure the database with optimized connection settings
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
@@ -24,10 +30,15 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_timeout": 30,  # Wait up to 30 seconds for a connection from the pool
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False  # Disable event system for better performance
+app.config["SQL_SLOW_QUERY_MS"] = float(os.environ.get("SQL_SLOW_QUERY_MS", 200))  # Slow-query log threshold
 
 # Initialize the database
 db.init_app(app)
 
+# Per-request query counts, N+1 detection and slow-query logging
+from db_metrics import init_sql_instrumentation
+init_sql_instrumentation(app)
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -35,11 +46,147 @@ login_manager.login_view = 'auth.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# Create database tables
-with app.app_context():
+    # Cached principal instead of a User query per request (see user_cache.py)
+    return get_user_principal(user_id)
+
+def init_db():
+    """Create database tables, apply pending migrations, seed the prebuilt configurations,
+    and reprice and refresh the summaries of builds saved against an older catalog."""
+    from prebuilt_configs import create_prebuilt_configs
+    from migrations import upgrade
+    from build_summaries import refresh_stale_summaries
+    from repricing import reprice_if_catalog_changed
+    from admin_stats import recount_admin_stats
     db.create_all()
+    upgrade()
+    create_prebuilt_configs()
+    reprice_if_catalog_changed()
+    refresh_stale_summaries()
+    recount_admin_stats()
+
+def warm_caches():
+    """Load the catalog, rules, benchmark tables, templates and step fragments into memory.
+    
+    Called once in the gunicorn master (see gunicorn.conf.py) so forked workers share
+    these structures copy-on-write instead of each building their own copy.
+    """
+    import benchmarks  # noqa: F401  (benchmark tables are module-level constants)
+    
+    components = load_component_data()
+    load_compatibility_rules()
+    
+    for template_name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(template_name)
+    
+    with app.test_request_context():
+        for category in components:
+            step_cards_fragment(category)
+
+# Schema creation is an explicit step (`flask --app main init-db`) rather than an import side effect
+@app.cli.command('init-db')
+def init_db_command():
+    """Create database tables and seed the prebuilt configurations."""
+    init_db()
+    print("Database initialized")
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    from migrations import upgrade
+    applied = upgrade()
+    print(f"Applied migrations: {applied}" if applied else "Database schema is up to date")
+
+@app.cli.command('refresh-summaries')
+def refresh_summaries_command():
+    """Recompute build summaries built against an older catalog version."""
+    from build_summaries import refresh_stale_summaries
+    refreshed = refresh_stale_summaries()
+    print(", ".join(f"{table}: {count} refreshed" for table, count in refreshed.items()))
+
+@app.cli.command('reprice')
+@click.option('--dry-run', is_flag=True, help='Report the price changes without writing them')
+def reprice_command(dry_run):
+    """Recompute stored build, prebuilt and cart prices from the current catalog."""
+    from repricing import reprice_all
+    report = reprice_all(dry_run=dry_run)
+    for table, diff in report.items():
+        print(f"{table}: {diff['changed']} {'would change' if dry_run else 'changed'}, total change {diff['delta']:+.2f}")
+        for row_id, old_price, new_price in diff['largest']:
+            print(f"  #{row_id}: {old_price} -> {new_price}")
+
+@app.cli.command('recount-stats')
+def recount_stats_command():
+    """Reconcile the admin dashboard counters with exact counts (run periodically, e.g. hourly)."""
+    from admin_stats import recount_admin_stats
+    changes = recount_admin_stats()
+    print(", ".join(f"{name}: {old} -> {new}" for name, (old, new) in changes.items()) or "Admin stats are exact")
+
+@app.cli.command('purge-carts')
+@click.option('--max-age-days', type=int, default=None, help='Age of the last update after which an anonymous cart is deleted')
+@click.option('--batch-size', type=int, default=1000, help='Carts deleted per transaction')
+def purge_carts_command(max_age_days, batch_size):
+    """Delete abandoned anonymous carts in small batches (run periodically, e.g. daily)."""
+    from cart import purge_abandoned_carts, ANONYMOUS_CART_MAX_AGE_DAYS
+    deleted = purge_abandoned_carts(max_age_days or ANONYMOUS_CART_MAX_AGE_DAYS, batch_size)
+    print(f"Deleted {deleted} abandoned carts")
+
+@app.cli.command('sync-stripe-catalog')
+@click.option('--force', is_flag=True, help='Check every component even if this catalog version was already synced')
+def sync_stripe_catalog_command(force):
+    """Mirror catalog components into Stripe Products/Prices (run after each catalog change)."""
+    from stripe_catalog import sync_stripe_catalog
+    report = sync_stripe_catalog(force=force)
+    print(", ".join(f"{change}: {count}" for change, count in report.items()) if report else "Stripe catalog is up to date")
+
+@app.cli.command('process-webhooks')
+def process_webhooks_command():
+    """Apply queued Stripe webhook events (web workers do this in the background; use after a restart)."""
+    from webhook_queue import process_all_pending_events
+    processed = process_all_pending_events()
+    print(f"Processed {processed} webhook events")
+
+@app.cli.command('set-stock')
+@click.argument('category')
+@click.argument('component_id')
+@click.argument('quantity', type=int, required=False)
+@click.option('--untrack', is_flag=True, help='Stop tracking the component (it never runs out)')
+def set_stock_command(category, component_id, quantity, untrack):
+    """Set the units of a component available for checkout."""
+    from models import ComponentStock
+    if untrack:
+        ComponentStock.query.filter_by(category=category, component_id=component_id).delete()
+        db.session.commit()
+        print(f"{category} {component_id} is no longer tracked")
+        return
+    if quantity is None or quantity < 0:
+        raise click.UsageError('QUANTITY must be zero or more (or use --untrack)')
+    db.session.merge(ComponentStock(category=category, component_id=component_id, available=quantity))
+    db.session.commit()
+    print(f"{category} {component_id}: {quantity} available")
+
+@app.cli.command('release-reservations')
+def release_reservations_command():
+    """Return stock held by abandoned checkouts and cancel their orders (run periodically, e.g. every 5 minutes)."""
+    from inventory import release_expired_reservations
+    released = release_expired_reservations()
+    print(f"Released the reservations of {released} orders")
+
+@app.cli.command('export-orders')
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--from', 'start', help='First order date to include (YYYY-MM-DD)')
+@click.option('--to', 'end', help='Last order date to include (YYYY-MM-DD)')
+@click.option('--status', 'statuses', multiple=True, help='Only orders with this status (repeatable)')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='File to write (default: stdout)')
+def export_orders_command(export_format, start, end, statuses, output):
+    """Stream orders as CSV or NDJSON with component names, for fulfilment and accounting."""
+    from order_export import parse_date_range, validate_statuses, iter_orders, stream_export
+    try:
+        start, end = parse_date_range(start, end)
+        statuses = validate_statuses(statuses)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for chunk in stream_export(iter_orders(start, end, statuses), export_format):
+        output.write(chunk)
     
 # Register blueprints
 from auth import auth_bp
@@ -74,18 +221,37 @@ def classic_builder():
     if 'pc_config' not in session:
         session['pc_config'] = {}
     
+    # Only the selected components are rendered server-side; the rest load per category on demand
     components = load_component_data()
+    selected_components = {}
+    for category, component_id in session['pc_config'].items():
+        component = get_component_by_id(components, category, component_id)
+        if component:
+            selected_components[category] = [component]
+    
     compatibility_issues = check_compatibility(session['pc_config'])
     total_price = calculate_total_price(session['pc_config'])
     
     return render_template(
         'builder.html',
-        components=components,
+        selected_components=selected_components,
         current_config=session['pc_config'],
         compatibility_issues=compatibility_issues,
         total_price=total_price
     )
 
+def step_cards_fragment(category):
+    """The cached step builder cards for one category, with selection and stock markers unresolved."""
+    return get_cached_fragment(('step_cards', category), lambda: render_template(
+        'fragments/step_component_cards.html',
+        category=category,
+        components=load_component_data().get(category, [])
+    ))
+
+def render_step_cards(category, selected_id=None):
+    """Render the step builder cards for one category from the fragment cache."""
+    return apply_stock(apply_selection(step_cards_fragment(category), selected_id), category)
+
 @app.route('/builder/step-by-step', methods=['GET'])
 def step_builder():
     """Step-by-Step PC Builder page with guided interface."""
@@ -93,18 +259,37 @@ def step_builder():
     if 'pc_config' not in session:
         session['pc_config'] = {}
     
-    components = load_component_data()
     compatibility_issues = check_compatibility(session['pc_config'])
     total_price = calculate_total_price(session['pc_config'])
     
+    # Only the first step is rendered here, the other steps are fetched from step_partial
     return render_template(
         'step_builder.html',
-        components=components,
+        step_cards=render_step_cards('case', session['pc_config'].get('case')),
         current_config=session['pc_config'],
         compatibility_issues=compatibility_issues,
         total_price=total_price
     )
 
+@app.route('/builder/step/<category>', methods=['GET'])
+def step_partial(category):
+    """Component cards (HTML) or component list (?format=json) for a single builder step."""
+    components = load_component_data()
+    if category not in components:
+        return jsonify({'error': f"Component category '{category}' not found"}), 404
+    
+    if request.args.get('format') == 'json':
+        # Availability of tracked components comes alongside, from the stock snapshot
+        response = jsonify({category: components[category], 'stock': get_category_stock(category)})
+        # Nothing per-visitor, so any cache may share it, for as long as the stock snapshot lives
+        response.headers['Cache-Control'] = f'public, max-age={STOCK_SNAPSHOT_TTL}'
+        return response
+    
+    current_config = session.get('pc_config', {})
+    response = make_response(render_step_cards(category, current_config.get(category)))
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
 @app.route('/select/<category>', methods=['GET'])
 def select_component(category):
     components = load_component_data()
@@ -116,11 +301,17 @@ def select_component(category):
     # Get the current configuration
     current_config = session.get('pc_config', {})
     
+    # The component cards only depend on the catalog, so render them once and inject the selection
+    cards = get_cached_fragment(('component_select', category), lambda: render_template(
+        'fragments/component_select_cards.html',
+        category=category,
+        components=components[category]
+    ))
+    
     return render_template(
         'component_select.html',
         category=category,
-        components=components[category],
-        current_selection=current_config.get(category)
+        cards=apply_stock(apply_selection(cards, current_config.get(category)), category)
     )
     
 @app.route('/component/<category>/<component_id>', methods=['GET'])
@@ -132,7 +323,6 @@ def component_detail(category, component_id):
         return redirect(url_for('step_builder'))
     
     # Use the helper function for more efficient lookup
-    from utils import get_component_by_id
     component = get_component_by_id(components, category, component_id)
     
     if not component:
@@ -141,14 +331,19 @@ def component_detail(category, component_id):
     
     # Check if this component is currently selected in the build
     current_config = session.get('pc_config', {})
-    is_selected = current_config.get(category) == component_id
+    
+    # The details body only depends on the catalog, so render it once and inject the selection
+    details = get_cached_fragment(('component_detail', category, component_id), lambda: render_template(
+        'fragments/component_details_body.html',
+        category=category,
+        component=component
+    ))
     
     # Add cache control headers for better client-side caching
     response = make_response(render_template(
         'component_details.html',
-        category=category,
         component=component,
-        is_selected=is_selected
+        details=apply_selection(details, current_config.get(category))
     ))
     response.headers['Cache-Control'] = 'private, max-age=60'  # Cache for 60 seconds
     return response
@@ -166,6 +361,9 @@ def add_component(category, component_id):
         del session['pc_config'][category]
         session.modified = True
         return redirect(url_for('step_builder'))
+    elif not is_in_stock(category, component_id):
+        flash("Sorry, that component is out of stock.", "warning")
+        return redirect(url_for('select_component', category=category))
     else:
         # This is an add/select action
         # Add component to configuration
@@ -192,43 +390,49 @@ def remove_component(category):
     return redirect(url_for('step_builder'))
 
 @app.route('/summary')
-def summary():
-    if 'pc_config' not in session or not session['pc_config']:
-        flash("Please build a PC configuration first", "warning")
-        return redirect(url_for('step_builder'))
+@app.route('/summary/<code>')
+def summary(code=None):
+    if code:
+        # Shared build codes carry the whole configuration, so no session or DB access is needed
+        pc_config = decode_build_code(code)
+        if pc_config is None:
+            flash("This build link is invalid or was created for an older catalog", "warning")
+            return redirect(url_for('step_builder'))
+    else:
+        if 'pc_config' not in session or not session['pc_config']:
+            flash("Please build a PC configuration first", "warning")
+            return redirect(url_for('step_builder'))
+        pc_config = session['pc_config']
     
     components = load_component_data()
     config_details = {}
     
     # More efficient component lookup using the helper function
-    for category, component_id in session['pc_config'].items():
-        from utils import get_component_by_id
+    for category, component_id in pc_config.items():
         component = get_component_by_id(components, category, component_id)
         if component:
             config_details[category] = component
     
-    compatibility_issues = check_compatibility(session['pc_config'])
-    total_price = calculate_total_price(session['pc_config'])
-    
-    # Get performance benchmarks if CPU and GPU are selected
-    performance_summary = None
-    if 'cpu' in session['pc_config'] and 'gpu' in session['pc_config']:
-        try:
-            # Lazy import for better performance
-            from benchmarks import get_performance_summary
-            performance_summary = get_performance_summary(session['pc_config'])
-        except Exception as e:
-            app.logger.error(f"Error retrieving performance summary: {str(e)}")
+    # Compatibility, price and performance come from the same cached state as /api/builder_state
+    state = get_builder_state(pc_config)
     
     # Cache control headers for better browser caching
     response = make_response(render_template(
         'summary.html',
         config=config_details,
-        compatibility_issues=compatibility_issues,
-        total_price=total_price,
-        performance=performance_summary
+        compatibility_issues=state['issues'],
+        total_price=state['total'],
+        performance=state['performance'],
+        share_code=encode_build_code(pc_config),
+        shared=code is not None
     ))
-    response.headers['Cache-Control'] = 'private, max-age=10'  # Cache for 10 seconds
+    if code and not current_user.is_authenticated and not get_flashed_messages():
+        # Shared links render the same for every anonymous visitor, so let CDNs cache them.
+        # Not when the page showed this visitor's flashed messages (get_flashed_messages
+        # returns what the render consumed), which also changed their session cookie
+        response.headers['Cache-Control'] = 'public, max-age=3600'
+    else:
+        response.headers['Cache-Control'] = 'private, max-age=10'  # Cache for 10 seconds
     return response
 
 # Benchmarks and compare routes removed as per updated site map
@@ -250,6 +454,33 @@ def api_calculate_price():
         'total': total_price
     })
 
+@app.route('/api/builder_state', methods=['POST'])
+def api_builder_state():
+    """Compatibility issues, total, per-category subtotals and performance in one round trip.
+    
+    Clients may send the category that changed and its previous component id so the
+    server can build on the state it computed for the previous configuration.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    config = data.get('config') or {}
+    changed = data.get('changed')
+    previous = data.get('previous')
+    
+    # The state cache is keyed on these values, so only builder categories and string ids get in
+    if not isinstance(config, dict) or not all(
+            category in BUILD_CODE_CATEGORIES and isinstance(component_id, str)
+            for category, component_id in config.items()):
+        return jsonify({'error': 'config must map builder categories to component ids'}), 400
+    if changed is not None and changed not in BUILD_CODE_CATEGORIES:
+        return jsonify({'error': 'changed must be a builder category'}), 400
+    if previous is not None and not isinstance(previous, str):
+        return jsonify({'error': 'previous must be a component id'}), 400
+    
+    state = get_builder_state(config, changed=changed, previous=previous)
+    return jsonify(state)
+
 @app.route('/reset', methods=['POST'])
 def reset_configuration():
     if 'pc_config' in session:
@@ -302,41 +533,92 @@ def contact():
         
     return render_template('contact.html')
 
+# Rendered-page cache for static content pages served to anonymous visitors
+_page_cache = {}
+DEPLOY_VERSION = os.environ.get('DEPLOY_VERSION', os.environ.get('REPLIT_DEPLOYMENT_ID', ''))
+STATIC_PAGE_BASES = ['layout.html', 'legal_base.html']  # Parent templates that make up the page chrome
+STATIC_PAGE_MAX_AGE = 86400  # Cache lifetime in seconds (1 day)
+
+class StaticPageSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions that leave Vary: Cookie off the shared static page responses.
+    
+    Flask adds the header whenever the session was read, and Flask-Login reads it on
+    every response, so it can't be avoided by not touching the session. The shared
+    copy is the same for every visitor it is served to, and with the header shared
+    caches would keep one copy per cookie, i.e. none at all.
+    """
+    
+    def save_session(self, app, session, response):
+        # A modified session still goes out with its Set-Cookie and the header
+        if g.get('shared_static_page') and not session.modified:
+            session.accessed = False
+        super().save_session(app, session, response)
+
+app.session_interface = StaticPageSessionInterface()
+
+def render_static_page(template_name):
+    """Render a content page once per template version and serve it with a strong ETag."""
+    # Flash messages and the logged-in nav are per-user, so those requests render normally
+    if '_flashes' in session or '_user_id' in session or 'remember_token' in request.cookies:
+        return render_template(template_name)
+    
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    mtimes = tuple(
+        os.path.getmtime(os.path.join(template_dir, name))
+        for name in [template_name] + STATIC_PAGE_BASES
+    )
+    key = (mtimes, DEPLOY_VERSION)
+    
+    cached = _page_cache.get(template_name)
+    if cached is None or cached['key'] != key:
+        # Rendered in a cookie-less request context of its own, so the visitor who
+        # triggers the render neither shapes the shared copy nor has their session touched
+        with app.test_request_context(request.path, base_url=request.root_url):
+            html = render_template(template_name)
+        cached = {'key': key, 'html': html, 'etag': hashlib.sha1(html.encode('utf-8')).hexdigest()}
+        _page_cache[template_name] = cached
+    
+    g.shared_static_page = True
+    response = make_response(cached['html'])
+    response.set_etag(cached['etag'])
+    response.headers['Cache-Control'] = f'public, max-age={STATIC_PAGE_MAX_AGE}'
+    return response.make_conditional(request)
+
 # Legal routes
 @app.route('/terms')
 def terms():
     """Terms & Conditions page."""
-    return render_template('terms.html')
+    return render_static_page('terms.html')
 
 @app.route('/privacy')
 def privacy():
     """Privacy Policy page."""
-    return render_template('privacy.html')
+    return render_static_page('privacy.html')
 
 @app.route('/cookies')
 def cookies():
     """Cookie Policy page."""
-    return render_template('cookies.html')
+    return render_static_page('cookies.html')
 
 @app.route('/about')
 def about():
     """About Us page with company information."""
-    return render_template('about.html')
+    return render_static_page('about.html')
 
 @app.route('/delivery')
 def delivery():
     """Delivery Information page with shipping details."""
-    return render_template('delivery.html')
+    return render_static_page('delivery.html')
 
 @app.route('/faq')
 def faq():
     """Frequently Asked Questions page."""
-    return render_template('faq.html')
+    return render_static_page('faq.html')
 
 @app.route('/sitemap')
 def sitemap():
     """Site Map page showing all website pages in an organized format."""
-    return render_template('sitemap.html')
+    return render_static_page('sitemap.html')
 
 
 @app.route('/prebuilt')
@@ -359,38 +641,12 @@ def product_detail(config_id):
         return redirect(url_for('builds.prebuilt_configs'))
     config_details = {}
     
-    # Get component details for each category
-    for category in ['cpu', 'motherboard', 'ram', 'gpu', 'storage', 'power_supply', 'case', 'cooling']:
-        component_id = getattr(config, f'{category}_id')
-        if component_id:
-            category_components = components.get(category, [])
-            component = next((c for c in category_components if c['id'] == component_id), None)
-            if component:
-                config_details[category] = component
-    
-    # Calculate performance benchmarks
-    performance_summary = None
-    if config.cpu_id and config.gpu_id:
-        try:
-            # Lazy import for better performance
-            from benchmarks import get_performance_summary
-            temp_config = {
-                'cpu': config.cpu_id,
-                'gpu': config.gpu_id,
-                'ram': config.ram_id
-            }
-            performance_summary = get_performance_summary(temp_config)
-        except Exception as e:
-            app.logger.error(f"Error retrieving performance summary: {str(e)}")
-    
-    # Check compatibility
-    temp_config = {}
-    for category in ['cpu', 'motherboard', 'ram', 'gpu', 'storage', 'power_supply', 'case', 'cooling']:
-        component_id = getattr(config, f'{category}_id')
-        if component_id:
-            temp_config[category] = component_id
-            
-    compatibility_issues = check_compatibility(temp_config)
+    # Component specs are index lookups; scores come from the stored summary (see build_summaries.py)
+    for category, component_id in get_row_config(config).items():
+        component = get_component_by_id(components, category, component_id)
+        if component:
+            config_details[category] = component
+    performance_summary = get_summaries([config])[config.id].get('performance')
     
     # Use specialized template for the Ryzen 5 5500 RTX 4060 product
     if config.name == "Ryzen 5 5500 RTX 4060 Gaming PC":
@@ -399,7 +655,6 @@ def product_detail(config_id):
             config=config,
             config_details=config_details,
             performance=performance_summary,
-            compatibility_issues=compatibility_issues,
             PreBuiltConfig=PreBuiltConfig
         )
     else:
@@ -408,7 +663,6 @@ def product_detail(config_id):
             config=config,
             config_details=config_details,
             performance=performance_summary,
-            compatibility_issues=compatibility_issues,
             PreBuiltConfig=PreBuiltConfig
         )
 
@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
 from models import db, User
+from password_hashing import HashingBusy, allow_login_attempt
+from builds import get_user_builds_page
+from utils import decode_keyset_cursor
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
@@ -43,11 +45,30 @@ def login():
     
     form = LoginForm()
     
+    # Per-IP and per-account limits are checked before the form is validated or anything is hashed
+    if request.method == 'POST' and not allow_login_attempt(request.remote_addr, request.form.get('email')):
+        flash('Too many login attempts. Please wait a minute and try again.', 'danger')
+        return render_template('auth/login.html', form=form), 429
+    
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         
         # Check if user exists and password is correct
-        if user and user.check_password(form.password.data):
+        try:
+            password_ok = user is not None and user.check_password(form.password.data)
+        except HashingBusy:
+            flash('We are receiving a lot of login attempts right now. Please try again in a moment.', 'danger')
+            return render_template('auth/login.html', form=form), 429
+        
+        if password_ok:
+            # Upgrade hashes made with older parameters while the plain password is at hand
+            if user.password_needs_rehash():
+                try:
+                    user.set_password(form.password.data)
+                    db.session.commit()
+                except HashingBusy:
+                    pass
+            
             login_user(user, remember=form.remember.data)
             
             # Get next page from request args, or default to index
@@ -68,13 +89,21 @@ def register():
     
     form = RegisterForm()
     
+    if request.method == 'POST' and not allow_login_attempt(request.remote_addr):
+        flash('Too many attempts. Please wait a minute and try again.', 'danger')
+        return render_template('auth/register.html', form=form), 429
+    
     if form.validate_on_submit():
         # Create new user
         new_user = User(
             username=form.username.data,
             email=form.email.data
         )
-        new_user.set_password(form.password.data)
+        try:
+            new_user.set_password(form.password.data)
+        except HashingBusy:
+            flash('We are receiving a lot of requests right now. Please try again in a moment.', 'danger')
+            return render_template('auth/register.html', form=form), 429
         
         # Add user to database
         db.session.add(new_user)
@@ -95,7 +124,14 @@ def logout():
 @auth_bp.route('/profile')
 @login_required
 def profile():
-    # Get user's builds - current_user is provided by Flask-Login
-    user_builds = current_user.builds.all()
+    # Get user's builds a page at a time - current_user is the cached principal provided by Flask-Login
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        after = decode_keyset_cursor(cursor)
+        if after is None:
+            return redirect(url_for('auth.profile'))
+    user_builds, next_cursor = get_user_builds_page(current_user.id, after)
     
-    return render_template('auth/profile.html', user=current_user, builds=user_builds)
\ No newline at end of file
+    return render_template('auth/profile.html', user=current_user, builds=user_builds, next_cursor=next_cursor,
+                           first_page=after is None)
\ No newline at end of file
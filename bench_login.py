@@ -0,0 +1,213 @@
+"""
+Login and shop latency during a credential-stuffing burst.
+
+Measures page and login latency at rest, then again while a burst of concurrent
+failed logins (random accounts, rotating X-Forwarded-For addresses) hits
+/auth/login. With hashing in a bounded pool and the per-IP/per-account token
+buckets of password_hashing.py, most of the burst is answered 429 without hashing
+and the shop and genuine logins keep their latency.
+
+Usage:
+    python bench_login.py --url http://127.0.0.1:5000
+    python bench_login.py --start                    # launch with gunicorn.conf.py, measure, stop
+    python bench_login.py --start --attackers 64 --duration 20
+"""
+import argparse
+import collections
+import http.cookiejar
+import os
+import random
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SHOP_PATHS = ['/', '/builds/prebuilt', '/builder/step/cpu', '/faq']
+GENUINE_USERS = 20
+PASSWORD = 'bench-password-1'
+_CSRF_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class Client:
+    """Cookie-keeping HTTP client that appears to come from one IP address."""
+
+    def __init__(self, base_url, ip):
+        self.base_url = base_url
+        self.ip = ip
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+        self.csrf_token = None
+
+    def request(self, path, data=None):
+        """Return (status, seconds)."""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, headers={'X-Forwarded-For': self.ip})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                text = response.read().decode('utf-8', 'replace')
+                status = response.status
+        except urllib.error.HTTPError as e:
+            text = e.read().decode('utf-8', 'replace')
+            status = e.code
+        except OSError:
+            return 'error', time.perf_counter() - started
+        match = _CSRF_PATTERN.search(text)
+        if match:
+            self.csrf_token = match.group(1)
+        return status, time.perf_counter() - started
+
+    def post_form(self, path, fields):
+        if self.csrf_token is None:
+            self.request(path)
+        return self.request(path, dict(fields, csrf_token=self.csrf_token or ''))
+
+    def login(self, email, password):
+        status, seconds = self.post_form('/auth/login', {'email': email, 'password': password})
+        if status == 302:
+            # Logged in; log out again so the next attempt goes through the form
+            self.request('/auth/logout')
+        return status, seconds
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _random_ip():
+    return f'10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}'
+
+
+def register_genuine_users(base_url):
+    emails = []
+    for i in range(GENUINE_USERS):
+        suffix = f'{os.getpid()}-{i}'
+        client = Client(base_url, _random_ip())
+        client.post_form('/auth/register', {
+            'username': f'bench-{suffix}', 'email': f'bench-{suffix}@example.com',
+            'password': PASSWORD, 'confirm_password': PASSWORD,
+        })
+        emails.append(f'bench-{suffix}@example.com')
+    return emails
+
+
+def measure(base_url, emails, duration, stop):
+    """Shop page and genuine login latency until duration passes or stop is set."""
+    results = {'shop': [], 'login': [], 'statuses': collections.Counter()}
+    shop = Client(base_url, '192.0.2.1')
+    deadline = time.time() + duration
+    turn = 0
+    while time.time() < deadline and not stop.is_set():
+        status, seconds = shop.request(SHOP_PATHS[turn % len(SHOP_PATHS)])
+        results['shop'].append(seconds)
+        results['statuses'][f'shop {status}'] += 1
+        if turn % 4 == 0:
+            # Each genuine user logs in from their own address, as real customers do
+            email = emails[(turn // 4) % len(emails)]
+            status, seconds = Client(base_url, f'192.0.2.{10 + emails.index(email)}').login(email, PASSWORD)
+            results['login'].append(seconds)
+            results['statuses'][f'login {status}'] += 1
+        turn += 1
+        time.sleep(0.05)
+    return results
+
+
+def attack(base_url, stop, counter):
+    client = Client(base_url, _random_ip())
+    attempts = 0
+    while not stop.is_set():
+        if attempts % 20 == 0:
+            # Move to a fresh address every 20 attempts, like a botnet
+            client = Client(base_url, _random_ip())
+        status, _ = client.login(f'victim{random.randint(1, 500)}@example.com', f'guess{random.random()}')
+        counter[status] += 1
+        attempts += 1
+
+
+def _percentiles(samples):
+    if not samples:
+        return 'no samples'
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f'p50 {statistics.median(samples) * 1000:7.1f} ms   p99 {p99 * 1000:7.1f} ms   n={len(samples)}'
+
+
+def run(base_url, attackers, duration):
+    emails = register_genuine_users(base_url)
+
+    print('At rest:')
+    baseline = measure(base_url, emails, duration, threading.Event())
+    print(f"  shop   {_percentiles(baseline['shop'])}")
+    print(f"  login  {_percentiles(baseline['login'])}")
+
+    stop = threading.Event()
+    burst = collections.Counter()
+    threads = [threading.Thread(target=attack, args=(base_url, stop, burst), daemon=True) for _ in range(attackers)]
+    for thread in threads:
+        thread.start()
+    try:
+        loaded = measure(base_url, emails, duration, stop)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=30)
+
+    print(f'During a burst from {attackers} concurrent attackers:')
+    print(f"  shop   {_percentiles(loaded['shop'])}")
+    print(f"  login  {_percentiles(loaded['login'])}")
+    print(f"  genuine responses: {dict(loaded['statuses'])}")
+    print(f"  attacker responses: {dict(burst)}  ({sum(burst.values()) / duration:.0f} attempts/s)")
+
+
+def start_and_run(workers, port, attackers, duration):
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'rigfreaks-bench.db'))
+    env['WEB_CONCURRENCY'] = str(workers)
+    env['GUNICORN_BIND'] = f'127.0.0.1:{port}'
+
+    # Login needs the user table, so make sure the schema exists
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'init-db'], cwd=ROOT, env=env, check=True)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py'], cwd=ROOT, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.time() + 30
+        while Client(base_url, '127.0.0.1').request('/faq')[0] != 200:
+            if server.poll() is not None or time.time() > deadline:
+                sys.exit("gunicorn did not start")
+            time.sleep(0.5)
+        run(base_url, attackers, duration)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server')
+    parser.add_argument('--start', action='store_true', help='start gunicorn with gunicorn.conf.py and measure it')
+    parser.add_argument('--workers', type=int, default=2, help='workers to start with --start')
+    parser.add_argument('--port', type=int, default=5056, help='port to bind with --start')
+    parser.add_argument('--attackers', type=int, default=32, help='concurrent attacking clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to measure at rest and under the burst')
+    args = parser.parse_args()
+
+    if args.start:
+        start_and_run(args.workers, args.port, args.attackers, args.duration)
+    elif args.url:
+        run(args.url.rstrip('/'), args.attackers, args.duration)
+    else:
+        parser.error('either --url or --start is required')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Per-worker memory report for a running gunicorn server.
+
+Reports each worker's unique set size (USS: memory private to that process) and
+its RSS, read from /proc/<pid>/smaps_rollup (Linux only). Lower USS means more
+memory is shared copy-on-write with the master, so more workers fit on a box.
+
+Usage:
+    python bench_memory.py --pid <gunicorn master pid>
+    python bench_memory.py --start                 # launch with gunicorn.conf.py, measure, stop
+    GUNICORN_PRELOAD=0 python bench_memory.py --start   # compare without pre-fork warming
+    python bench_memory.py --start --settle 310    # again after serving traffic for 5+ minutes
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Pages requested before measuring so each worker has served real traffic
+WARMUP_PATHS = ['/', '/builder/step-by-step', '/builder/step/cpu', '/select/cpu', '/faq']
+
+
+def read_memory(pid):
+    """Return (uss_kb, rss_kb) for a process."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':'):
+                fields[parts[0][:-1]] = int(parts[1])
+    uss = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return uss, fields.get('Rss', 0)
+
+
+def worker_pids(master_pid):
+    """PIDs of the direct children of the gunicorn master."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def report(master_pid):
+    pids = worker_pids(master_pid)
+    if not pids:
+        sys.exit(f"No workers found for gunicorn master {master_pid}")
+
+    master_uss, master_rss = read_memory(master_pid)
+    print(f"{'process':>10} {'pid':>8} {'USS MB':>9} {'RSS MB':>9}")
+    print(f"{'master':>10} {master_pid:>8} {master_uss / 1024:>9.1f} {master_rss / 1024:>9.1f}")
+    total_uss = 0
+    for pid in pids:
+        uss, rss = read_memory(pid)
+        total_uss += uss
+        print(f"{'worker':>10} {pid:>8} {uss / 1024:>9.1f} {rss / 1024:>9.1f}")
+    print(f"\nMean unique memory per worker: {total_uss / len(pids) / 1024:.1f} MB across {len(pids)} workers")
+
+
+def start_and_measure(workers, port, settle=0):
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'rigfreaks-bench.db'))
+    env['WEB_CONCURRENCY'] = str(workers)
+    env['GUNICORN_BIND'] = f'127.0.0.1:{port}'
+
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py'], cwd=ROOT, env=env)
+    try:
+        deadline = time.time() + 30
+        while len(worker_pids(server.pid)) < workers or not _responds(port):
+            if server.poll() is not None or time.time() > deadline:
+                sys.exit("gunicorn did not start")
+            time.sleep(0.5)
+
+        _warm_up(port, workers)
+        print(f"preload_app={'off' if env.get('GUNICORN_PRELOAD') == '0' else 'on'}")
+        report(server.pid)
+
+        if settle:
+            # Keep serving traffic, so anything done lazily after a while (e.g. cache reloads) shows up
+            deadline = time.time() + settle
+            while time.time() < deadline:
+                _warm_up(port, workers)
+                time.sleep(5)
+            print(f"\nAfter {settle}s of traffic:")
+            report(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def _warm_up(port, workers):
+    # Spread requests over the workers
+    for _ in range(workers * 3):
+        for path in WARMUP_PATHS:
+            _get(port, path)
+
+
+def _get(port, path):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=10) as response:
+            response.read()
+        return True
+    except OSError:
+        return False
+
+
+def _responds(port):
+    return _get(port, '/faq')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pid', type=int, help='PID of a running gunicorn master')
+    parser.add_argument('--start', action='store_true', help='start gunicorn with gunicorn.conf.py and measure it')
+    parser.add_argument('--workers', type=int, default=4, help='workers to start with --start')
+    parser.add_argument('--port', type=int, default=5055, help='port to bind with --start')
+    parser.add_argument('--settle', type=int, default=0, help='with --start, measure again after this many seconds of traffic')
+    args = parser.parse_args()
+
+    if args.start:
+        start_and_measure(args.workers, args.port, args.settle)
+    elif args.pid:
+        report(args.pid)
+    else:
+        parser.error('either --pid or --start is required')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Startup profiling and import-time benchmark for the RigFreaks application.
+
+Imports the application module in fresh interpreters and reports how long the
+import takes (the bulk of gunicorn worker boot time). With --profile it also
+runs Python's -X importtime and lists the most expensive modules.
+
+Usage:
+    python bench_startup.py                  # median import time of `app` over 5 runs
+    python bench_startup.py --module main    # import the gunicorn entry module
+    python bench_startup.py --profile        # per-module import cost
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run(args, env):
+    return subprocess.run(
+        [sys.executable] + args,
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+def _environment():
+    env = dict(os.environ)
+    # The app refuses to start without a database URL; a throwaway SQLite file is enough to import it
+    env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'rigfreaks-bench.db'))
+    return env
+
+
+def measure_import(module, repeat):
+    """Median wall time in milliseconds to import a module, excluding interpreter startup."""
+    env = _environment()
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; "
+        "print((time.perf_counter() - start) * 1000)"
+    )
+    timings = []
+    for _ in range(repeat):
+        result = _run(['-c', code], env)
+        if result.returncode != 0:
+            sys.exit(f"Importing {module} failed:\n{result.stderr}")
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings), timings
+
+
+def profile_imports(module):
+    """Per-module import cost as (self_us, cumulative_us, name) tuples."""
+    result = _run(['-X', 'importtime', '-c', f'import {module}'], _environment())
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app', help='module to import (default: app)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh-interpreter runs')
+    parser.add_argument('--profile', action='store_true', help='report per-module import cost')
+    parser.add_argument('--top', type=int, default=25, help='number of modules to list with --profile')
+    args = parser.parse_args()
+
+    median, timings = measure_import(args.module, args.repeat)
+    print(f"import {args.module}: median {median:.1f} ms over {len(timings)} runs "
+          f"(min {min(timings):.1f} ms, max {max(timings):.1f} ms)")
+
+    if args.profile:
+        rows = profile_imports(args.module)
+        print(f"\nTop {args.top} modules by cumulative import time:")
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for self_us, cumulative_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+            print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Denormalized summaries for saved builds and prebuilt configurations.
+
+List and card views need component names, thumbnails, the performance tier,
+the compatibility flag and the current price of a build, and the prebuilt product
+page its benchmark scores. Resolving those means
+a catalog lookup per component plus compatibility and benchmark work, so the
+result is stored on the row (summary / summary_version columns) when the build
+is saved and refreshed in bulk whenever the catalog version changes. Pages never
+compute summaries: until the refresh has run they show the stored one, and rows
+without one get a placeholder made from catalog lookups alone.
+
+Refresh stale rows with `flask --app main refresh-summaries` (also part of
+`flask --app main init-db`).
+"""
+import json
+import logging
+from sqlalchemy import or_
+from models import db, Build, PreBuiltConfig
+from utils import (load_component_data, get_component_by_id, get_builder_state, get_catalog_version,
+                   calculate_total_price, BUILD_CATEGORIES)
+
+SUMMARY_MODELS = (Build, PreBuiltConfig)
+REFRESH_BATCH_SIZE = 500
+
+
+def get_row_config(row):
+    """Component configuration ({category: id}) of a Build or PreBuiltConfig row"""
+    config = {}
+    for category in BUILD_CATEGORIES:
+        component_id = getattr(row, f'{category}_id')
+        if component_id:
+            config[category] = component_id
+    return config
+
+
+def _summary_components(config):
+    components = load_component_data()
+    summary_components = {}
+    for category, component_id in config.items():
+        component = get_component_by_id(components, category, component_id)
+        summary_components[category] = {
+            'id': component_id,
+            'name': component['name'] if component else component_id,
+            'image_url': component.get('image_url') if component else None,
+        }
+    return summary_components
+
+
+def compute_summary(config):
+    """Summary of a configuration against the current catalog"""
+    state = get_builder_state(config)
+    return {
+        'components': _summary_components(config),
+        'price': state['total'],
+        'compatible': state['compatible'],
+        'issue_count': len(state['issues']),
+        'tier': state['performance']['tier'] if state['performance'] else None,
+        'performance': state['performance'],
+    }
+
+
+def placeholder_summary(config):
+    """
+    Summary from catalog lookups alone, for rows without a stored one. Compatibility
+    and tier are unknown (None) until the refresh command has run.
+    """
+    return {
+        'components': _summary_components(config),
+        'price': calculate_total_price(config),
+        'compatible': None,
+        'issue_count': 0,
+        'tier': None,
+        'performance': None,
+    }
+
+
+def summary_columns(config, label):
+    """
+    summary / summary_version column values for a configuration. If computing the
+    summary fails the error is logged and both are None, leaving the row for the
+    refresh command to retry rather than failing the save.
+    """
+    try:
+        summary = compute_summary(config)
+    except Exception:
+        logging.exception(f"Could not compute the summary of {label}")
+        return {'summary': None, 'summary_version': None}
+    return {'summary': json.dumps(summary), 'summary_version': get_catalog_version()}
+
+
+def refresh_summary(row):
+    """Recompute and store the summary of a row (the caller commits)"""
+    label = f"{row.__tablename__} {row.id or '(new)'}"
+    for column, value in summary_columns(get_row_config(row), label).items():
+        setattr(row, column, value)
+
+
+def get_summaries(rows):
+    """
+    {row.id: summary} for rows about to be rendered, without computing any. Stored
+    summaries are used even if the catalog changed since (refresh-summaries brings
+    them up to date); rows without one get placeholder_summary().
+    """
+    summaries = {}
+    for row in rows:
+        if row.summary:
+            summaries[row.id] = json.loads(row.summary)
+        else:
+            summaries[row.id] = placeholder_summary(get_row_config(row))
+    return summaries
+
+
+def refresh_stale_summaries(batch_size=REFRESH_BATCH_SIZE):
+    """
+    Recompute summaries built against an older catalog version, in batches of
+    batch_size rows per transaction. Batches walk the table by id, so each one
+    starts where the last stopped, and a row that fails to refresh is logged and
+    left stale for the next run instead of being fetched again.
+    Returns {table name: rows refreshed}.
+    """
+    version = get_catalog_version()
+    columns = [f'{category}_id' for category in BUILD_CATEGORIES]
+    refreshed = {}
+
+    for model in SUMMARY_MODELS:
+        stale = or_(model.summary_version.is_(None), model.summary_version != version)
+        # A catalog refresh is not a user edit, so keep updated_at where the model has one
+        keep_updated_at = hasattr(model, 'updated_at')
+        selected = [model.id] + [getattr(model, column) for column in columns]
+        if keep_updated_at:
+            selected.append(model.updated_at)
+        count = 0
+        last_id = 0
+        while True:
+            rows = db.session.query(*selected).filter(stale, model.id > last_id) \
+                .order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            mappings = []
+            for row in rows:
+                config = {category: getattr(row, f'{category}_id')
+                          for category in BUILD_CATEGORIES if getattr(row, f'{category}_id')}
+                try:
+                    summary = compute_summary(config)
+                except Exception:
+                    logging.exception(f"Could not refresh the summary of {model.__tablename__} {row.id}")
+                    continue
+                mapping = {
+                    'id': row.id,
+                    'summary': json.dumps(summary),
+                    'summary_version': version,
+                }
+                if keep_updated_at:
+                    mapping['updated_at'] = row.updated_at
+                mappings.append(mapping)
+            if mappings:
+                db.session.bulk_update_mappings(model, mappings)
+            db.session.commit()
+            count += len(mappings)
+
+        refreshed[model.__tablename__] = count
+        if count:
+            logging.info(f"Refreshed {count} {model.__tablename__} summaries for catalog {version}")
+    return refreshed
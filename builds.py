@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session, jsonify
+from sqlalchemy import tuple_
 from models import db, Build, PreBuiltConfig
-from utils import load_component_data, check_compatibility, calculate_total_price
+from build_summaries import refresh_summary, get_summaries
+from utils import load_component_data, check_compatibility, calculate_total_price, decode_build_code, encode_keyset_cursor, decode_keyset_cursor
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, BooleanField, SubmitField
 from wtforms.validators import DataRequired, Length
@@ -46,6 +48,9 @@ def save_build():
         for category, component_id in session['pc_config'].items():
             setattr(new_build, f'{category}_id', component_id)
         
+        # Denormalized names, thumbnails, tier and price for the list views
+        refresh_summary(new_build)
+        
         # Save to database
         db.session.add(new_build)
         db.session.commit()
@@ -55,16 +60,82 @@ def save_build():
     
     return render_template('builds/save_build.html', form=form)
 
+# Public gallery page size (?limit= is clamped to MAX_PAGE_SIZE)
+GALLERY_PAGE_SIZE = 12
+GALLERY_MAX_PAGE_SIZE = 48
+
+# The gallery shows the newest few of the user's own builds; the profile pages through all of them
+USER_BUILDS_PREVIEW = 6
+PROFILE_PAGE_SIZE = 20
+
+def _keyset_page(query, after, limit):
+    """
+    Keyset page of query, newest first, ordered by (created_at, id) so ties on
+    created_at are stable. Returns (builds, next_cursor); next_cursor is None on
+    the last page.
+    """
+    if after is not None:
+        query = query.filter(tuple_(Build.created_at, Build.id) < after)
+    
+    # Fetch one extra row to know whether there is another page
+    builds = query.order_by(Build.created_at.desc(), Build.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(builds) > limit:
+        builds = builds[:limit]
+        next_cursor = encode_keyset_cursor(builds[-1])
+    return builds, next_cursor
+
+def get_public_builds_page(after=None, limit=GALLERY_PAGE_SIZE):
+    """Keyset page of public builds; see _keyset_page."""
+    return _keyset_page(Build.query.filter_by(is_public=True), after, limit)
+
+def get_user_builds_page(user_id, after=None, limit=PROFILE_PAGE_SIZE):
+    """Keyset page of one user's builds, public or not; see _keyset_page."""
+    return _keyset_page(Build.query.filter_by(user_id=user_id), after, limit)
+
 @builds_bp.route('/builds')
 def list_builds():
-    # Get public builds and user's builds if logged in
-    public_builds = Build.query.filter_by(is_public=True).order_by(Build.created_at.desc()).all()
+    wants_json = request.args.get('format') == 'json'
+    limit = min(max(request.args.get('limit', GALLERY_PAGE_SIZE, type=int), 1), GALLERY_MAX_PAGE_SIZE)
     
-    user_builds = []
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        after = decode_keyset_cursor(cursor)
+        if after is None:
+            if wants_json:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            return redirect(url_for('builds.list_builds'))
+    
+    public_builds, next_cursor = get_public_builds_page(after, limit)
+    summaries = get_summaries(public_builds)
+    
+    # Infinite-scroll variant: the next page of cards plus the cursor after it
+    if wants_json:
+        return jsonify({
+            'builds': [{
+                'id': build.id,
+                'name': build.name,
+                'description': build.description,
+                'total_price': build.total_price,
+                'created_at': build.created_at.isoformat(),
+                'summary': summaries[build.id],
+                'url': url_for('builds.view_build', build_id=build.id)
+            } for build in public_builds],
+            'html': render_template('fragments/public_build_cards.html', builds=public_builds, summaries=summaries),
+            'next_cursor': next_cursor
+        })
+    
+    # Newest few of the user's builds if logged in; the rest are on the profile
+    user_builds, more_user_builds = [], False
     if 'user_id' in session:
-        user_builds = Build.query.filter_by(user_id=session['user_id']).order_by(Build.created_at.desc()).all()
+        user_builds, user_cursor = get_user_builds_page(session['user_id'], limit=USER_BUILDS_PREVIEW)
+        more_user_builds = user_cursor is not None
+        summaries.update(get_summaries(user_builds))
     
-    return render_template('builds/list_builds.html', public_builds=public_builds, user_builds=user_builds)
+    return render_template('builds/list_builds.html', public_builds=public_builds, user_builds=user_builds,
+                           more_user_builds=more_user_builds, summaries=summaries, next_cursor=next_cursor,
+                           page_size=limit)
 
 @builds_bp.route('/build/<int:build_id>')
 def view_build(build_id):
@@ -102,7 +173,21 @@ def view_build(build_id):
     )
 
 @builds_bp.route('/build/<int:build_id>/load')
-def load_build(build_id):
+@builds_bp.route('/share/<code>/load')
+def load_build(build_id=None, code=None):
+    if code:
+        # Build codes carry the full configuration, so they load without a DB lookup
+        config = decode_build_code(code)
+        if config is None:
+            flash('This build link is invalid or was created for an older catalog.', 'danger')
+            return redirect(url_for('builds.list_builds'))
+        
+        session['pc_config'] = config
+        session.modified = True
+        
+        flash('Shared build has been loaded.', 'success')
+        return redirect(url_for('builder'))
+    
     # Get the build
     build = Build.query.get_or_404(build_id)
     
@@ -152,7 +237,7 @@ def prebuilt_configs():
             categories[config.category] = []
         categories[config.category].append(config)
     
-    return render_template('builds/prebuilt.html', categories=categories)
+    return render_template('builds/prebuilt.html', categories=categories, summaries=get_summaries(configs))
 
 @builds_bp.route('/prebuilt/<int:config_id>/load')
 def load_prebuilt(config_id):
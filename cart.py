@@ -1,20 +1,27 @@
 import os
 import json
-import stripe
+import logging
 import uuid
-from flask import Blueprint, render_template, session, request, redirect, url_for, flash, jsonify
+from datetime import datetime, timedelta
+from flask import Blueprint, render_template, session, request, redirect, url_for, flash, jsonify, current_app
 from app import db
 from werkzeug.utils import secure_filename
 from models import User, Build, Order, Cart, OrderStatus
 from utils import load_component_data, calculate_total_price, check_compatibility
 from forms import CheckoutForm, ShippingForm
-
-# Initialize Stripe with the API key
-stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+from stripe_gateway import (create_checkout_session, get_open_checkout_session, expire_checkout_session,
+                            construct_webhook_event)
+from webhook_queue import enqueue_webhook_event, notify_webhook_worker
+from payment_state import get_checkout_state, is_paid
+from stripe_catalog import build_line_items
+from inventory import OutOfStock, reserve_stock, release_order_reservations, is_in_stock
 
 # Get domain from environment variables
 DOMAIN = os.environ.get('REPLIT_DEV_DOMAIN', os.environ.get('REPLIT_DOMAINS', 'localhost:5000').split(',')[0])
 
+# Anonymous carts untouched for this long are deleted by purge_abandoned_carts
+ANONYMOUS_CART_MAX_AGE_DAYS = int(os.environ.get('ANONYMOUS_CART_MAX_AGE_DAYS', 30))
+
 # Create blueprint
 cart_bp = Blueprint('cart', __name__)
 
@@ -24,8 +31,8 @@ def generate_order_number():
     return 'ORD-' + str(uuid.uuid4())[:8].upper()
 
 
-def get_or_create_cart(session_id=None):
-    """Get the current cart for the user or create a new one."""
+def _cart_owner():
+    """(user_id, is_authenticated) for the current visitor."""
     # Import current_user here to avoid circular imports
     from flask_login import current_user
 
@@ -39,36 +46,76 @@ def get_or_create_cart(session_id=None):
     except:
         # If there's any issue with current_user, fall back to session
         pass
+    return user_id, is_authenticated
+
+
+def get_cart():
+    """Get the current cart without writing to the database.
     
+    Visitors who never added anything get an empty, unsaved Cart (cart.id is None),
+    so browsing /cart or finishing a payment costs no INSERT. The row is created by
+    get_or_create_cart on the first real mutation.
+    """
+    user_id, is_authenticated = _cart_owner()
+    
+    cart = None
     if is_authenticated:
-        # Check if user has an existing cart
         cart = Cart.query.filter_by(user_id=user_id).first()
-    else:
-        # For non-logged-in users, use session ID to track cart
-        if not session_id:
+    elif session.get('cart_session_id'):
+        cart = Cart.query.filter_by(session_id=session['cart_session_id']).first()
+    
+    if not cart:
+        cart = Cart(user_id=user_id, quantity=1, total_price=0.0)
+    return cart
+
+
+def get_or_create_cart():
+    """Get the current cart, adding a new one to the session if needed.
+    
+    Only call this when the cart is about to change; the caller's commit persists
+    the new row together with the change.
+    """
+    cart = get_cart()
+    if cart.id is None:
+        user_id, is_authenticated = _cart_owner()
+        if not is_authenticated:
+            # For non-logged-in users, use session ID to track cart
             session_id = session.get('cart_session_id')
             if not session_id:
                 session_id = str(uuid.uuid4())
                 session['cart_session_id'] = session_id
-        
-        cart = Cart.query.filter_by(session_id=session_id).first()
-    
-    # If no cart exists, create a new one
-    if not cart:
-        cart = Cart(
-            user_id=user_id,
-            session_id=None if is_authenticated else session_id
-        )
+            cart.session_id = session_id
         db.session.add(cart)
-        db.session.commit()
-    
     return cart
 
 
+def purge_abandoned_carts(max_age_days=ANONYMOUS_CART_MAX_AGE_DAYS, batch_size=1000):
+    """Delete anonymous carts not updated for max_age_days, batch_size rows per transaction.
+    
+    Short transactions keep row locks brief so checkout traffic is not blocked while
+    a large backlog is purged. Returns the number of carts deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    deleted = 0
+    while True:
+        ids = [row.id for row in db.session.query(Cart.id)
+               .filter(Cart.user_id.is_(None), Cart.updated_at < cutoff)
+               .order_by(Cart.updated_at)
+               .limit(batch_size)]
+        if not ids:
+            break
+        # The conditions are repeated so a cart claimed by a login or updated since the
+        # SELECT (read without locks) is left alone
+        deleted += Cart.query.filter(Cart.id.in_(ids), Cart.user_id.is_(None), Cart.updated_at < cutoff) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+    return deleted
+
+
 @cart_bp.route('/cart')
 def view_cart():
     """Display the shopping cart."""
-    cart = get_or_create_cart()
+    cart = get_cart()
     build_details = None
     
     if cart and cart.build_id:
@@ -124,6 +171,12 @@ def add_to_cart():
         flash(f"Cannot add to cart: Missing required components: {missing_list}", "warning")
         return redirect(url_for('builder'))
     
+    out_of_stock = [category for category, component_id in config.items() if not is_in_stock(category, component_id)]
+    if out_of_stock:
+        sold_out_list = ", ".join([category.replace('_', ' ').capitalize() for category in out_of_stock])
+        flash(f"Cannot add to cart: Out of stock: {sold_out_list}", "warning")
+        return redirect(url_for('builder'))
+    
     # Get or create cart
     cart = get_or_create_cart()
     
@@ -150,9 +203,9 @@ def add_to_cart():
 @cart_bp.route('/cart/remove', methods=['POST'])
 def remove_from_cart():
     """Remove item from cart."""
-    cart = get_or_create_cart()
+    cart = get_cart()
     
-    if cart:
+    if cart.id is not None:
         cart.build_id = None
         cart.build_config = None
         cart.quantity = 0
@@ -166,9 +219,9 @@ def remove_from_cart():
 @cart_bp.route('/cart/update', methods=['POST'])
 def update_cart():
     """Update cart items."""
-    cart = get_or_create_cart()
+    cart = get_cart()
     
-    if cart:
+    if cart.id is not None:
         quantity = int(request.form.get('quantity', 1))
         if quantity < 1:
             quantity = 1
@@ -186,7 +239,7 @@ def update_cart():
 @cart_bp.route('/checkout', methods=['GET', 'POST'])
 def checkout():
     """Checkout process."""
-    cart = get_or_create_cart()
+    cart = get_cart()
     
     # If cart is empty, redirect to cart page
     if not cart or not cart.build_config or cart.total_price <= 0:
@@ -244,7 +297,16 @@ def checkout():
         elif cart.build_config:
             order.set_build_config(cart.get_build_config())
         
+        # Hold stock for the build in the same transaction as the order (see inventory.py)
         db.session.add(order)
+        db.session.flush()
+        try:
+            reserve_stock(order, build_config, cart.quantity)
+        except OutOfStock as e:
+            db.session.rollback()
+            flash(f"Sorry, the {e.category.replace('_', ' ')} in your build just sold out. "
+                  f"Please choose another one.", "warning")
+            return redirect(url_for('cart.view_cart'))
         db.session.commit()
         
         # Store order ID in session for the next step
@@ -269,35 +331,29 @@ def payment():
         flash("Order not found. Please try again.", "danger")
         return redirect(url_for('cart.view_cart'))
     
+    # Canceled orders have given their stock back
+    if order.status != OrderStatus.PENDING.value:
+        session.pop('current_order_id', None)
+        flash("This order is no longer awaiting payment. Please check out again.", "warning")
+        return redirect(url_for('cart.view_cart'))
+    
+    # Reloading /payment sends the customer back to the session they already started
+    try:
+        open_session = get_open_checkout_session(order)
+    except Exception as e:
+        logging.warning(f"Could not look up checkout session {order.payment_id}: {e}")
+        open_session = None
+    if open_session:
+        return redirect(open_session.url)
+    
     # Create a description of the order
     components_info = order.get_build_config()
     line_items = []
     
-    # If there's a build configuration, create line items for the components
+    # If there's a build configuration, list its components, by Stripe price id where
+    # they are mirrored in Stripe (see stripe_catalog.py)
     if components_info:
-        # Load components data
-        components_data = load_component_data()
-        
-        # Add each component as a line item
-        for category, component_id in components_info.items():
-            if not component_id:
-                continue
-                
-            # Find the component details
-            for comp in components_data.get(category, []):
-                if comp['id'] == component_id:
-                    line_items.append({
-                        'price_data': {
-                            'currency': 'usd',
-                            'product_data': {
-                                'name': f"{category.replace('_', ' ').title()}: {comp['name']}",
-                                'description': comp.get('description', ''),
-                            },
-                            'unit_amount': int(float(comp['price']) * 100),  # Convert to cents
-                        },
-                        'quantity': 1,
-                    })
-                    break
+        line_items = build_line_items(components_info)
     else:
         # If no components, use the total amount as a single line item
         line_items.append({
@@ -323,7 +379,7 @@ def payment():
         if not cancel_url.startswith('https://'):
             cancel_url = f"https://{cancel_url}"
         
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = create_checkout_session(order, dict(
             payment_method_types=['card'],
             line_items=line_items,
             mode='payment',
@@ -380,7 +436,7 @@ def payment():
                     }
                 },
             ],
-        )
+        ))
         
         # Store the checkout session ID in the order
         order.payment_id = checkout_session.id
@@ -403,43 +459,23 @@ def payment_success():
         return redirect(url_for('cart.view_cart'))
     
     try:
-        # Retrieve the checkout session to verify payment
-        checkout_session = stripe.checkout.Session.retrieve(session_id)
+        # Webhook-fed state first; Stripe is only asked if the webhook hasn't landed yet.
+        # The order itself is updated by the webhook queue worker, not here.
+        state = get_checkout_state(session_id)
         
-        # Find the order with this session id
-        order = Order.query.filter_by(payment_id=session_id).first()
+        order = None
+        if state is not None and state.order_id:
+            order = Order.query.get(state.order_id)
         if not order:
-            # If order is not found by session ID, try looking up by client reference ID
-            if checkout_session.client_reference_id:
-                order = Order.query.get(int(checkout_session.client_reference_id))
+            order = Order.query.filter_by(payment_id=session_id).first()
         
         if not order:
             flash("Order not found. Please contact support.", "danger")
             return redirect(url_for('index'))
         
-        # Update order status
-        order.status = OrderStatus.PAID.value
-        
-        # If we have shipping details from Stripe, update order
-        if hasattr(checkout_session, 'shipping') and checkout_session.shipping:
-            shipping = checkout_session.shipping
-            if shipping.address:
-                order.address_line1 = shipping.address.line1
-                if hasattr(shipping.address, 'line2'):
-                    order.address_line2 = shipping.address.line2
-                order.city = shipping.address.city
-                order.state = shipping.address.state
-                order.postal_code = shipping.address.postal_code
-                order.country = shipping.address.country
-            
-            if shipping.name:
-                order.full_name = shipping.name
-        
-        db.session.commit()
-        
         # Clear the cart and session data
-        cart = get_or_create_cart()
-        if cart:
+        cart = get_cart()
+        if cart.id is not None:
             cart.build_id = None
             cart.build_config = None
             cart.quantity = 0
@@ -452,7 +488,7 @@ def payment_success():
         if 'pc_config' in session:
             session['pc_config'] = {}
         
-        return render_template('cart/payment_success.html', order=order)
+        return render_template('cart/payment_success.html', order=order, payment_confirmed=is_paid(state))
     
     except Exception as e:
         flash(f"Error processing payment confirmation: {str(e)}", "danger")
@@ -462,10 +498,35 @@ def payment_success():
 @cart_bp.route('/payment/cancel')
 def payment_cancel():
     """Payment canceled handler."""
+    # Give the order's stock back, unless its session can't be closed (it may have just been paid)
+    order_id = session.get('current_order_id')
+    order = Order.query.get(order_id) if order_id else None
+    if order and order.status == OrderStatus.PENDING.value:
+        try:
+            if order.payment_id and order.payment_id.startswith('cs_'):
+                expire_checkout_session(order.payment_id)
+        except Exception as e:
+            logging.warning(f"Could not expire checkout session {order.payment_id}: {e}")
+        else:
+            release_order_reservations(order.id)
+            order.status = OrderStatus.CANCELED.value
+            db.session.commit()
+            session.pop('current_order_id', None)
+    
     flash("Payment was canceled. Your order has not been placed.", "warning")
     return redirect(url_for('cart.view_cart'))
 
 
+def _is_webhook_event(event):
+    """True if event has the shape the webhook queue relies on (valid JSON can still be a list or a string)."""
+    if not isinstance(event, dict) or not event.get('id') or not event.get('type'):
+        return False
+    if not isinstance(event['id'], str) or not isinstance(event['type'], str):
+        return False
+    data = event.get('data', {})
+    return isinstance(data, dict) and isinstance(data.get('object', {}), dict)
+
+
 @cart_bp.route('/webhook', methods=['POST'])
 def stripe_webhook():
     """Handle Stripe webhook events."""
@@ -482,10 +543,9 @@ def stripe_webhook():
             return jsonify({'error': 'Invalid payload'}), 400
     else:
         try:
-            # Verify webhook signature
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, webhook_secret
-            )
+            # Verify webhook signature, then queue the plain JSON event
+            construct_webhook_event(payload, sig_header, webhook_secret)
+            event = json.loads(payload)
         except ValueError as e:
             # Invalid payload
             return jsonify({'error': 'Invalid payload'}), 400
@@ -493,68 +553,12 @@ def stripe_webhook():
             # Invalid signature or other error
             return jsonify({'error': 'Invalid signature'}), 400
     
-    # Handle different event types
-    event_type = event['type']
+    if not _is_webhook_event(event):
+        return jsonify({'error': 'Invalid payload'}), 400
     
-    # Handle checkout.session.completed event
-    if event_type == 'checkout.session.completed':
-        session = event['data']['object']
-        
-        # Extract order information from session
-        client_ref = session.get('client_reference_id')
-        session_id = session.get('id')
-        
-        if client_ref:
-            try:
-                # Find the order either by client reference or session ID
-                order = Order.query.get(int(client_ref))
-                
-                if not order and session_id:
-                    order = Order.query.filter_by(payment_id=session_id).first()
-                    
-                if order:
-                    # Update order status
-                    order.status = OrderStatus.PAID.value
-                    
-                    # If payment method details are available, record them
-                    if 'payment_intent' in session:
-                        order.payment_id = session['payment_intent']
-                    
-                    # Update shipping information if available
-                    if 'shipping' in session and session['shipping']:
-                        shipping = session['shipping']
-                        if 'address' in shipping:
-                            addr = shipping['address']
-                            order.address_line1 = addr.get('line1', '')
-                            order.address_line2 = addr.get('line2', '')
-                            order.city = addr.get('city', '')
-                            order.state = addr.get('state', '')
-                            order.postal_code = addr.get('postal_code', '')
-                            order.country = addr.get('country', '')
-                            
-                        if 'name' in shipping:
-                            order.full_name = shipping['name']
-                    
-                    db.session.commit()
-                    
-                    # Log order completion
-                    print(f"Order {order.order_number} was paid successfully via webhook")
-            except Exception as e:
-                print(f"Error processing checkout session webhook: {str(e)}")
-    
-    # Also handle the payment_intent.succeeded event for backward compatibility
-    elif event_type == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        order_id = payment_intent.get('metadata', {}).get('order_id')
-        
-        if order_id:
-            try:
-                order = Order.query.get(int(order_id))
-                if order:
-                    order.status = OrderStatus.PAID.value
-                    db.session.commit()
-                    print(f"Order {order.order_number} was updated via payment_intent webhook")
-            except Exception as e:
-                print(f"Error updating order in payment_intent webhook: {str(e)}")
+    # Store the event and acknowledge at once; it is applied by the background worker
+    # (see webhook_queue.py). Redeliveries of a stored event are no-ops.
+    if enqueue_webhook_event(event, payload):
+        notify_webhook_worker(current_app._get_current_object())
     
     return jsonify({'status': 'success'})
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+Query plan regression check for the hot queries.
+
+Builds a scratch database (a temporary SQLite file unless --database-url is
+given), applies the schema and migrations, seeds it with synthetic rows and
+EXPLAINs the ORM queries behind the hot pages. Exits non-zero if any query
+stops using its index.
+
+Usage:
+    python check_query_plans.py
+    python check_query_plans.py --database-url postgresql://.../scratch_db   # never a live database
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='scratch database to seed (default: temporary SQLite file)')
+    parser.add_argument('--rows', type=int, default=20000, help='rows to seed per table')
+    return parser.parse_args()
+
+
+args = parse_args()
+if args.database_url:
+    os.environ['DATABASE_URL'] = args.database_url
+else:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'query_plans.db')
+
+from sqlalchemy import or_, text, tuple_  # noqa: E402
+from app import app  # noqa: E402
+from models import db, User, Build, Cart, Order, ContactMessage, WebhookEvent, StockReservation  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from inventory import expired_reservation_orders  # noqa: E402
+
+
+def hot_queries():
+    """(description, ORM query, index the plan must use)"""
+    cursor = (datetime.utcnow() - timedelta(minutes=500), 500)
+    return [
+        ('public builds, first page (list_builds)',
+         Build.query.filter_by(is_public=True).order_by(Build.created_at.desc(), Build.id.desc()).limit(13),
+         'ix_build_is_public_created_at_id'),
+        ('public builds, after cursor (list_builds)',
+         Build.query.filter_by(is_public=True).filter(tuple_(Build.created_at, Build.id) < cursor)
+         .order_by(Build.created_at.desc(), Build.id.desc()).limit(13),
+         'ix_build_is_public_created_at_id'),
+        ("user's builds (list_builds, profile)",
+         Build.query.filter_by(user_id=1).order_by(Build.created_at.desc(), Build.id.desc()).limit(21),
+         'ix_build_user_id_created_at_id'),
+        ("user's builds, after cursor (profile)",
+         Build.query.filter_by(user_id=1).filter(tuple_(Build.created_at, Build.id) < cursor)
+         .order_by(Build.created_at.desc(), Build.id.desc()).limit(21),
+         'ix_build_user_id_created_at_id'),
+        ('anonymous cart (get_cart)',
+         Cart.query.filter_by(session_id='session-42'),
+         'ix_cart_session_id'),
+        ('user cart (get_cart)',
+         Cart.query.filter_by(user_id=1),
+         'ix_cart_user_id'),
+        ('abandoned anonymous carts (purge_abandoned_carts)',
+         db.session.query(Cart.id).filter(Cart.user_id.is_(None), Cart.updated_at < datetime.utcnow() - timedelta(days=30))
+         .order_by(Cart.updated_at).limit(1000),
+         'ix_cart_updated_at'),
+        ('order by payment id (payment_success, webhook worker)',
+         Order.query.filter_by(payment_id='cs_test_42'),
+         'ix_order_payment_id'),
+        ('orders containing a component (orders_with_component)',
+         Order.query.filter(Order.contains_component('gpu', 'gpu-042')),
+         'ix_order_build_config_gpu' if db.engine.dialect.name == 'sqlite' else 'ix_order_build_config'),
+        ('unread messages, after cursor (admin inbox)',
+         ContactMessage.query.filter_by(is_read=False).filter(tuple_(ContactMessage.created_at, ContactMessage.id) < cursor)
+         .order_by(ContactMessage.created_at.desc(), ContactMessage.id.desc()).limit(11),
+         'ix_contact_message_is_read_created_at_id'),
+        ('all messages, after cursor (admin inbox)',
+         ContactMessage.query.filter(tuple_(ContactMessage.created_at, ContactMessage.id) < cursor)
+         .order_by(ContactMessage.created_at.desc(), ContactMessage.id.desc()).limit(11),
+         'ix_contact_message_created_at_id'),
+        ('pending webhook batch (webhook worker)',
+         WebhookEvent.query.filter(WebhookEvent.status == 'pending',
+                                   or_(WebhookEvent.next_attempt_at.is_(None), WebhookEvent.next_attempt_at <= datetime.utcnow()))
+         .order_by(WebhookEvent.stripe_created, WebhookEvent.id).limit(100),
+         'ix_webhook_event_status_stripe_created_id'),
+        ("order's held stock (checkout cancel, webhook worker)",
+         StockReservation.query.filter_by(order_id=42, status='held'),
+         'ix_stock_reservation_order_id'),
+        ('expired reservations (release_expired_reservations)',
+         expired_reservation_orders(500),
+         'ix_stock_reservation_status_expires_at'),
+        ('orders in a date range (order export)',
+         Order.query.filter(Order.created_at >= datetime.utcnow() - timedelta(days=1), Order.created_at < datetime.utcnow())
+         .order_by(Order.created_at, Order.id),
+         'ix_order_created_at_id'),
+    ]
+
+
+def seed(rows):
+    now = datetime.utcnow()
+    random.seed(42)
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x'}
+        for i in range(1, 101)
+    ])
+    db.session.execute(Build.__table__.insert(), [
+        {'name': f'Build {i}', 'user_id': random.randint(1, 100), 'is_public': i % 10 == 0,
+         'created_at': now - timedelta(minutes=i), 'total_price': 1000.0}
+        for i in range(rows)
+    ])
+    db.session.execute(Cart.__table__.insert(), [
+        {'session_id': f'session-{i}' if i % 2 else None, 'user_id': None if i % 2 else (i % 100) + 1,
+         'created_at': now - timedelta(minutes=i), 'updated_at': now - timedelta(hours=i)}
+        for i in range(rows)
+    ])
+    db.session.execute(Order.__table__.insert(), [
+        {'order_number': f'ORD-{i:08d}', 'total_amount': 1000.0, 'full_name': 'Test', 'email': 't@example.com',
+         'address_line1': '1 Street', 'city': 'City', 'state': 'State', 'postal_code': '12345',
+         'country': 'GB', 'payment_id': f'cs_test_{i}', 'created_at': now - timedelta(minutes=i),
+         'build_config': {'cpu': f'cpu-{i % 50:03d}', 'gpu': f'gpu-{i % 200:03d}'}}
+        for i in range(rows)
+    ])
+    db.session.execute(ContactMessage.__table__.insert(), [
+        {'name': 'Customer', 'email': f'c{i}@example.com', 'message': 'Hello', 'is_read': i % 20 != 0,
+         'created_at': now - timedelta(minutes=i)}
+        for i in range(rows)
+    ])
+    db.session.execute(WebhookEvent.__table__.insert(), [
+        {'id': f'evt_{i}', 'type': 'checkout.session.completed', 'stripe_created': 1700000000 + i,
+         'payload': '{}', 'status': 'pending' if i % 100 == 0 else 'processed'}
+        for i in range(rows)
+    ])
+    db.session.execute(StockReservation.__table__.insert(), [
+        {'order_id': i + 1, 'category': 'gpu', 'component_id': f'gpu-{i % 200:03d}', 'quantity': 1,
+         'status': 'held' if i % 50 == 0 else 'committed',
+         'expires_at': now + timedelta(minutes=30) - timedelta(minutes=i), 'created_at': now - timedelta(minutes=i)}
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+def explain(query):
+    dialect = db.engine.dialect
+    statement = getattr(query, 'statement', query)  # ORM Query or Core select
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        return '\n'.join(row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+    return '\n'.join(row[0] for row in db.session.execute(text(f'EXPLAIN {sql}')))
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        upgrade()
+        if Build.query.count() == 0:
+            seed(args.rows)
+
+        if db.engine.dialect.name == 'sqlite':
+            db.session.execute(text('ANALYZE'))
+        elif db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('ANALYZE'))
+            # Small scratch tables can make a sequential scan look cheaper than it is in production
+            db.session.execute(text('SET enable_seqscan = off'))
+
+        failures = 0
+        for description, query, index_name in hot_queries():
+            plan = explain(query)
+            ok = index_name in plan
+            failures += not ok
+            print(f"[{'ok' if ok else 'REGRESSED'}] {description}: expected {index_name}")
+            if not ok:
+                print('    ' + plan.replace('\n', '\n    '))
+
+    if failures:
+        sys.exit(f"{failures} hot queries no longer use their index")
+    print("All hot queries use their indexes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Per-request SQL instrumentation.
+
+Counts the queries and database time of every request, spots statements that
+repeat within a request (the usual sign of an N+1 lazy load) and logs slow
+queries with their parameters. In debug mode the numbers are returned as X-DB-*
+response headers; in production they are aggregated per endpoint and exposed
+at /admin/metrics.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('sql')
+slow_logger = logging.getLogger('sql.slow')
+
+# Thresholds, overridable through app config in init_sql_instrumentation
+_settings = {
+    'slow_query_ms': 200,  # Log queries slower than this
+    'n_plus_one_threshold': 5,  # Flag statements repeated this many times in one request
+}
+
+# Aggregated numbers per endpoint since the process started
+_endpoint_stats = {}
+_stats_lock = threading.Lock()
+_listeners_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, which is discarded with it if the statement fails
+    context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._query_start) * 1000
+
+    if elapsed_ms >= _settings['slow_query_ms']:
+        endpoint = request.endpoint if has_request_context() else None
+        slow_logger.warning(f"Slow query ({elapsed_ms:.1f} ms) on {endpoint}: {statement} | params: {parameters!r}")
+
+    if not has_request_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+    stats['count'] += 1
+    stats['time_ms'] += elapsed_ms
+    stats['statements'][statement] += 1
+
+
+def _start_request():
+    g.sql_stats = {'count': 0, 'time_ms': 0.0, 'statements': Counter()}
+
+
+def _finish_request(response, app):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+
+    duplicates = sum(count - 1 for count in stats['statements'].values() if count > 1)
+    repeated = [
+        (statement, count) for statement, count in stats['statements'].items()
+        if count >= _settings['n_plus_one_threshold']
+    ]
+    for statement, count in repeated:
+        logger.warning(f"Possible N+1 on {request.endpoint}: statement ran {count} times: {statement[:300]}")
+
+    endpoint = request.endpoint or 'unknown'
+    with _stats_lock:
+        totals = _endpoint_stats.setdefault(endpoint, {
+            'requests': 0, 'queries': 0, 'db_time_ms': 0.0, 'duplicate_queries': 0, 'n_plus_one_requests': 0,
+        })
+        totals['requests'] += 1
+        totals['queries'] += stats['count']
+        totals['db_time_ms'] += stats['time_ms']
+        totals['duplicate_queries'] += duplicates
+        totals['n_plus_one_requests'] += bool(repeated)
+
+    if app.debug:
+        response.headers['X-DB-Query-Count'] = str(stats['count'])
+        response.headers['X-DB-Time-Ms'] = f"{stats['time_ms']:.1f}"
+        response.headers['X-DB-Duplicate-Queries'] = str(duplicates)
+        if repeated:
+            response.headers['X-DB-N-Plus-One'] = str(len(repeated))
+    return response
+
+
+def get_endpoint_stats():
+    """Snapshot of the per-endpoint query statistics, with per-request averages."""
+    with _stats_lock:
+        snapshot = {endpoint: dict(totals) for endpoint, totals in _endpoint_stats.items()}
+    for totals in snapshot.values():
+        totals['avg_queries'] = round(totals['queries'] / totals['requests'], 2)
+        totals['avg_db_time_ms'] = round(totals['db_time_ms'] / totals['requests'], 2)
+        totals['db_time_ms'] = round(totals['db_time_ms'], 2)
+    return snapshot
+
+
+def init_sql_instrumentation(app):
+    """Install the SQLAlchemy event hooks and request hooks for an app."""
+    global _listeners_installed
+    _settings['slow_query_ms'] = app.config.get('SQL_SLOW_QUERY_MS', _settings['slow_query_ms'])
+    _settings['n_plus_one_threshold'] = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', _settings['n_plus_one_threshold'])
+
+    if not _listeners_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listeners_installed = True
+
+    app.before_request(_start_request)
+    app.after_request(lambda response: _finish_request(response, app))
@@ -0,0 +1,321 @@
+"""
+Local fake of the parts of the Stripe API the shop uses, for development and
+load tests without network access.
+
+Implements checkout sessions (create with idempotency keys, retrieve, expire),
+products and prices (create, update) and a /pay/<session id> page that completes a session and redirects to its
+success_url. With --webhook-url, completing a session first delivers a signed
+checkout.session.completed event there, as Stripe would. Latency and failures
+can be injected to exercise the timeouts and retries of stripe_gateway.py.
+GET /_stats reports request, connection and request body byte counts, so
+keep-alive reuse and payload sizes are visible.
+
+Usage:
+    python fake_stripe.py --port 12111 [--latency 0.2] [--fail-rate 0.1]
+        [--webhook-url http://127.0.0.1:5000/webhook --webhook-secret whsec_test]
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_fake python main.py
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from urllib.request import Request, urlopen
+
+
+def decode_form(body):
+    """Decode Stripe's form encoding (a[b][0][c]=1) into nested dicts and lists."""
+    root = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        node = root
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return _listify(root)
+
+
+def _listify(node):
+    if not isinstance(node, dict):
+        return node
+    if node and all(key.isdigit() for key in node):
+        return [_listify(node[key]) for key in sorted(node, key=int)]
+    return {key: _listify(value) for key, value in node.items()}
+
+
+class FakeStripe:
+    """In-memory Stripe state plus fault injection settings."""
+
+    def __init__(self, latency=0.0, fail_rate=0.0, webhook_url=None, webhook_secret=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.products = {}
+        self.prices = {}
+        self.idempotent = {}  # key -> (request fingerprint, status, response)
+        self.stats = Counter()
+        self.base_url = None
+
+    def create_session(self, params):
+        session_id = 'cs_test_' + uuid.uuid4().hex
+        amount = 0
+        for item in params.get('line_items', []):
+            if 'price' in item:
+                unit_amount = self.prices[item['price']]['unit_amount']
+            else:
+                unit_amount = int(item.get('price_data', {}).get('unit_amount', 0))
+            amount += unit_amount * int(item.get('quantity', 1))
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f'{self.base_url}/pay/{session_id}',
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'payment_intent': None,
+            'amount_total': amount,
+            'currency': 'usd',
+            'created': int(time.time()),
+            'expires_at': int(time.time()) + 24 * 3600,
+            'client_reference_id': params.get('client_reference_id'),
+            'customer_email': params.get('customer_email'),
+            'metadata': params.get('metadata', {}),
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+            'shipping': None,
+        }
+        self.sessions[session_id] = session
+        return session
+
+    def create_price(self, params):
+        price = {
+            'id': 'price_test_' + uuid.uuid4().hex, 'object': 'price', 'active': True,
+            'product': params['product'], 'currency': params.get('currency', 'usd'),
+            'unit_amount': int(params['unit_amount']),
+        }
+        self.prices[price['id']] = price
+        return price
+
+    def create_product(self, params):
+        product = {
+            'id': 'prod_test_' + uuid.uuid4().hex, 'object': 'product', 'active': True,
+            'name': params['name'], 'description': params.get('description'),
+            'metadata': params.get('metadata', {}), 'default_price': None,
+        }
+        self.products[product['id']] = product
+        if 'default_price_data' in params:
+            product['default_price'] = self.create_price(dict(params['default_price_data'], product=product['id']))['id']
+        return product
+
+    def complete_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None or session['status'] != 'open':
+            return None
+        session.update(status='complete', payment_status='paid',
+                       payment_intent='pi_test_' + uuid.uuid4().hex)
+        return session
+
+    def send_webhook(self, event_type, obj):
+        """POST a signed event to webhook_url, if one is configured."""
+        if not self.webhook_url:
+            return
+        payload = json.dumps({
+            'id': 'evt_test_' + uuid.uuid4().hex, 'object': 'event', 'type': event_type,
+            'created': int(time.time()), 'data': {'object': obj},
+        })
+        headers = {'Content-Type': 'application/json'}
+        if self.webhook_secret:
+            timestamp = int(time.time())
+            signature = hmac.new(self.webhook_secret.encode('utf-8'), f'{timestamp}.{payload}'.encode('utf-8'),
+                                 hashlib.sha256).hexdigest()
+            headers['Stripe-Signature'] = f't={timestamp},v1={signature}'
+        try:
+            with urlopen(Request(self.webhook_url, data=payload.encode('utf-8'), headers=headers), timeout=10) as response:
+                response.read()
+            with self.lock:
+                self.stats['webhooks_sent'] += 1
+        except OSError as e:
+            with self.lock:
+                self.stats['webhook_failures'] += 1
+            print(f'Webhook delivery to {self.webhook_url} failed: {e}')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled clients reuse connections
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def setup(self):
+        super().setup()
+        with self.server.fake.lock:
+            self.server.fake.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, error_type, message, headers=None):
+        self._send(status, {'error': {'type': error_type, 'message': message}}, headers)
+
+    def _inject_faults(self):
+        """Sleep for the configured latency; True if this request should fail."""
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if self.fake.fail_rate and random.random() < self.fake.fail_rate:
+            with self.fake.lock:
+                self.fake.stats['injected_failures'] += 1
+            self._error(500, 'api_error', 'Injected failure', {'Stripe-Should-Retry': 'true'})
+            return True
+        return False
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        with self.fake.lock:
+            self.fake.stats['requests'] += 1
+
+        if path == '/_stats':
+            with self.fake.lock:
+                return self._send(200, dict(self.fake.stats, sessions=len(self.fake.sessions)))
+
+        match = re.fullmatch(r'/pay/(\w+)', path)
+        if match:
+            with self.fake.lock:
+                session = self.fake.complete_session(match.group(1))
+                session = dict(session) if session else None
+            if session is None:
+                return self._error(404, 'invalid_request_error', 'No open session')
+            self.fake.send_webhook('checkout.session.completed', session)
+            location = (session['success_url'] or '/').replace('{CHECKOUT_SESSION_ID}', session['id'])
+            self.send_response(303)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self._inject_faults():
+            return
+        match = re.fullmatch(r'/v1/checkout/sessions/(\w+)', path)
+        if match:
+            with self.fake.lock:
+                session = self.fake.sessions.get(match.group(1))
+            if session is None:
+                return self._error(404, 'invalid_request_error', f'No such checkout.session: {match.group(1)}')
+            return self._send(200, session)
+        self._error(404, 'invalid_request_error', f'Unrecognized request URL (GET: {path})')
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        with self.fake.lock:
+            self.fake.stats['requests'] += 1
+            self.fake.stats['bytes_received'] += len(body)
+        if self._inject_faults():
+            return
+
+        params = decode_form(body)
+        key = self.headers.get('Idempotency-Key')
+        fingerprint = hashlib.sha256(f'{path}?{body}'.encode('utf-8')).hexdigest()
+        with self.fake.lock:
+            if key and key in self.fake.idempotent:
+                stored_fingerprint, status, response = self.fake.idempotent[key]
+                if stored_fingerprint != fingerprint:
+                    return self._error(400, 'idempotency_error',
+                                       'Keys for idempotent requests can only be used with the same parameters')
+                self.fake.stats['idempotent_replays'] += 1
+                return self._send(status, response, {'Idempotent-Replayed': 'true'})
+
+            status, response = self._route_post(path, params)
+            if key:
+                self.fake.idempotent[key] = (fingerprint, status, response)
+        self._send(status, response)
+
+    def _route_post(self, path, params):
+        if path == '/v1/checkout/sessions':
+            unknown = [item['price'] for item in params.get('line_items', [])
+                       if 'price' in item and item['price'] not in self.fake.prices]
+            if unknown:
+                return 400, {'error': {'type': 'invalid_request_error', 'message': f'No such price: {unknown[0]}'}}
+            self.fake.stats['sessions_created'] += 1
+            return 200, self.fake.create_session(params)
+
+        if path == '/v1/products':
+            return 200, self.fake.create_product(params)
+        if path == '/v1/prices':
+            if params.get('product') not in self.fake.products:
+                return 400, {'error': {'type': 'invalid_request_error', 'message': 'No such product'}}
+            return 200, self.fake.create_price(params)
+
+        match = re.fullmatch(r'/v1/(products|prices)/(\w+)', path)
+        if match:
+            objects = self.fake.products if match.group(1) == 'products' else self.fake.prices
+            obj = objects.get(match.group(2))
+            if obj is None:
+                return 404, {'error': {'type': 'invalid_request_error', 'message': f'No such {match.group(1)[:-1]}'}}
+            for name, value in params.items():
+                obj[name] = value == 'true' if name == 'active' else value
+            return 200, obj
+
+        match = re.fullmatch(r'/v1/checkout/sessions/(\w+)/expire', path)
+        if match:
+            session = self.fake.sessions.get(match.group(1))
+            if session is None:
+                return 404, {'error': {'type': 'invalid_request_error', 'message': 'No such checkout.session'}}
+            if session['status'] != 'open':
+                return 400, {'error': {'type': 'invalid_request_error',
+                                       'message': f"Only open sessions can be expired (status: {session['status']})"}}
+            session['status'] = 'expired'
+            return 200, session
+
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL (POST: {path})'}}
+
+
+def start(port=0, latency=0.0, fail_rate=0.0, webhook_url=None, webhook_secret=None):
+    """Serve a FakeStripe on a background thread. Returns (server, fake); stop with server.shutdown()."""
+    fake = FakeStripe(latency=latency, fail_rate=fail_rate, webhook_url=webhook_url, webhook_secret=webhook_secret)
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    fake.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API request')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of API requests answered 500')
+    parser.add_argument('--webhook-url', help='where to deliver checkout.session.completed events')
+    parser.add_argument('--webhook-secret', help='signing secret (the app\'s STRIPE_WEBHOOK_SECRET)')
+    args = parser.parse_args()
+
+    server, fake = start(args.port, args.latency, args.fail_rate, args.webhook_url, args.webhook_secret)
+    print(f'Fake Stripe listening on {fake.base_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
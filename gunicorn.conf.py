@@ -0,0 +1,48 @@
+"""
+Gunicorn configuration for production.
+
+The app is built and warmed once in the master (preload_app + main.create_app),
+then gc.freeze() moves everything allocated so far out of the collector's view.
+Forked workers therefore share the catalog, rules, compiled templates and
+benchmark tables copy-on-write instead of each holding a private copy. The
+catalog files are then no longer checked for changes; send the master SIGHUP
+to pick up a new catalog.
+
+Measure the effect with `python bench_memory.py --start`.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+wsgi_app = 'main:create_app()'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+reuse_port = True
+
+# Threads let a worker keep serving pages while one of its requests waits on the
+# password hashing pool (see password_hashing.py); hashing itself releases the GIL
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Set GUNICORN_PRELOAD=0 to compare against workers that each load the app themselves
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def post_worker_init(worker):
+    # Start polling the webhook queue at boot, so events left pending by a restart or
+    # deploy don't wait for the next delivery
+    from app import app
+    from webhook_queue import start_webhook_worker
+    start_webhook_worker(app)
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is warm and before any worker is forked.
+    # Frozen objects are never scanned by the collector, so GC passes in the workers
+    # don't write to (and thereby un-share) the pages they live on.
+    if preload_app:
+        # Workers keep the master's catalog instead of re-reading the files, which would
+        # give each its own private copy; reload the master (kill -HUP) after a catalog change
+        from utils import freeze_catalog
+        freeze_catalog()
+        gc.collect()
+        gc.freeze()
@@ -0,0 +1,239 @@
+"""
+Component stock tracking and checkout reservations.
+
+component_stock holds the units of each tracked component that can still be
+reserved; components without a row are not tracked and never run out. Set stock
+with `flask --app main set-stock CATEGORY COMPONENT_ID QUANTITY`.
+
+Checkout locks the build's tracked rows in (category, component_id) order, then
+reserves them with a single conditional `UPDATE ... SET available = available - n
+WHERE available >= n`, in the same transaction as the order insert. Either every part is reserved or the order is
+rolled back, and overselling is impossible. The row locks only last until that
+short transaction commits.
+
+Reservations are committed when the payment webhook lands. They are released
+(returned to stock) when the checkout session expires, when the customer cancels
+payment, or when they outlive STOCK_RESERVATION_MINUTES. The last case is
+handled by `flask --app main release-reservations`, run every few minutes.
+
+The builder never reads component_stock directly. It uses a per-process
+snapshot of the whole table, refreshed every STOCK_SNAPSHOT_TTL seconds, so
+page views add no load to the rows checkouts are updating.
+"""
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, tuple_
+from models import db, ComponentStock, StockReservation, ReservationStatus, Order, OrderStatus
+from stripe_gateway import expire_checkout_session
+
+STOCK_RESERVATION_MINUTES = int(os.environ.get('STOCK_RESERVATION_MINUTES', 30))
+STOCK_SNAPSHOT_TTL = 10
+LOW_STOCK_THRESHOLD = 3
+RELEASE_BATCH_SIZE = 500
+
+# Matches <!--stock:ID--> markers in cached component fragments
+_STOCK_PATTERN = re.compile(r'<!--stock:(.*?)-->')
+
+_snapshot = {'data': None, 'expires': 0}
+
+# Order statuses whose held stock may go back on sale
+_RELEASABLE_STATUSES = (OrderStatus.PENDING.value, OrderStatus.CANCELED.value, OrderStatus.REFUNDED.value)
+
+
+class OutOfStock(Exception):
+    """A tracked component has fewer units available than the order needs."""
+
+    def __init__(self, category, component_id):
+        super().__init__(f'{category} {component_id} is out of stock')
+        self.category = category
+        self.component_id = component_id
+
+
+def reserve_stock(order, config, quantity=1):
+    """
+    Reserve quantity units of every tracked component in config for order (which
+    must be flushed). Runs in the caller's transaction; raises OutOfStock, after
+    which the caller must roll back.
+    """
+    stock = ComponentStock.__table__
+    parts = [(category, component_id) for category, component_id in sorted(config.items()) if component_id]
+    if not parts:
+        return
+    key = tuple_(stock.c.category, stock.c.component_id)
+    # Lock the tracked rows in one fixed order first. A multi-row UPDATE locks rows in
+    # whatever order the plan visits them, so two checkouts sharing parts could each
+    # hold one row the other is waiting for
+    tracked = [tuple(row) for row in db.session.execute(
+        select(stock.c.category, stock.c.component_id).where(key.in_(parts))
+        .order_by(stock.c.category, stock.c.component_id).with_for_update())]
+    if not tracked:
+        return
+
+    # One statement for the whole build: it only touches parts with enough units left,
+    # so fewer rows than tracked parts means something ran out
+    result = db.session.execute(
+        stock.update()
+        .where(key.in_(tracked), stock.c.available >= quantity)
+        .values(available=stock.c.available - quantity, updated_at=datetime.utcnow())
+    )
+    if result.rowcount != len(tracked):
+        short = db.session.execute(
+            select(stock.c.category, stock.c.component_id)
+            .where(key.in_(tracked), stock.c.available < quantity).limit(1)
+        ).first()
+        raise OutOfStock(*(short or tracked[0]))
+
+    expires_at = datetime.utcnow() + timedelta(minutes=STOCK_RESERVATION_MINUTES)
+    db.session.add_all([
+        StockReservation(order_id=order.id, category=category, component_id=component_id,
+                         quantity=quantity, expires_at=expires_at)
+        for category, component_id in tracked
+    ])
+
+
+def _return_to_stock(reservation):
+    stock = ComponentStock.__table__
+    db.session.execute(
+        stock.update()
+        .where(stock.c.category == reservation.category, stock.c.component_id == reservation.component_id)
+        .values(available=stock.c.available + reservation.quantity, updated_at=datetime.utcnow())
+    )
+    reservation.status = ReservationStatus.RELEASED.value
+
+
+def release_order_reservations(order_id):
+    """Return an order's held stock. Runs in the caller's transaction; returns the number released."""
+    held = StockReservation.query.filter_by(order_id=order_id, status=ReservationStatus.HELD.value) \
+        .with_for_update().all()
+    for reservation in held:
+        _return_to_stock(reservation)
+    return len(held)
+
+
+def commit_order_reservations(order_id):
+    """
+    Mark an order's reservations as paid for. Stock already released (the payment
+    came in after the reservation expired) is taken again if it is still there;
+    otherwise the shortfall is logged for fulfilment. Runs in the caller's transaction.
+    """
+    stock = ComponentStock.__table__
+    for reservation in StockReservation.query.filter_by(order_id=order_id).with_for_update().all():
+        if reservation.status == ReservationStatus.RELEASED.value:
+            result = db.session.execute(
+                stock.update()
+                .where(stock.c.category == reservation.category, stock.c.component_id == reservation.component_id,
+                       stock.c.available >= reservation.quantity)
+                .values(available=stock.c.available - reservation.quantity, updated_at=datetime.utcnow())
+            )
+            if result.rowcount != 1:
+                logging.warning(f"Order {order_id} was paid after its reservation of {reservation.category} "
+                                f"{reservation.component_id} expired and the stock is gone")
+        reservation.status = ReservationStatus.COMMITTED.value
+
+
+def expired_reservation_orders(limit, skipped=()):
+    """
+    Query for the ids of up to limit orders with expired held reservations, longest
+    expired first, leaving out skipped. The expired rows are picked first, through the
+    (status, expires_at) index, and only then grouped by order.
+    """
+    expired = select(StockReservation.order_id, StockReservation.expires_at) \
+        .where(StockReservation.status == ReservationStatus.HELD.value,
+               StockReservation.expires_at < datetime.utcnow())
+    if skipped:
+        expired = expired.where(StockReservation.order_id.notin_(skipped))
+    # MATERIALIZED keeps the planner from merging it into the grouping query, which on
+    # SQLite trades the index for a full scan in order_id order
+    expired = expired.cte('expired').prefix_with('MATERIALIZED')
+    # GROUP BY rather than DISTINCT: Postgres only orders DISTINCT rows by selected columns
+    return select(expired.c.order_id).group_by(expired.c.order_id) \
+        .order_by(func.min(expired.c.expires_at)).limit(limit)
+
+
+def release_expired_reservations(batch_size=RELEASE_BATCH_SIZE):
+    """
+    Release held reservations older than STOCK_RESERVATION_MINUTES and cancel their
+    still-pending orders, expiring the Stripe checkout session first so it can no
+    longer be paid. Orders whose session can't be expired (already paid, or Stripe
+    unreachable) are left for the webhook or the next run. Returns the number of
+    orders released. Held reservations of orders that were paid meanwhile are
+    committed instead.
+    """
+    released = 0
+    skipped = set()
+    while True:
+        order_ids = db.session.scalars(expired_reservation_orders(batch_size, skipped)).all()
+        db.session.rollback()
+        if not order_ids:
+            return released
+
+        for order_id in order_ids:
+            order = db.session.get(Order, order_id, with_for_update=True)
+            if order.status not in _RELEASABLE_STATUSES:
+                # Paid by an event that didn't commit the reservation; the stock is the customer's
+                commit_order_reservations(order_id)
+                db.session.commit()
+                continue
+            if order.payment_id and order.payment_id.startswith('cs_') and order.status == OrderStatus.PENDING.value:
+                try:
+                    expire_checkout_session(order.payment_id)
+                except Exception as e:
+                    logging.warning(f"Keeping the reservation of order {order.order_number}: "
+                                    f"could not expire checkout session {order.payment_id}: {e}")
+                    db.session.rollback()
+                    skipped.add(order_id)
+                    continue
+
+            release_order_reservations(order_id)
+            if order.status == OrderStatus.PENDING.value:
+                order.status = OrderStatus.CANCELED.value
+            db.session.commit()
+            released += 1
+
+
+def get_stock_snapshot():
+    """{(category, component id): units available} for tracked components, at most STOCK_SNAPSHOT_TTL old."""
+    if _snapshot['data'] is None or time.monotonic() > _snapshot['expires']:
+        _snapshot['data'] = {
+            (row.category, row.component_id): row.available
+            for row in db.session.query(ComponentStock.category, ComponentStock.component_id, ComponentStock.available)
+        }
+        _snapshot['expires'] = time.monotonic() + STOCK_SNAPSHOT_TTL
+    return _snapshot['data']
+
+
+def is_in_stock(category, component_id, quantity=1):
+    """Snapshot check for the builder and cart; checkout itself always checks the live row."""
+    available = get_stock_snapshot().get((category, component_id))
+    return available is None or available >= quantity
+
+
+def get_category_stock(category):
+    """{component id: availability} for the tracked components of a category, for the builder's JSON."""
+    return {
+        component_id: {
+            'available': available,
+            'in_stock': available > 0,
+            'low_stock': 0 < available <= LOW_STOCK_THRESHOLD,
+        }
+        for (stock_category, component_id), available in get_stock_snapshot().items()
+        if stock_category == category
+    }
+
+
+def apply_stock(fragment, category):
+    """Resolve the stock markers of a cached component fragment into availability badges."""
+    snapshot = get_stock_snapshot()
+
+    def badge(match):
+        available = snapshot.get((category, match.group(1)))
+        if available is None or available > LOW_STOCK_THRESHOLD:
+            return ''
+        if available <= 0:
+            return '<span class="badge bg-danger stock-badge stock-out">Out of stock</span>'
+        return f'<span class="badge bg-warning text-dark stock-badge">Only {available} left</span>'
+
+    return _STOCK_PATTERN.sub(badge, fragment)
@@ -1,9 +1,30 @@
-from app import app  # noqa: F401
+from app import app, warm_caches  # noqa: F401
+from models import db
+from sqlalchemy.exc import SQLAlchemyError
 from prebuilt_configs import create_prebuilt_configs
 
-# Load prebuilt configurations when the app starts
-with app.app_context():
-    create_prebuilt_configs()
+def sync_prebuilt_configs():
+    """Sync the prebuilt configurations (a no-op unless they changed). Needs an app context."""
+    try:
+        create_prebuilt_configs()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Could not sync prebuilt configurations, has `flask --app main init-db` been run? {str(e)}")
+
+def create_app():
+    """Application factory used by gunicorn.conf.py to build and warm the app before forking.
+    
+    Importing this module has no side effects; the prebuilt sync runs here, once per
+    deploy in the master, and in `flask --app main init-db`.
+    """
+    with app.app_context():
+        sync_prebuilt_configs()
+        warm_caches()
+        # Connections opened in the master must not be shared with forked workers
+        db.engine.dispose()
+    return app
 
 if __name__ == '__main__':
+    with app.app_context():
+        sync_prebuilt_configs()
     app.run(host='0.0.0.0', port=5000, debug=True)
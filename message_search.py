@@ -0,0 +1,140 @@
+"""
+Full-text search over the admin contact inbox.
+
+Indexes ContactMessage name, email, subject and message:
+- SQLite: an external-content FTS5 table (contact_message_fts) kept in sync with
+  contact_message by triggers, ranked with bm25().
+- PostgreSQL: a stored generated tsvector column (contact_message.search_vector)
+  with a GIN index, ranked with ts_rank_cd().
+Both are created by migration 7 (see migrations.py), which also indexes the
+existing rows. Name, email and subject matches outrank matches in the body.
+"""
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from models import db, ContactMessage
+
+SEARCH_LIMIT = 50
+
+# Highlight markers are control characters so user text can be HTML-escaped
+# before they are turned into <mark> tags
+_START, _STOP = '\x02', '\x03'
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS contact_message_fts USING fts5("
+    "name, email, subject, message, content='contact_message', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS contact_message_fts_insert AFTER INSERT ON contact_message BEGIN "
+    "INSERT INTO contact_message_fts (rowid, name, email, subject, message) "
+    "VALUES (new.id, new.name, new.email, new.subject, new.message); END",
+    "CREATE TRIGGER IF NOT EXISTS contact_message_fts_delete AFTER DELETE ON contact_message BEGIN "
+    "INSERT INTO contact_message_fts (contact_message_fts, rowid, name, email, subject, message) "
+    "VALUES ('delete', old.id, old.name, old.email, old.subject, old.message); END",
+    "CREATE TRIGGER IF NOT EXISTS contact_message_fts_update "
+    "AFTER UPDATE OF name, email, subject, message ON contact_message BEGIN "
+    "INSERT INTO contact_message_fts (contact_message_fts, rowid, name, email, subject, message) "
+    "VALUES ('delete', old.id, old.name, old.email, old.subject, old.message); "
+    "INSERT INTO contact_message_fts (rowid, name, email, subject, message) "
+    "VALUES (new.id, new.name, new.email, new.subject, new.message); END",
+    # Index the rows that existed before the table was created
+    "INSERT INTO contact_message_fts (contact_message_fts) VALUES ('rebuild')",
+]
+
+POSTGRESQL_SCHEMA = [
+    "ALTER TABLE contact_message ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(email, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(subject, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(message, '')), 'C')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_contact_message_search_vector ON contact_message USING gin (search_vector)",
+]
+
+
+def create_search_index(conn):
+    """Create the dialect's full-text index over contact_message (idempotent)."""
+    statements = POSTGRESQL_SCHEMA if conn.dialect.name == 'postgresql' else SQLITE_SCHEMA
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def _fts5_query(query):
+    # Each word becomes a quoted term, so punctuation in emails and order numbers is
+    # never parsed as FTS5 syntax. Only the last word is a prefix term (for partial
+    # input); prefix-expanding every word is slow for common ones like "com".
+    tokens = _TOKEN_PATTERN.findall(query)
+    if not tokens:
+        return ''
+    return ' '.join([f'"{token}"' for token in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+
+
+def _highlight(value):
+    """HTML-escape a highlighted value and turn the markers into <mark> tags"""
+    if value is None:
+        return None
+    return Markup(str(escape(value)).replace(_START, '<mark>').replace(_STOP, '</mark>'))
+
+
+def _search_sqlite(query, is_read, limit):
+    match = _fts5_query(query)
+    if not match:
+        return []
+    read_filter = '' if is_read is None else 'AND contact_message.is_read = :is_read'
+    return db.session.execute(text(
+        f"SELECT contact_message_fts.rowid AS id, "
+        f"highlight(contact_message_fts, 0, :start, :stop) AS name, "
+        f"highlight(contact_message_fts, 1, :start, :stop) AS email, "
+        f"highlight(contact_message_fts, 2, :start, :stop) AS subject, "
+        f"snippet(contact_message_fts, 3, :start, :stop, '…', 24) AS snippet "
+        f"FROM contact_message_fts JOIN contact_message ON contact_message.id = contact_message_fts.rowid "
+        f"WHERE contact_message_fts MATCH :match {read_filter} "
+        f"ORDER BY bm25(contact_message_fts, 4.0, 4.0, 2.0, 1.0) LIMIT :limit"
+    ), {'match': match, 'is_read': is_read, 'limit': limit, 'start': _START, 'stop': _STOP}).all()
+
+
+def _search_postgresql(query, is_read, limit):
+    read_filter = '' if is_read is None else 'AND contact_message.is_read = :is_read'
+    options = f'StartSel={_START}, StopSel={_STOP}, HighlightAll=true'
+    snippet_options = f'StartSel={_START}, StopSel={_STOP}, MaxFragments=2, MaxWords=24, MinWords=8'
+    # Rank and limit first so ts_headline only runs on the rows that are shown
+    return db.session.execute(text(
+        f"SELECT id, ts_headline('simple', name, q, :options) AS name, "
+        f"ts_headline('simple', email, q, :options) AS email, "
+        f"ts_headline('simple', coalesce(subject, ''), q, :options) AS subject, "
+        f"ts_headline('simple', message, q, :snippet_options) AS snippet "
+        f"FROM (SELECT contact_message.*, q, ts_rank_cd(search_vector, q) AS rank "
+        f"FROM contact_message, websearch_to_tsquery('simple', :query) AS q "
+        f"WHERE search_vector @@ q {read_filter} ORDER BY rank DESC LIMIT :limit) AS ranked "
+        f"ORDER BY rank DESC"
+    ), {'query': query, 'is_read': is_read, 'limit': limit,
+        'options': options, 'snippet_options': snippet_options}).all()
+
+
+def search_messages(query, is_read=None, limit=SEARCH_LIMIT):
+    """
+    Ranked full-text search of the inbox. is_read optionally restricts to read or
+    unread messages. Returns (messages, highlights) where highlights maps message id
+    to HTML-safe name, email, subject and message snippet with <mark> tags.
+    """
+    query = query.strip()
+    if not query:
+        return [], {}
+
+    if db.engine.dialect.name == 'postgresql':
+        rows = _search_postgresql(query, is_read, limit)
+    else:
+        rows = _search_sqlite(query, is_read, limit)
+
+    highlights = {
+        row.id: {
+            'name': _highlight(row.name),
+            'email': _highlight(row.email),
+            'subject': _highlight(row.subject) or None,
+            'snippet': _highlight(row.snippet),
+        }
+        for row in rows
+    }
+    messages_by_id = {message.id: message for message in
+                      ContactMessage.query.filter(ContactMessage.id.in_(list(highlights))).all()} if highlights else {}
+    messages = [messages_by_id[row.id] for row in rows if row.id in messages_by_id]
+    return messages, highlights
@@ -0,0 +1,174 @@
+"""
+Versioned schema migrations.
+
+db.create_all() only creates missing tables, so changes to existing tables
+(new indexes, columns, ...) are applied here. Each migration runs once, in its
+own transaction, and is recorded in the schema_migration table. Migrations must
+also be safe on a fresh database where create_all() already built the current
+schema from models.py (hence IF NOT EXISTS / existence checks).
+
+Run with `flask --app main db-upgrade` (also part of `flask --app main init-db`).
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+from models import (db, SchemaMigration, AdminStat, WebhookEvent, PaymentState, StripePrice, ComponentStock,
+                    StockReservation)
+from utils import BUILD_CATEGORIES
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function taking a SQLAlchemy connection."""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+@migration(1, 'Indexes for the hot build, cart, order and inbox queries')
+def add_hot_query_indexes(conn):
+    statements = [
+        'CREATE INDEX IF NOT EXISTS ix_build_is_public_created_at ON build (is_public, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_build_user_id_created_at ON build (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_cart_session_id ON cart (session_id)',
+        'CREATE INDEX IF NOT EXISTS ix_cart_user_id ON cart (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_order_payment_id ON "order" (payment_id)',
+        'CREATE INDEX IF NOT EXISTS ix_contact_message_is_read_created_at ON contact_message (is_read, created_at)',
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+@migration(2, 'Keyset index for the public build gallery')
+def add_public_gallery_keyset_index(conn):
+    # (created_at, id) keyset pagination needs id in the index to seek past ties
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_build_is_public_created_at_id ON build (is_public, created_at, id)'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_build_is_public_created_at'))
+
+
+@migration(3, 'Denormalized summary columns on build and pre_built_config')
+def add_build_summary_columns(conn):
+    inspector = inspect(conn)
+    for table in ('build', 'pre_built_config'):
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        if 'summary' not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN summary TEXT'))
+        if 'summary_version' not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN summary_version VARCHAR(12)'))
+
+
+@migration(4, 'Index for the abandoned anonymous cart purge')
+def add_cart_updated_at_index(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_cart_updated_at ON cart (updated_at)'))
+
+
+@migration(5, 'Native JSON build_config on order and cart, with component indexes')
+def convert_build_config_to_json(conn):
+    postgresql = conn.dialect.name == 'postgresql'
+    inspector = inspect(conn)
+    for table in ('order', 'cart'):
+        if postgresql:
+            column = next(c for c in inspector.get_columns(table) if c['name'] == 'build_config')
+            if not isinstance(column['type'], JSONB):
+                conn.execute(text(
+                    f'ALTER TABLE "{table}" ALTER COLUMN build_config TYPE JSONB USING build_config::jsonb'
+                ))
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_{table}_build_config ON "{table}" '
+                f'USING gin (build_config jsonb_path_ops)'
+            ))
+        else:
+            # SQLite stores JSON as text already; only the expression indexes are new
+            for category in BUILD_CATEGORIES:
+                conn.execute(text(
+                    f'CREATE INDEX IF NOT EXISTS ix_{table}_build_config_{category} ON "{table}" '
+                    f"(json_extract(build_config, '$.{category}'))"
+                ))
+
+
+@migration(6, 'Admin stats table and keyset indexes for the admin inbox')
+def add_admin_stats_and_inbox_indexes(conn):
+    AdminStat.__table__.create(conn, checkfirst=True)
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_contact_message_is_read_created_at_id ON contact_message (is_read, created_at, id)'
+    ))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_contact_message_created_at_id ON contact_message (created_at, id)'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_contact_message_is_read_created_at'))
+
+
+@migration(7, 'Full-text search index over contact messages')
+def add_contact_message_search(conn):
+    from message_search import create_search_index
+    create_search_index(conn)
+
+
+@migration(8, 'Stripe webhook event queue')
+def add_webhook_event_queue(conn):
+    WebhookEvent.__table__.create(conn, checkfirst=True)
+
+
+@migration(9, 'Checkout payment state cache')
+def add_payment_state(conn):
+    PaymentState.__table__.create(conn, checkfirst=True)
+
+
+@migration(10, 'Stripe product and price lookup for catalog components')
+def add_stripe_price(conn):
+    StripePrice.__table__.create(conn, checkfirst=True)
+
+
+@migration(11, 'Component stock and checkout reservations')
+def add_stock_tracking(conn):
+    ComponentStock.__table__.create(conn, checkfirst=True)
+    StockReservation.__table__.create(conn, checkfirst=True)
+
+
+@migration(12, 'Index for the date-ordered order export')
+def add_order_created_at_index(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_order_created_at_id ON "order" (created_at, id)'))
+
+
+@migration(13, "Keyset index for a user's builds")
+def add_user_builds_keyset_index(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_build_user_id_created_at_id ON build (user_id, created_at, id)'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_build_user_id_created_at'))
+
+
+@migration(14, 'Retry backoff for webhook events')
+def add_webhook_event_next_attempt_at(conn):
+    existing = {column['name'] for column in inspect(conn).get_columns('webhook_event')}
+    if 'next_attempt_at' not in existing:
+        conn.execute(text('ALTER TABLE webhook_event ADD COLUMN next_attempt_at TIMESTAMP'))
+
+
+@migration(15, 'Recompute summaries to include benchmark scores')
+def expire_summaries_for_performance(conn):
+    # Stale rows are picked up by the next refresh-summaries run
+    conn.execute(text('UPDATE build SET summary_version = NULL'))
+    conn.execute(text('UPDATE pre_built_config SET summary_version = NULL'))
+
+
+def get_applied_versions():
+    return {row.version for row in SchemaMigration.query.all()}
+
+
+def upgrade():
+    """Apply all pending migrations in version order. Returns the versions applied."""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = get_applied_versions()
+    db.session.rollback()
+
+    newly_applied = []
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        with db.engine.begin() as conn:
+            func(conn)
+            conn.execute(
+                SchemaMigration.__table__.insert().values(version=version, description=description)
+            )
+        logging.info(f"Applied migration {version}: {description}")
+        newly_applied.append(version)
+    return newly_applied
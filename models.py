@@ -1,9 +1,11 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_hashing import hash_password, verify_password, needs_rehash
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import JSONB
 import json
 from enum import Enum
 from flask_login import UserMixin
+from utils import BUILD_CATEGORIES
 
 # Initialize SQLAlchemy
 db = SQLAlchemy()
@@ -16,11 +18,15 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     builds = db.relationship('Build', backref='user', lazy='dynamic')
     
+    # Hashing runs in the bounded pool of password_hashing and raises HashingBusy when it is full
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -45,6 +51,16 @@ class Build(db.Model):
     case_id = db.Column(db.String(20), nullable=True)
     cooling_id = db.Column(db.String(20), nullable=True)
     
+    # Denormalized summary for list views (see build_summaries.py)
+    summary = db.Column(db.Text, nullable=True)  # Stored as JSON
+    summary_version = db.Column(db.String(12), nullable=True)  # Catalog version the summary was built from
+    
+    # Indexes for the public gallery and "my builds" listings (see migrations.py)
+    __table_args__ = (
+        db.Index('ix_build_is_public_created_at_id', 'is_public', 'created_at', 'id'),
+        db.Index('ix_build_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<Build {self.name}>'
 
@@ -72,9 +88,40 @@ class PreBuiltConfig(db.Model):
     case_id = db.Column(db.String(20), nullable=True)
     cooling_id = db.Column(db.String(20), nullable=True)
     
+    # Denormalized summary for list views (see build_summaries.py)
+    summary = db.Column(db.Text, nullable=True)  # Stored as JSON
+    summary_version = db.Column(db.String(12), nullable=True)  # Catalog version the summary was built from
+    
     def __repr__(self):
         return f'<PreBuiltConfig {self.name}>'
 
+class SchemaMigration(db.Model):
+    """Versioned schema migrations that have been applied (see migrations.py)"""
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaMigration {self.version}>'
+
+class SeedState(db.Model):
+    """Content hash of the data last seeded into a table, used to skip unchanged reseeds"""
+    name = db.Column(db.String(50), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SeedState {self.name}>'
+
+class AdminStat(db.Model):
+    """Admin dashboard counter, kept current by ORM events and reconciled by a recount (see admin_stats.py)"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AdminStat {self.name}={self.value}>'
+
 class ContactMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -89,9 +136,58 @@ class ContactMessage(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     is_replied = db.Column(db.Boolean, default=False)
     
+    # Keyset indexes for the admin inbox, with and without the read/unread filter (see migrations.py)
+    __table_args__ = (
+        db.Index('ix_contact_message_is_read_created_at_id', 'is_read', 'created_at', 'id'),
+        db.Index('ix_contact_message_created_at_id', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<ContactMessage {self.id} - {self.email}>'
 
+# Component configurations ({category: component id}) are stored as native JSON:
+# JSONB on PostgreSQL (GIN-indexed for containment), JSON text on SQLite (with an
+# expression index per component category, see build_config_indexes)
+BuildConfigJSON = db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql')
+
+class BuildConfigMixin:
+    """build_config column plus accessors shared by Order and Cart"""
+    build_config = db.Column(BuildConfigJSON, nullable=True)
+    
+    def set_build_config(self, config_dict):
+        self.build_config = dict(config_dict)
+    
+    def get_build_config(self):
+        return dict(self.build_config) if self.build_config else {}
+    
+    def get_component_id(self, category):
+        """Component id for one category, without copying the whole configuration"""
+        return self.build_config.get(category) if self.build_config else None
+    
+    @classmethod
+    def component_id_expr(cls, category):
+        """SQL expression for the component id of one category, e.g. to select or group by it"""
+        if db.engine.dialect.name == 'postgresql':
+            return cls.build_config[category].astext
+        # Literal path so SQLite matches the expression index
+        return db.func.json_extract(cls.build_config, db.literal_column(f"'$.{category}'"))
+    
+    @classmethod
+    def contains_component(cls, category, component_id):
+        """Filter for rows whose configuration uses component_id for category (index-backed)"""
+        if db.engine.dialect.name == 'postgresql':
+            return cls.build_config.contains({category: component_id})
+        return cls.component_id_expr(category) == component_id
+
+def build_config_indexes(model):
+    """GIN index on PostgreSQL, one expression index per category on SQLite"""
+    table = model.__tablename__
+    db.Index(f'ix_{table}_build_config', model.build_config,
+             postgresql_using='gin', postgresql_ops={'build_config': 'jsonb_path_ops'}).ddl_if(dialect='postgresql')
+    for category in BUILD_CATEGORIES:
+        db.Index(f'ix_{table}_build_config_{category}',
+                 db.func.json_extract(model.build_config, db.literal_column(f"'$.{category}'"))).ddl_if(dialect='sqlite')
+
 class OrderStatus(Enum):
     PENDING = 'pending'
     PAID = 'paid'
@@ -101,7 +197,7 @@ class OrderStatus(Enum):
     CANCELED = 'canceled'
     REFUNDED = 'refunded'
 
-class Order(db.Model):
+class Order(BuildConfigMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     user = db.relationship('User', backref=db.backref('orders', lazy='dynamic'))
@@ -126,7 +222,7 @@ class Order(db.Model):
     
     # Payment information
     payment_method = db.Column(db.String(50), nullable=True)
-    payment_id = db.Column(db.String(100), nullable=True)  # For Stripe payment_intent ID
+    payment_id = db.Column(db.String(100), nullable=True, index=True)  # For Stripe payment_intent ID
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -136,50 +232,126 @@ class Order(db.Model):
     build_id = db.Column(db.Integer, db.ForeignKey('build.id'), nullable=True)
     build = db.relationship('Build', backref=db.backref('orders', lazy='dynamic'))
     
-    # Build configuration JSON
-    build_config = db.Column(db.Text, nullable=True)  # Stored as JSON
-    
-    def set_build_config(self, config_dict):
-        self.build_config = json.dumps(config_dict)
-    
-    def get_build_config(self):
-        if self.build_config:
-            return json.loads(self.build_config)
-        return {}
+    __table_args__ = (
+        db.Index('ix_order_created_at_id', 'created_at', 'id'),
+    )
     
     def __repr__(self):
         return f'<Order {self.order_number}>'
 
-class Cart(db.Model):
+class Cart(BuildConfigMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     user = db.relationship('User', backref=db.backref('cart', uselist=False))
     
     # Session ID for non-authenticated users
-    session_id = db.Column(db.String(100), nullable=True)
+    session_id = db.Column(db.String(100), nullable=True, index=True)
     
     # Build IDs in the cart
     build_id = db.Column(db.Integer, db.ForeignKey('build.id'), nullable=True)
     build = db.relationship('Build', backref=db.backref('in_cart', uselist=False))
     
-    # Build configuration for custom builds
-    build_config = db.Column(db.Text, nullable=True)  # Stored as JSON
-    
     # Cart item details
     quantity = db.Column(db.Integer, default=1)
     total_price = db.Column(db.Float, default=0.0)
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Abandoned-cart purge
+    
+    def __repr__(self):
+        return f'<Cart {self.id}>'
+
+class WebhookEventStatus(Enum):
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    IGNORED = 'ignored'  # Event type the shop does not handle
+    FAILED = 'failed'  # Gave up after WEBHOOK_MAX_ATTEMPTS
+
+class WebhookEvent(db.Model):
+    """Stripe webhook event, stored on receipt and processed in the background (see webhook_queue.py)"""
+    id = db.Column(db.String(255), primary_key=True)  # Stripe event id, so redeliveries are no-ops
+    type = db.Column(db.String(100), nullable=False)
+    stripe_created = db.Column(db.Integer, nullable=False)  # Event time at Stripe; batches are taken oldest first
+    order_id = db.Column(db.Integer, nullable=True)  # From client_reference_id or metadata, if present
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=WebhookEventStatus.PENDING.value)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # Retry backoff after a failed attempt
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    # The next pending batch, oldest first
+    __table_args__ = (
+        db.Index('ix_webhook_event_status_stripe_created_id', 'status', 'stripe_created', 'id'),
+    )
+    
+    def get_payload(self):
+        return json.loads(self.payload)
+    
+    def __repr__(self):
+        return f'<WebhookEvent {self.id} {self.type}>'
+
+class PaymentState(db.Model):
+    """Last known state of a Stripe checkout session, written when its webhook arrives (see payment_state.py)"""
+    session_id = db.Column(db.String(255), primary_key=True)
+    order_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=True)  # Checkout session status: open, complete, expired
+    payment_status = db.Column(db.String(30), nullable=True)  # paid, unpaid, no_payment_required
+    payment_intent = db.Column(db.String(255), nullable=True)
+    stripe_created = db.Column(db.Integer, nullable=False)  # Time of the event that set this state
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def set_build_config(self, config_dict):
-        self.build_config = json.dumps(config_dict)
+    def __repr__(self):
+        return f'<PaymentState {self.session_id} {self.payment_status}>'
+
+class StripePrice(db.Model):
+    """Stripe Product and Price mirroring a catalog component (see stripe_catalog.py)"""
+    category = db.Column(db.String(20), primary_key=True)
+    component_id = db.Column(db.String(100), primary_key=True)
+    product_id = db.Column(db.String(255), nullable=False)
+    price_id = db.Column(db.String(255), nullable=False)
+    unit_amount = db.Column(db.Integer, nullable=False)  # Cents
+    fingerprint = db.Column(db.String(40), nullable=False)  # Hash of the synced name, description and amount
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def get_build_config(self):
-        if self.build_config:
-            return json.loads(self.build_config)
-        return {}
+    def __repr__(self):
+        return f'<StripePrice {self.category}/{self.component_id} {self.price_id}>'
+
+class ComponentStock(db.Model):
+    """Units of a component available to reserve; components without a row are not stock-tracked (see inventory.py)"""
+    category = db.Column(db.String(20), primary_key=True)
+    component_id = db.Column(db.String(100), primary_key=True)
+    available = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ComponentStock {self.category}/{self.component_id}={self.available}>'
+
+class ReservationStatus(Enum):
+    HELD = 'held'  # Taken from stock, awaiting payment
+    COMMITTED = 'committed'  # Paid for
+    RELEASED = 'released'  # Returned to stock (payment canceled or expired)
+
+class StockReservation(db.Model):
+    """Stock held for an order between checkout and payment (see inventory.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    category = db.Column(db.String(20), nullable=False)
+    component_id = db.Column(db.String(100), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=ReservationStatus.HELD.value)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Held reservations past their expiry, oldest first
+    __table_args__ = (
+        db.Index('ix_stock_reservation_status_expires_at', 'status', 'expires_at'),
+    )
     
     def __repr__(self):
-        return f'<Cart {self.id}>'
\ No newline at end of file
+        return f'<StockReservation {self.order_id} {self.category}/{self.component_id} x{self.quantity} {self.status}>'
+
+build_config_indexes(Order)
+build_config_indexes(Cart)
@@ -0,0 +1,121 @@
+"""
+Streaming export of orders for fulfilment and accounting, as CSV or NDJSON.
+
+Orders are read with a server-side cursor (yield_per) in EXPORT_BATCH_SIZE rows
+at a time, as plain column tuples rather than ORM objects, and written out in
+chunks of about EXPORT_CHUNK_BYTES. Memory use doesn't grow with the number of
+orders, and the first bytes go out as soon as the first row is read. Component ids
+in each build are expanded to names through the catalog index; ids that left the
+catalog are kept as they are. CSV cells that a spreadsheet would run as a formula
+get a leading apostrophe; NDJSON is written as stored.
+
+Served by /admin/orders/export and `flask --app main export-orders`.
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import db, Order, OrderStatus
+from utils import BUILD_CATEGORIES, load_component_data, get_component_index
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+ORDER_COLUMNS = [
+    Order.order_number, Order.status, Order.created_at, Order.total_amount, Order.payment_id,
+    Order.full_name, Order.email, Order.phone, Order.address_line1, Order.address_line2,
+    Order.city, Order.state, Order.postal_code, Order.country, Order.build_id, Order.build_config,
+]
+ORDER_FIELDS = [column.key for column in ORDER_COLUMNS if column.key != 'build_config']
+CSV_FIELDS = ORDER_FIELDS + [name for category in BUILD_CATEGORIES for name in (f'{category}_id', category)]
+
+# Spreadsheets run cells starting with these as formulas (names and addresses are customer input)
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_date_range(start=None, end=None):
+    """(from, to) datetimes for inclusive YYYY-MM-DD dates, either may be None; raises ValueError."""
+    start = datetime.strptime(start, '%Y-%m-%d') if start else None
+    end = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) if end else None
+    return start, end
+
+
+def validate_statuses(statuses):
+    """The given statuses, or ValueError naming the first unknown one."""
+    known = {status.value for status in OrderStatus}
+    for status in statuses:
+        if status not in known:
+            raise ValueError(f"Unknown order status '{status}'")
+    return list(statuses)
+
+
+def iter_orders(start=None, end=None, statuses=None):
+    """Orders created in [start, end) with one of statuses (all if empty), oldest first, as dicts."""
+    query = select(*ORDER_COLUMNS).order_by(Order.created_at, Order.id)
+    if start:
+        query = query.where(Order.created_at >= start)
+    if end:
+        query = query.where(Order.created_at < end)
+    if statuses:
+        query = query.where(Order.status.in_(statuses))
+
+    components = load_component_data()
+    index = get_component_index()
+    for row in db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE)):
+        order = row._asdict()
+        config = order.pop('build_config') or {}
+        order['created_at'] = order['created_at'].isoformat() if order['created_at'] else None
+        order['components'] = {}
+        for category in BUILD_CATEGORIES:
+            component_id = config.get(category)
+            if component_id:
+                position = index.get(category, {}).get(component_id)
+                name = components[category][position]['name'] if position is not None else component_id
+                order['components'][category] = {'id': component_id, 'name': name}
+        yield order
+
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_row(order):
+    row = {field: order[field] for field in ORDER_FIELDS}
+    for category, component in order['components'].items():
+        row[f'{category}_id'] = component['id']
+        row[category] = component['name']
+    return {field: _csv_value(value) for field, value in row.items()}
+
+
+def stream_export(orders, export_format='csv'):
+    """Encode orders as export_format, yielding chunks of about EXPORT_CHUNK_BYTES."""
+    buffer = io.StringIO()
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    if export_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        write = lambda order: writer.writerow(_csv_row(order))
+        # The header goes out before the query runs
+        yield flush()
+    else:
+        write = lambda order: buffer.write(json.dumps(order, separators=(',', ':')) + '\n')
+
+    first = True
+    for order in orders:
+        write(order)
+        # The first row is sent on its own too, so a slow first batch doesn't look like a hang
+        if first or buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield flush()
+            first = False
+    if buffer.tell():
+        yield flush()
@@ -0,0 +1,131 @@
+"""
+Password hashing off the request thread, with early rejection under load.
+
+Werkzeug's scrypt hash is deliberately slow and memory-hard, so a credential
+stuffing burst on /auth/login used to tie up every worker hashing guesses. Now:
+
+- Hashing runs in a small per-process thread pool (hashlib's scrypt and pbkdf2
+  release the GIL). At most HASH_WORKERS hashes run and HASH_QUEUE_DEPTH wait per
+  process; past that HashingBusy is raised at once instead of queueing. A hash
+  still unfinished after HASH_TIMEOUT also gives HashingBusy, but keeps its slot
+  until it completes, so slow hashes can't push the pool past its bound.
+- Per-IP and per-account token buckets (LoginRateLimiter) reject attempts before
+  any hashing is done. Buckets live in shared memory created at import, so with
+  gunicorn's preload_app all workers draw from the same buckets.
+- Hashes made with older parameters are upgraded to PASSWORD_HASH_METHOD on the
+  next successful login (see User.password_needs_rehash).
+
+Measure login and shop latency during a burst with `python bench_login.py --start`.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+HASH_QUEUE_DEPTH = int(os.environ.get('HASH_QUEUE_DEPTH', 8))
+HASH_TIMEOUT = 10
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool of this process is saturated."""
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_DEPTH)
+
+
+def _get_executor():
+    # Threads do not survive fork, so each worker creates its own pool on first use
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run(func, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = _get_executor().submit(func, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # The slot is freed when the hash is done (or cancelled), not when the caller stops waiting
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        # Drop it if it is still queued; a running hash finishes and then frees its slot
+        future.cancel()
+        raise HashingBusy()
+
+
+def hash_password(password):
+    """Hash a password with the current parameters, in the hashing pool."""
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    """Check a password against its hash, in the hashing pool."""
+    return _run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True if password_hash was made with other parameters than PASSWORD_HASH_METHOD."""
+    return not password_hash or password_hash.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+
+class LoginRateLimiter:
+    """
+    Token buckets in a fixed number of shared-memory slots. Keys are hashed to a
+    slot, so an unrelated key occasionally shares a bucket; with enough slots that
+    only ever makes the limit slightly stricter.
+    """
+
+    def __init__(self, rate, burst, slots=4096):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.slots = slots
+        # (tokens, last refill time) per slot; tokens < 0 marks an unused slot
+        self._state = multiprocessing.Array('d', [-1.0, 0.0] * slots)
+
+    def allow(self, key):
+        """Take a token for key; False if its bucket is empty."""
+        index = 2 * (zlib.crc32(key.encode('utf-8')) % self.slots)
+        now = time.time()
+        with self._state.get_lock():
+            tokens, updated = self._state[index], self._state[index + 1]
+            if tokens < 0:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._state[index] = tokens
+            self._state[index + 1] = now
+        return allowed
+
+
+# 10 attempts per IP then one every 6 seconds; 5 per account then one a minute
+ip_limiter = LoginRateLimiter(rate=1 / 6, burst=10)
+account_limiter = LoginRateLimiter(rate=1 / 60, burst=5)
+
+
+def allow_login_attempt(ip, account=None):
+    """Check the per-IP and per-account buckets before any hashing is done."""
+    if not ip_limiter.allow(f'ip:{ip}'):
+        return False
+    if account and not account_limiter.allow(f'account:{account.strip().lower()}'):
+        return False
+    return True
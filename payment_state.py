@@ -0,0 +1,84 @@
+"""
+Local cache of Stripe checkout session state for the payment success page.
+
+Every checkout.session.* webhook upserts the session's status, payment status and
+payment intent into payment_state as the event is received, before the queue
+worker applies it to the order. Older events never overwrite newer state. The
+success page reads this table first. Only if the webhook hasn't landed yet does
+it make one bounded Stripe call (STRIPE_FALLBACK_TIMEOUT, no retries). The
+answer is cached in the same table. A completed session found this way is also
+queued like a webhook, so the order is only ever updated by the queue worker.
+"""
+import json
+import logging
+import os
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, PaymentState
+
+STRIPE_FALLBACK_TIMEOUT = float(os.environ.get('STRIPE_FALLBACK_TIMEOUT', 3))
+
+PAID_STATUSES = ('paid', 'no_payment_required')
+
+
+def _session_order_id(checkout_session):
+    order_id = checkout_session.get('client_reference_id') or (checkout_session.get('metadata') or {}).get('order_id')
+    try:
+        return int(order_id) if order_id else None
+    except (TypeError, ValueError):
+        return None
+
+
+def record_checkout_session(checkout_session, stripe_created):
+    """Upsert the state of a checkout session object (a dict), unless newer state is already stored."""
+    values = {
+        'session_id': checkout_session['id'],
+        'order_id': _session_order_id(checkout_session),
+        'status': checkout_session.get('status'),
+        'payment_status': checkout_session.get('payment_status'),
+        'payment_intent': checkout_session.get('payment_intent'),
+        'stripe_created': stripe_created,
+    }
+    insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    statement = insert(PaymentState).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=['session_id'],
+        set_={name: statement.excluded[name] for name in values if name != 'session_id'},
+        where=PaymentState.stripe_created <= statement.excluded.stripe_created,
+    )
+    db.session.execute(statement)
+
+
+def is_paid(state):
+    return state is not None and state.payment_status in PAID_STATUSES
+
+
+def get_checkout_state(session_id):
+    """PaymentState for a checkout session, asking Stripe once if no webhook has landed. None if unknown."""
+    state = db.session.get(PaymentState, session_id)
+    if state is not None:
+        return state
+
+    # Imported here as webhook_queue imports this module
+    from stripe_gateway import retrieve_checkout_session
+    from webhook_queue import enqueue_webhook_event, notify_webhook_worker
+    from flask import current_app
+
+    try:
+        checkout_session = retrieve_checkout_session(session_id, read_timeout=STRIPE_FALLBACK_TIMEOUT, max_retries=0)
+    except Exception as e:
+        logging.warning(f"Could not retrieve checkout session {session_id}: {e}")
+        return None
+    data = json.loads(str(checkout_session))
+
+    # Stamped with the session's creation time, so any real webhook supersedes this state
+    created = int(data.get('created') or 0)
+    if data.get('status') == 'complete':
+        event = {'id': f'fallback_{session_id}', 'type': 'checkout.session.completed',
+                 'created': created, 'data': {'object': data}}
+        if enqueue_webhook_event(event, json.dumps(event)):
+            notify_webhook_worker(current_app._get_current_object())
+    else:
+        record_checkout_session(data, created)
+        db.session.commit()
+    return db.session.get(PaymentState, session_id)
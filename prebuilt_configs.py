@@ -1,7 +1,20 @@
+import os
 import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import text
 from app import app
-from utils import load_component_data, calculate_total_price
-from models import db, PreBuiltConfig
+from utils import load_component_data, calculate_total_price, get_catalog_version, BUILD_CATEGORIES
+from models import db, PreBuiltConfig, SeedState
+from build_summaries import summary_columns
+
+# Name of the SeedState row tracking the seeded prebuilt configurations
+SEED_NAME = 'prebuilt_configs'
+
+# Advisory lock key (Postgres) / lock file (other databases) so only one worker seeds
+SEED_LOCK_ID = 7270031
+SEED_LOCK_FILE = os.path.join(tempfile.gettempdir(), 'rigfreaks-prebuilt-seed.lock')
 
 # Define prebuilt configurations
 PREBUILT_CONFIGS = [
@@ -113,44 +126,102 @@ PREBUILT_CONFIGS = [
     }
 ]
 
+def get_prebuilt_hash():
+    """Hash of PREBUILT_CONFIGS plus the catalog version the prices are derived from"""
+    payload = json.dumps(PREBUILT_CONFIGS, sort_keys=True) + get_catalog_version()
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _prebuilt_row_values(config_data):
+    """Column values a PreBuiltConfig row should have for one PREBUILT_CONFIGS entry"""
+    components = config_data["components"]
+    values = {
+        "description": config_data["description"],
+        "category": config_data["category"],
+        # Set price if provided directly, otherwise calculate from components
+        "price": config_data["price"] if "price" in config_data else calculate_total_price(components),
+        "special_features": json.dumps(config_data["special_features"]) if "special_features" in config_data else None,
+    }
+    for category in BUILD_CATEGORIES:
+        values[f"{category}_id"] = components.get(category)
+    # Stored with the row so the prebuilt listing renders without catalog lookups
+    config = {category: components[category] for category in BUILD_CATEGORIES if components.get(category)}
+    values.update(summary_columns(config, f"prebuilt configuration {config_data['name']}"))
+    return values
+
+@contextmanager
+def _seed_lock():
+    """Serialise seeding across gunicorn workers"""
+    if db.engine.dialect.name == 'postgresql':
+        # Released automatically when the seeding transaction commits or rolls back
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:lock_id)'), {'lock_id': SEED_LOCK_ID})
+        yield
+        return
+    
+    import fcntl
+    with open(SEED_LOCK_FILE, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def create_prebuilt_configs():
-    """Create predefined PC configurations in the database"""
+    """Sync predefined PC configurations into the database.
     
-    # Get components data to calculate prices
-    components_data = load_component_data()
+    Does nothing when neither PREBUILT_CONFIGS nor the catalog changed since the
+    last seed; otherwise upserts only the changed rows in a single transaction.
+    """
+    content_hash = get_prebuilt_hash()
     
-    # Clear existing prebuilt configs
-    PreBuiltConfig.query.delete()
+    # Fast path: unchanged deploys boot without touching the table
+    state = db.session.get(SeedState, SEED_NAME)
+    if state and state.content_hash == content_hash:
+        db.session.rollback()
+        return False
     
-    for config_data in PREBUILT_CONFIGS:
-        # Create config object
-        config = PreBuiltConfig(
-            name=config_data["name"],
-            description=config_data["description"],
-            category=config_data["category"]
-        )
+    with _seed_lock():
+        # Another worker may have finished seeding while we waited for the lock
+        db.session.expire_all()
+        state = db.session.get(SeedState, SEED_NAME)
+        if state and state.content_hash == content_hash:
+            db.session.rollback()
+            return False
         
-        # Add component IDs
-        for category, component_id in config_data["components"].items():
-            setattr(config, f"{category}_id", component_id)
+        existing = {config.name: config for config in PreBuiltConfig.query.all()}
+        created = updated = 0
         
-        # Set price if provided directly, otherwise calculate from components
-        if "price" in config_data:
-            config.price = config_data["price"]
-        else:
-            config_dict = config_data["components"]
-            config.price = calculate_total_price(config_dict)
+        for config_data in PREBUILT_CONFIGS:
+            values = _prebuilt_row_values(config_data)
+            config = existing.pop(config_data["name"], None)
+            if config is None:
+                config = PreBuiltConfig(name=config_data["name"], **values)
+                db.session.add(config)
+                created += 1
+                continue
             
-        # Set special features if provided
-        if "special_features" in config_data:
-            config.special_features = json.dumps(config_data["special_features"])
+            changed = False
+            for column, value in values.items():
+                if getattr(config, column) != value:
+                    setattr(config, column, value)
+                    changed = True
+            if changed:
+                updated += 1
+        
+        # Remove configurations that are no longer defined
+        for config in existing.values():
+            db.session.delete(config)
+        
+        if state is None:
+            state = SeedState(name=SEED_NAME, content_hash=content_hash)
+            db.session.add(state)
+        else:
+            state.content_hash = content_hash
         
-        # Add to database
-        db.session.add(config)
+        # Commit changes
+        db.session.commit()
     
-    # Commit changes
-    db.session.commit()
-    print(f"Created {len(PREBUILT_CONFIGS)} pre-built PC configurations")
+    print(f"Synced pre-built PC configurations: {created} created, {updated} updated, {len(existing)} removed")
+    return True
 
 # Run this script with Flask app context
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+"""
+Bulk repricing of stored prices after a catalog price change.
+
+Build.total_price, PreBuiltConfig.price and Cart.total_price are snapshots taken
+when the row was saved. reprice_all() loads the catalog price vector once into a
+temporary component_price table and recomputes builds and prebuilt configs
+set-based: one INSERT ... SELECT of the changed rows into a temporary price_diff
+table, then a single UPDATE ... FROM price_diff per table.
+Cart configurations are JSON documents rather than columns, so carts are recomputed
+in Python and written back with chunked executemany UPDATEs. Orders are never
+repriced.
+
+Run with `flask --app main reprice [--dry-run]`; `flask --app main init-db` runs
+it once per catalog version.
+"""
+import logging
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, bindparam, text
+from models import db, Cart, SeedState
+from utils import load_component_data, get_catalog_version, BUILD_CATEGORIES
+
+SEED_NAME = 'catalog_repricing'
+CART_BATCH_SIZE = 1000
+SAMPLE_SIZE = 10
+
+# Prices are stored as floats; differences below half a cent are not changes
+PRICE_EPSILON = 0.005
+
+_metadata = MetaData()
+component_price = Table(
+    'component_price', _metadata,
+    Column('category', String(20), primary_key=True),
+    Column('component_id', String(20), primary_key=True),
+    Column('price', Float, nullable=False),
+    prefixes=['TEMPORARY'],
+)
+price_diff = Table(
+    'price_diff', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('old_price', Float),
+    Column('new_price', Float, nullable=False),
+    prefixes=['TEMPORARY'],
+)
+
+
+def get_price_vector():
+    """{(category, component id): price} for every component in the current catalog"""
+    return {
+        (category, component['id']): float(component.get('price', 0) or 0)
+        for category, category_components in load_component_data().items()
+        for component in category_components
+    }
+
+
+def _new_price_select(table, price_column):
+    # Current price of each selected component, joined from the temp table; unknown
+    # components cost 0, matching calculate_total_price
+    joins = ' '.join(
+        f"LEFT JOIN component_price AS price_{category} ON price_{category}.category = '{category}' "
+        f"AND price_{category}.component_id = {table}.{category}_id"
+        for category in BUILD_CATEGORIES
+    )
+    new_price = ' + '.join(f"COALESCE(price_{category}.price, 0)" for category in BUILD_CATEGORIES)
+    return f"SELECT {table}.id AS id, {table}.{price_column} AS old_price, {new_price} AS new_price FROM {table} {joins}"
+
+
+def _reprice_table(conn, table, price_column, dry_run, where=None, params=None):
+    """
+    Recompute price_column of every row of table. New prices are computed once into
+    the temp price_diff table (changed rows only), which feeds the report and a
+    single UPDATE ... FROM. Returns a diff report.
+    """
+    select = _new_price_select(table, price_column)
+    if where:
+        select = f"{select} WHERE {where}"
+    clause = text(
+        f"INSERT INTO price_diff (id, old_price, new_price) SELECT id, old_price, new_price FROM ({select}) AS prices "
+        f"WHERE old_price IS NULL OR ABS(old_price - new_price) >= {PRICE_EPSILON}"
+    )
+    for name, value in (params or {}).items():
+        if isinstance(value, (list, tuple)):
+            clause = clause.bindparams(bindparam(name, expanding=True))
+
+    conn.execute(price_diff.delete())
+    conn.execute(clause, params or {})
+
+    report = conn.execute(text(
+        "SELECT COUNT(*) AS changed, COALESCE(SUM(new_price - COALESCE(old_price, 0)), 0) AS delta FROM price_diff"
+    )).one()
+    samples = conn.execute(text(
+        f"SELECT id, old_price, new_price FROM price_diff "
+        f"ORDER BY ABS(new_price - COALESCE(old_price, 0)) DESC LIMIT {SAMPLE_SIZE}"
+    )).all()
+
+    if report.changed and not dry_run:
+        conn.execute(text(
+            f"UPDATE {table} SET {price_column} = price_diff.new_price FROM price_diff WHERE {table}.id = price_diff.id"
+        ))
+
+    return {
+        'changed': report.changed,
+        'delta': round(report.delta, 2),
+        'largest': [(row.id, row.old_price, round(row.new_price, 2)) for row in samples],
+    }
+
+
+def _reprice_carts(prices, dry_run):
+    """Recompute cart totals from their JSON configurations in chunks of CART_BATCH_SIZE"""
+    report = {'changed': 0, 'delta': 0.0, 'largest': []}
+    # A price change is not cart activity, so updated_at (which drives the abandoned-cart purge) is kept
+    cart_table = Cart.__table__
+    update = cart_table.update().where(cart_table.c.id == bindparam('cart_id')) \
+        .values(total_price=bindparam('new_price'), updated_at=cart_table.c.updated_at)
+    last_id = 0
+
+    while True:
+        rows = db.session.query(Cart.id, Cart.total_price, Cart.build_config) \
+            .filter(Cart.id > last_id, Cart.build_config.isnot(None)) \
+            .order_by(Cart.id).limit(CART_BATCH_SIZE).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            new_price = sum(prices.get((category, component_id), 0)
+                            for category, component_id in row.build_config.items())
+            if row.total_price is None or abs(row.total_price - new_price) >= PRICE_EPSILON:
+                updates.append({'cart_id': row.id, 'new_price': new_price})
+                report['delta'] += new_price - (row.total_price or 0)
+                report['largest'].append((row.id, row.total_price, round(new_price, 2)))
+
+        if updates and not dry_run:
+            db.session.execute(update, updates)
+        db.session.commit()
+        report['changed'] += len(updates)
+
+    report['delta'] = round(report['delta'], 2)
+    report['largest'] = sorted(report['largest'], key=lambda d: abs(d[2] - (d[1] or 0)), reverse=True)[:SAMPLE_SIZE]
+    return report
+
+
+def reprice_all(dry_run=False):
+    """
+    Reprice saved builds, prebuilt configs and carts against the current catalog.
+    Returns {table: {'changed', 'delta', 'largest'}} where largest lists up to
+    SAMPLE_SIZE (id, old price, new price) tuples with the biggest changes.
+    """
+    # Imported here as prebuilt_configs imports the app
+    from prebuilt_configs import PREBUILT_CONFIGS
+
+    prices = get_price_vector()
+    report = {}
+
+    with db.engine.begin() as conn:
+        component_price.create(conn)
+        price_diff.create(conn)
+        try:
+            conn.execute(component_price.insert(), [
+                {'category': category, 'component_id': component_id, 'price': price}
+                for (category, component_id), price in prices.items()
+            ])
+            report['build'] = _reprice_table(conn, 'build', 'total_price', dry_run)
+
+            # Prebuilt configs with a fixed price in PREBUILT_CONFIGS keep it
+            derived = [config['name'] for config in PREBUILT_CONFIGS if 'price' not in config]
+            report['pre_built_config'] = _reprice_table(
+                conn, 'pre_built_config', 'price', dry_run,
+                where='pre_built_config.name IN :names',
+                params={'names': derived},
+            ) if derived else {'changed': 0, 'delta': 0.0, 'largest': []}
+        finally:
+            price_diff.drop(conn)
+            component_price.drop(conn)
+
+    report['cart'] = _reprice_carts(prices, dry_run)
+
+    for table, diff in report.items():
+        if diff['changed']:
+            logging.info(f"{'Would reprice' if dry_run else 'Repriced'} {diff['changed']} {table} rows "
+                         f"(total change {diff['delta']:+.2f})")
+    return report
+
+
+def reprice_if_catalog_changed():
+    """Run reprice_all() once per catalog version. Returns the report, or None if already done."""
+    version = get_catalog_version()
+    state = db.session.get(SeedState, SEED_NAME)
+    if state and state.content_hash == version:
+        db.session.rollback()
+        return None
+
+    report = reprice_all()
+
+    state = db.session.get(SeedState, SEED_NAME)
+    if state is None:
+        db.session.add(SeedState(name=SEED_NAME, content_hash=version))
+    else:
+        state.content_hash = version
+    db.session.commit()
+    return report
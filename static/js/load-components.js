@@ -34,8 +34,8 @@ document.addEventListener('DOMContentLoaded', () => {
     // We already have the component type from the active panel
     console.log(`Loading ${componentType} components...`);
 
-    // Load component data from JSON file
-    fetch('/static/data/components.json')
+    // Load only this step's components instead of the whole catalog
+    fetch(`/builder/step/${componentType}?format=json`)
         .then(response => response.json())
         .then(data => {
             console.log('Component data loaded:', data);
@@ -100,7 +100,7 @@ function displayComponents(data, componentType) {
             }
         }
         
-        const card = createComponentCard(component, componentType);
+        const card = createComponentCard(component, componentType, (data.stock || {})[component.id]);
         componentCardsContainer.appendChild(card);
     });
     
@@ -109,7 +109,7 @@ function displayComponents(data, componentType) {
 }
 
 // Create a component card element
-function createComponentCard(component, type) {
+function createComponentCard(component, type, stock) {
     const card = document.createElement('div');
     card.className = 'component-card';
     card.dataset.componentId = component.id;
@@ -127,6 +127,7 @@ function createComponentCard(component, type) {
                 getIconForType(type)}
         </div>
         <div class="component-name">${component.name}</div>
+        ${stockBadge(stock)}
         <div class="component-price">£${component.price.toFixed(2)}</div>
         <button class="btn btn-sm btn-outline-light mt-2 component-details-btn">
             <i class="fas fa-info-circle me-1"></i> View Details
@@ -212,6 +213,11 @@ function setupComponentCardEvents() {
     // Add click events to component cards
     document.querySelectorAll('.component-card').forEach(card => {
         card.addEventListener('click', function() {
+            // Sold out parts stay visible but can't be added to the build
+            if (this.querySelector('.stock-out')) {
+                return;
+            }
+            
             // Remove selected class from all cards
             document.querySelectorAll('.component-card').forEach(c => {
                 c.classList.remove('selected');
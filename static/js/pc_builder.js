@@ -1,3 +1,18 @@
+// Availability badge for a component, from the stock map of /builder/step/<category>?format=json.
+// Matches the badges inventory.apply_stock puts in server-rendered cards.
+function stockBadge(stock) {
+    if (!stock) {
+        return '';
+    }
+    if (!stock.in_stock) {
+        return '<span class="badge bg-danger stock-badge stock-out">Out of stock</span>';
+    }
+    if (stock.low_stock) {
+        return `<span class="badge bg-warning text-dark stock-badge">Only ${stock.available} left</span>`;
+    }
+    return '';
+}
+
 document.addEventListener('DOMContentLoaded', function() {
     console.log('PC Builder script loaded');
     
@@ -276,16 +291,30 @@ document.addEventListener('DOMContentLoaded', function() {
                         }
                     });
                     
-                    // Send to server for compatibility check
-                    fetch('/api/check_compatibility', {
+                    // Tell the server which category changed so it can reuse the previous state
+                    const changedCategory = e.target.getAttribute('data-category');
+                    const previousConfig = form._previousConfig || {};
+                    form._previousConfig = currentConfig;
+                    
+                    // Compatibility and price come back together in a single request
+                    fetch('/api/builder_state', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
                         },
-                        body: JSON.stringify({config: currentConfig}),
+                        body: JSON.stringify({
+                            config: currentConfig,
+                            changed: changedCategory,
+                            previous: previousConfig[changedCategory] || null
+                        }),
                     })
                     .then(response => response.json())
                     .then(data => {
+                        const priceDisplay = document.getElementById('total-price');
+                        if (priceDisplay) {
+                            priceDisplay.textContent = `$${data.total.toFixed(2)}`;
+                        }
+                        
                         const compatibilityAlert = document.getElementById('compatibility-alert');
                         if (!compatibilityAlert) {
                             console.error('Compatibility alert element not found');
@@ -311,26 +340,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         }
                     })
                     .catch(error => {
-                        console.error('Error checking compatibility:', error);
-                    });
-                    
-                    // Update price calculation
-                    fetch('/api/calculate_price', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({config: currentConfig}),
-                    })
-                    .then(response => response.json())
-                    .then(data => {
-                        const priceDisplay = document.getElementById('total-price');
-                        if (priceDisplay) {
-                            priceDisplay.textContent = `$${data.total.toFixed(2)}`;
-                        }
-                    })
-                    .catch(error => {
-                        console.error('Error calculating price:', error);
+                        console.error('Error updating builder state:', error);
                     });
                 }
             });
@@ -457,6 +457,11 @@ class StepBuilder {
             componentCard = componentCardOrId;
         }
         
+        // Sold out parts stay visible but can't be added to the build
+        if (componentCard && componentCard.querySelector('.stock-out')) {
+            return;
+        }
+        
         // Check if this component is already selected
         const isCurrentlySelected = this.buildConfig[category].id === componentId;
         
@@ -603,8 +608,14 @@ class StepBuilder {
             return;
         }
         
-        // Load component data from JSON file
-        fetch('/static/data/components.json')
+        // Steps rendered server-side or on an earlier visit only need their selection refreshed
+        if (componentCardsContainer.dataset.loaded === 'true') {
+            this.refreshSelectedCards(componentCardsContainer, componentType);
+            return;
+        }
+        
+        // Load only this step's components instead of the whole catalog
+        fetch(`/builder/step/${componentType}?format=json`)
             .then(response => response.json())
             .then(data => {
                 // Check if components exist for this type
@@ -666,6 +677,7 @@ class StepBuilder {
                                     this.getIconForType(componentType)}
                             </div>
                             <div class="component-name">${component.name}</div>
+                            ${stockBadge((data.stock || {})[component.id])}
                             <div class="component-price">£${component.price.toFixed(2)}</div>
                             <button class="btn btn-sm btn-outline-light mt-2 component-details-btn">
                                 <i class="fas fa-info-circle me-1"></i> View Details
@@ -690,6 +702,7 @@ class StepBuilder {
                         }
                     });
                     
+                    componentCardsContainer.dataset.loaded = 'true';
                     console.log(`Loaded ${data[componentType].length} ${componentType} components`);
                 } else {
                     // No components found for this type
@@ -720,6 +733,14 @@ class StepBuilder {
     }
     
     // Get icon for component type
+    // Mark the card matching the current build selection for a step
+    refreshSelectedCards(container, componentType) {
+        const selectedId = this.buildConfig[componentType] ? this.buildConfig[componentType].id : null;
+        container.querySelectorAll('.component-card').forEach(card => {
+            card.classList.toggle('selected', card.dataset.componentId === selectedId);
+        });
+    }
+    
     getIconForType(type) {
         switch(type) {
             case 'cpu': return '<i class="fas fa-microchip"></i>';
@@ -0,0 +1,178 @@
+"""
+Mirror of the component catalog as Stripe Products and Prices.
+
+sync_stripe_catalog() gives each catalog component a Stripe Product with a
+default Price and records the ids in the stripe_price lookup table. Checkout
+sessions can then list components by price reference ({'price': id}) instead of
+sending inline product and price data for every part.
+
+The sync is incremental: a component is only sent to Stripe when its name,
+description or price (the fingerprint) changed. Prices are immutable, so a price
+change makes a new Price and deactivates the old one. Components that left the
+catalog are archived. Stripe calls run a few at a time (SYNC_CONCURRENCY), and
+each batch's lookup rows are committed together. Create requests carry an
+idempotency key built from the component and its fingerprint, so a sync
+interrupted between a create and its commit won't duplicate products when rerun.
+
+Run with `flask --app main sync-stripe-catalog`. It does nothing if the current
+catalog version was already synced (--force to check every component anyway).
+"""
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from models import db, SeedState, StripePrice
+from stripe_gateway import create_product, update_product, create_price, update_price
+from utils import load_component_data, get_catalog_version, get_component_index
+
+SEED_NAME = 'stripe_catalog'
+SYNC_BATCH_SIZE = 50
+SYNC_CONCURRENCY = 4
+CURRENCY = 'usd'
+
+
+def unit_amount(component):
+    """Component price in cents"""
+    return int(round(float(component.get('price', 0) or 0) * 100))
+
+
+def product_name(category, component):
+    return f"{category.replace('_', ' ').title()}: {component['name']}"
+
+
+def _product_fields(category, component):
+    fields = {'name': product_name(category, component), 'unit_amount': unit_amount(component)}
+    # Stripe rejects an empty description
+    if component.get('description'):
+        fields['description'] = component['description']
+    return fields
+
+
+def _fingerprint(fields):
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _sync_component(category, component_id, fields, fingerprint, row):
+    """
+    Create or update one component's Product/Price. row is the component's current
+    lookup row as a plain tuple (or None), as this runs outside the app context.
+    Returns (product id, price id, change).
+    """
+    product_params = {key: value for key, value in fields.items() if key != 'unit_amount'}
+    if row is None:
+        product = create_product(dict(
+            product_params,
+            metadata={'category': category, 'component_id': component_id},
+            default_price_data={'currency': CURRENCY, 'unit_amount': fields['unit_amount']},
+        ), idempotency_key=f'catalog-product-{category}-{component_id}-{fingerprint}')
+        return product.id, product.default_price, 'created'
+
+    price_id = row.price_id
+    if fields['unit_amount'] != row.unit_amount:
+        price = create_price({'product': row.product_id, 'currency': CURRENCY, 'unit_amount': fields['unit_amount']},
+                             idempotency_key=f'catalog-price-{category}-{component_id}-{fingerprint}')
+        price_id = price.id
+    update_product(row.product_id, dict(product_params, default_price=price_id))
+    if price_id != row.price_id:
+        update_price(row.price_id, {'active': False})
+        return row.product_id, price_id, 'repriced'
+    return row.product_id, price_id, 'updated'
+
+
+def sync_stripe_catalog(force=False):
+    """
+    Bring the Stripe mirror in line with the catalog. Returns {change: count} for
+    created, updated, repriced, archived and unchanged components, or None if this
+    catalog version was already synced.
+    """
+    version = get_catalog_version()
+    state = db.session.get(SeedState, SEED_NAME)
+    if state and state.content_hash == version and not force:
+        db.session.rollback()
+        return None
+
+    existing = {
+        (row.category, row.component_id): row
+        for row in db.session.query(StripePrice.category, StripePrice.component_id, StripePrice.product_id,
+                                    StripePrice.price_id, StripePrice.unit_amount, StripePrice.fingerprint)
+    }
+    report = {'created': 0, 'updated': 0, 'repriced': 0, 'archived': 0, 'unchanged': 0}
+
+    work = []
+    wanted = set()
+    for category, components in load_component_data().items():
+        for component in components:
+            key = (category, component['id'])
+            wanted.add(key)
+            fields = _product_fields(category, component)
+            fingerprint = _fingerprint(fields)
+            row = existing.get(key)
+            if row is not None and row.fingerprint == fingerprint:
+                report['unchanged'] += 1
+            else:
+                work.append((category, component['id'], fields, fingerprint, row))
+
+    with ThreadPoolExecutor(max_workers=SYNC_CONCURRENCY) as executor:
+        for start in range(0, len(work), SYNC_BATCH_SIZE):
+            batch = work[start:start + SYNC_BATCH_SIZE]
+            results = executor.map(lambda item: _sync_component(*item), batch)
+            for (category, component_id, fields, fingerprint, _), (product_id, price_id, change) in zip(batch, results):
+                db.session.merge(StripePrice(
+                    category=category, component_id=component_id, product_id=product_id,
+                    price_id=price_id, unit_amount=fields['unit_amount'], fingerprint=fingerprint,
+                ))
+                report[change] += 1
+            db.session.commit()
+
+        removed = [row for key, row in existing.items() if key not in wanted]
+        list(executor.map(lambda row: update_product(row.product_id, {'active': False}), removed))
+    for row in removed:
+        db.session.query(StripePrice).filter_by(category=row.category, component_id=row.component_id).delete()
+        report['archived'] += 1
+
+    state = db.session.get(SeedState, SEED_NAME)
+    if state is None:
+        db.session.add(SeedState(name=SEED_NAME, content_hash=version))
+    else:
+        state.content_hash = version
+    db.session.commit()
+
+    logging.info(f"Synced Stripe catalog {version}: {report}")
+    return report
+
+
+def build_line_items(config):
+    """
+    Checkout line items for a {category: component id} configuration. Components
+    mirrored in Stripe at their current price are referenced by price id; any others
+    (not synced yet, or repriced since) fall back to inline price data.
+    """
+    components = load_component_data()
+    index = get_component_index()
+    selected = [(category, component_id) for category, component_id in config.items()
+                if component_id and component_id in index.get(category, {})]
+    if not selected:
+        return []
+
+    prices = {
+        (row.category, row.component_id): row
+        for row in StripePrice.query.filter(StripePrice.component_id.in_([c for _, c in selected])).all()
+    }
+
+    line_items = []
+    for category, component_id in selected:
+        component = components[category][index[category][component_id]]
+        price = prices.get((category, component_id))
+        if price is not None and price.unit_amount == unit_amount(component):
+            line_items.append({'price': price.price_id, 'quantity': 1})
+        else:
+            fields = _product_fields(category, component)
+            line_items.append({
+                'price_data': {
+                    'currency': CURRENCY,
+                    'product_data': {key: value for key, value in fields.items() if key != 'unit_amount'},
+                    'unit_amount': fields['unit_amount'],
+                },
+                'quantity': 1,
+            })
+    return line_items
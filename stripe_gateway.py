@@ -0,0 +1,135 @@
+"""
+Stripe gateway: one pooled, timeout-bounded Stripe client per process.
+
+All outbound Stripe calls go through here instead of the module-global SDK:
+- A requests.Session with a keep-alive connection pool (STRIPE_POOL_SIZE), so
+  checkouts don't pay a TCP/TLS handshake each time.
+- Connect and read timeouts (STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT) instead
+  of the SDK's 80 second default, so a slow Stripe can't hold a worker for long.
+- Up to STRIPE_MAX_RETRIES retries of connection errors, 409s and 5xx responses,
+  with the SDK's exponential backoff and jitter.
+- Idempotency keys derived from the order and the request, so a retried or
+  double-submitted create never makes a second checkout session.
+- Reuse of a still-open checkout session stored in Order.payment_id.
+
+Set STRIPE_API_BASE to point the client elsewhere, e.g. at the local fake in
+fake_stripe.py: `STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_fake`.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+STRIPE_CONNECT_TIMEOUT = float(os.environ.get('STRIPE_CONNECT_TIMEOUT', 3))
+STRIPE_READ_TIMEOUT = float(os.environ.get('STRIPE_READ_TIMEOUT', 10))
+STRIPE_MAX_RETRIES = int(os.environ.get('STRIPE_MAX_RETRIES', 2))
+STRIPE_POOL_SIZE = int(os.environ.get('STRIPE_POOL_SIZE', 10))
+
+# Checkout sessions this close to expiring are replaced rather than reused
+SESSION_REUSE_MARGIN = 300
+
+_session = None
+_session_pid = None
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def get_stripe_client(read_timeout=STRIPE_READ_TIMEOUT):
+    """A StripeClient with the given read timeout, created on first use (the SDK is slow to import)."""
+    global _session, _session_pid
+    with _client_lock:
+        # Pooled sockets must not be shared across fork, so each worker builds its own
+        if _session is None or _session_pid != os.getpid():
+            import requests
+
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _session_pid = os.getpid()
+            _clients.clear()
+
+        # Clients with different timeouts share the one connection pool
+        if read_timeout not in _clients:
+            import stripe
+
+            _clients[read_timeout] = stripe.StripeClient(
+                os.environ.get('STRIPE_SECRET_KEY'),
+                http_client=stripe.RequestsClient(timeout=(STRIPE_CONNECT_TIMEOUT, read_timeout), session=_session),
+                max_network_retries=STRIPE_MAX_RETRIES,
+                base_addresses={'api': STRIPE_API_BASE} if STRIPE_API_BASE else None,
+            )
+        return _clients[read_timeout]
+
+
+def _services(read_timeout=STRIPE_READ_TIMEOUT):
+    # Newer SDKs group the API under StripeClient.v1; older ones expose it directly
+    client = get_stripe_client(read_timeout)
+    return getattr(client, 'v1', client)
+
+
+def idempotency_key(order, purpose, params):
+    """
+    Key for a create request on behalf of order. Identical requests share a key (so
+    Stripe replays the first response); a changed request gets a new one, since
+    Stripe rejects a reused key with different parameters. The session being
+    replaced is part of the key, so an expired session is never replayed.
+    """
+    material = json.dumps([order.payment_id, params], sort_keys=True, default=str)
+    digest = hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+    return f'{purpose}-{order.order_number}-{digest}'
+
+
+def get_open_checkout_session(order):
+    """The order's checkout session if it can still be paid, else None."""
+    # payment_id holds the checkout session until the webhook replaces it with the payment intent
+    if not order.payment_id or not order.payment_id.startswith('cs_'):
+        return None
+    checkout_session = retrieve_checkout_session(order.payment_id)
+    if checkout_session.status != 'open' or not checkout_session.url:
+        return None
+    if checkout_session.expires_at and checkout_session.expires_at < time.time() + SESSION_REUSE_MARGIN:
+        return None
+    return checkout_session
+
+
+def create_checkout_session(order, params):
+    """Create a checkout session for order with an idempotency key derived from it."""
+    return _services().checkout.sessions.create(
+        params=params,
+        options={'idempotency_key': idempotency_key(order, 'checkout', params)},
+    )
+
+
+def retrieve_checkout_session(session_id, read_timeout=STRIPE_READ_TIMEOUT, max_retries=None):
+    options = {} if max_retries is None else {'max_network_retries': max_retries}
+    return _services(read_timeout).checkout.sessions.retrieve(session_id, options=options)
+
+
+def expire_checkout_session(session_id):
+    """Close an open session so it can no longer be paid; raises if it already completed."""
+    return _services().checkout.sessions.expire(session_id)
+
+
+def create_product(params, idempotency_key):
+    return _services().products.create(params=params, options={'idempotency_key': idempotency_key})
+
+
+def update_product(product_id, params):
+    return _services().products.update(product_id, params=params)
+
+
+def create_price(params, idempotency_key):
+    return _services().prices.create(params=params, options={'idempotency_key': idempotency_key})
+
+
+def update_price(price_id, params):
+    return _services().prices.update(price_id, params=params)
+
+
+def construct_webhook_event(payload, sig_header, secret):
+    """Verify a webhook signature and parse the event (no network access or API key needed)."""
+    import stripe
+    return stripe.Webhook.construct_event(payload, sig_header, secret)
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its catalog through paths relative to the project root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+
+@pytest.fixture
+def db_session():
+    """The app's session on a migrated database, emptied again after the test."""
+    from app import app
+    from migrations import upgrade
+    from models import db
+    with app.app_context():
+        db.create_all()
+        upgrade()
+        yield db.session
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name != 'schema_migration':
+                db.session.execute(table.delete())
+        db.session.commit()
+        db.session.remove()
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    """A fake_stripe.py server that the Stripe gateway talks to for the test."""
+    import fake_stripe
+    import stripe_gateway
+    server, fake = fake_stripe.start()
+    monkeypatch.setenv('STRIPE_SECRET_KEY', 'sk_test_fake')
+    monkeypatch.setattr(stripe_gateway, 'STRIPE_API_BASE', fake.base_url)
+    # Clients are cached per timeout; start from fresh ones pointed at the fake
+    monkeypatch.setattr(stripe_gateway, '_clients', {})
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def admin_client(db_session):
+    """A test client logged in as the admin (user 1)."""
+    from app import app
+    from models import User
+    db_session.add(User(id=1, username='admin', email='admin@example.com', password_hash='unused'))
+    db_session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['user_id'] = 1
+    return client
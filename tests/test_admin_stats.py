@@ -0,0 +1,96 @@
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+from admin_stats import get_admin_stats, recount_admin_stats
+from models import Build, ContactMessage, User
+
+
+def _message(db_session, number, created_at=None, is_read=False):
+    message = ContactMessage(name='Ada', email='ada@example.com', subject=f'Subject {number:02d}',
+                             message='Hello', is_read=is_read, created_at=created_at or datetime.utcnow())
+    db_session.add(message)
+    return message
+
+
+def _assert_no_drift():
+    before = get_admin_stats()
+    changes = recount_admin_stats()
+    assert {name: old for name, (old, new) in changes.items() if old is not None} == {}, changes
+    return before
+
+
+def test_counters_follow_inserts_updates_and_deletes(db_session):
+    recount_admin_stats()
+    messages = [_message(db_session, number) for number in range(4)]
+    _message(db_session, 4, is_read=True)
+    user = User(username='ada', email='ada@example.com', password_hash='unused')
+    db_session.add_all([user, Build(name='First build'), Build(name='Second build')])
+    db_session.commit()
+    assert _assert_no_drift() == {'messages': 5, 'unread_messages': 4, 'users': 1, 'builds': 2}
+
+    # A loaded is_read flips, and one set again to its current value
+    messages[0].is_read = True
+    messages[1].is_read = False
+    db_session.commit()
+    # An expired message, whose old is_read is unknown when it is set
+    db_session.expire(messages[2])
+    messages[2].is_read = True
+    db_session.commit()
+    assert _assert_no_drift()['unread_messages'] == 2
+
+    db_session.delete(messages[3])
+    db_session.delete(messages[0])
+    db_session.delete(user)
+    db_session.commit()
+    assert _assert_no_drift() == {'messages': 3, 'unread_messages': 1, 'users': 0, 'builds': 2}
+
+
+def test_recount_corrects_bulk_writes(db_session):
+    recount_admin_stats()
+    _message(db_session, 0)
+    db_session.commit()
+    # Bulk updates bypass the mapper events
+    ContactMessage.query.update({'is_read': True})
+    db_session.commit()
+    assert recount_admin_stats() == {'unread_messages': (1, 0)}
+
+
+def _page(client, **cursor):
+    html = client.get('/admin/messages', query_string=cursor).get_data(as_text=True)
+    subjects = [int(number) for number in re.findall(r'Subject (\d+)', html)]
+    older = re.search(r'after=([\w-]+)', html)
+    newer = re.search(r'before=([\w-]+)', html)
+    return subjects, older and older.group(1), newer and newer.group(1)
+
+
+@pytest.mark.parametrize('count', [10, 11, 25])
+def test_inbox_pages_cover_every_message_once(admin_client, db_session, count):
+    # Messages 5 to 14 share a timestamp, so the tie spans the first page boundary
+    start = datetime(2026, 1, 1)
+    for number in range(count):
+        created_at = start + timedelta(minutes=5 if 5 <= number < 15 else number)
+        _message(db_session, number, created_at=created_at)
+    db_session.commit()
+    expected = [message.subject for message in ContactMessage.query.order_by(
+        ContactMessage.created_at.desc(), ContactMessage.id.desc())]
+    expected = [int(subject.split()[1]) for subject in expected]
+
+    pages = []
+    subjects, older, newer = _page(admin_client)
+    pages.append(subjects)
+    assert newer is None
+    while older:
+        subjects, older, newer = _page(admin_client, after=older)
+        pages.append(subjects)
+        assert newer
+    assert [number for page in pages for number in page] == expected
+    assert all(len(page) == 10 for page in pages[:-1])
+
+    # And back again from the last page
+    back = [pages[-1]]
+    while newer:
+        subjects, older, newer = _page(admin_client, before=newer)
+        back.append(subjects)
+    assert back[::-1] == pages
@@ -0,0 +1,45 @@
+import base64
+import json
+
+from utils import (BUILD_CATEGORIES, BUILD_CODE_CATEGORIES, BUILD_CODE_VERSION_BITS, _build_code_widths,
+                   _catalog_version_tag, decode_build_code, encode_build_code, load_component_data)
+
+
+def test_every_catalog_category_has_a_slot():
+    with open('static/data/components.json') as f:
+        categories = set(json.load(f))
+    assert categories <= set(BUILD_CODE_CATEGORIES)
+
+
+def test_round_trip_covers_every_category_and_component():
+    components = load_component_data()
+    longest = max(len(items) for items in components.values())
+    for i in range(longest):
+        config = {category: items[i % len(items)]['id'] for category, items in components.items() if items}
+        assert decode_build_code(encode_build_code(config)) == config
+
+
+def test_round_trip_keeps_os_on_its_own():
+    components = load_component_data()
+    for item in components['os']:
+        config = {'os': item['id']}
+        assert decode_build_code(encode_build_code(config)) == config
+
+
+def test_codes_without_the_os_slot_still_decode():
+    components = load_component_data()
+    config = {category: components[category][0]['id'] for category in BUILD_CATEGORIES if components.get(category)}
+    widths = _build_code_widths(components, BUILD_CATEGORIES)
+    value = _catalog_version_tag()
+    for category, width in zip(BUILD_CATEGORIES, widths):
+        value = (value << width) | (1 if category in config else 0)
+    packed = value.to_bytes((BUILD_CODE_VERSION_BITS + sum(widths) + 7) // 8, 'big')
+    legacy_code = base64.urlsafe_b64encode(packed).decode('ascii').rstrip('=')
+
+    assert decode_build_code(legacy_code) == config
+
+
+def test_invalid_codes_are_rejected():
+    assert decode_build_code('') is None
+    assert decode_build_code('not a code!') is None
+    assert decode_build_code('AAAA') is None
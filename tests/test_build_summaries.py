@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import build_summaries
+from build_summaries import get_summaries, refresh_summary
+from models import Build
+from utils import calculate_total_price
+
+BUILD = {'cpu': 'amd-ryzen-9-9950x3d', 'storage': 'samsung-990-pro-1tb'}
+
+
+def _broken_builder_state(config):
+    raise KeyError('ram_type')
+
+
+def _build(db_session, **fields):
+    build = Build(name='Test build', is_public=True, **{f'{category}_id': component_id
+                                                        for category, component_id in BUILD.items()}, **fields)
+    db_session.add(build)
+    db_session.commit()
+    return build
+
+
+def test_refresh_summary_survives_catalog_errors(db_session, monkeypatch):
+    monkeypatch.setattr(build_summaries, 'get_builder_state', _broken_builder_state)
+    build = Build(name='Test build', cpu_id='amd-ryzen-9-9950x3d')
+    refresh_summary(build)
+    assert build.summary is None
+    assert build.summary_version is None
+
+
+def test_get_summaries_never_computes(db_session, monkeypatch):
+    stale = _build(db_session, summary=json.dumps({'components': {}, 'price': 1, 'compatible': True,
+                                                   'issue_count': 0, 'tier': 'Entry'}),
+                   summary_version='old')
+    missing = _build(db_session)
+
+    def unexpected(config):
+        pytest.fail('get_summaries computed a summary')
+    monkeypatch.setattr(build_summaries, 'compute_summary', unexpected)
+    monkeypatch.setattr(build_summaries, 'get_builder_state', unexpected)
+
+    summaries = get_summaries([stale, missing])
+    assert summaries[stale.id]['tier'] == 'Entry'
+    placeholder = summaries[missing.id]
+    assert set(placeholder['components']) == set(BUILD)
+    assert placeholder['compatible'] is None
+    assert placeholder['price'] == calculate_total_price(BUILD)
+
+
+def test_gallery_renders_builds_without_summary(db_session, monkeypatch):
+    from app import app
+    monkeypatch.setattr(build_summaries, 'get_builder_state', _broken_builder_state)
+    _build(db_session)
+    response = app.test_client().get('/builds/builds')
+    assert response.status_code == 200
+    assert b'Test build' in response.data
+
+
+def test_product_page_renders_from_stored_summary(db_session, monkeypatch):
+    from app import app
+    from models import PreBuiltConfig
+    performance = {'gaming_1080p': 150, 'gaming_1440p': 110, 'gaming_4k': 60, 'tier': 'Mainstream'}
+    config = PreBuiltConfig(name='Stored PC', category='gaming', cpu_id=BUILD['cpu'],
+                            summary=json.dumps({'components': {}, 'price': 1, 'compatible': True, 'issue_count': 0,
+                                                'tier': 'Mainstream', 'performance': performance}),
+                            summary_version='old')
+    db_session.add(config)
+    db_session.commit()
+
+    def unexpected(config):
+        pytest.fail('the product page ran the builder checks')
+    monkeypatch.setattr(build_summaries, 'get_builder_state', unexpected)
+    monkeypatch.setattr('app.check_compatibility', unexpected)
+
+    response = app.test_client().get(f'/product/{config.id}')
+    assert response.status_code == 200
+    assert b'Stored PC' in response.data
+    assert b'150' in response.data
@@ -0,0 +1,40 @@
+import pytest
+
+from utils import load_component_data
+
+
+@pytest.fixture
+def client(db_session):
+    from app import app
+    return app.test_client()
+
+
+@pytest.mark.parametrize('body', [
+    [],
+    'cpu',
+    {'config': ['cpu']},
+    {'config': {'cpu': 1}},
+    {'config': {'cpu': ['a', 'b']}},
+    {'config': {'not_a_category': 'x'}},
+    {'config': {}, 'changed': 'not_a_category'},
+    {'config': {}, 'changed': ['cpu']},
+    {'config': {}, 'changed': 'cpu', 'previous': {'id': 'x'}},
+])
+def test_malformed_requests_are_rejected(client, body):
+    response = client.post('/api/builder_state', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_non_json_body_is_rejected(client):
+    assert client.post('/api/builder_state', data='config=cpu').status_code == 400
+
+
+def test_valid_request(client):
+    components = load_component_data()
+    cpu = components['cpu'][0]
+    os_choice = components['os'][0]
+    response = client.post('/api/builder_state', json={
+        'config': {'cpu': cpu['id'], 'os': os_choice['id']}, 'changed': 'os', 'previous': None})
+    assert response.status_code == 200
+    assert response.get_json()['total'] == pytest.approx(cpu['price'] + os_choice['price'])
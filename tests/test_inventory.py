@@ -0,0 +1,171 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import inventory
+from inventory import (OutOfStock, commit_order_reservations, release_expired_reservations,
+                       release_order_reservations, reserve_stock)
+from models import ComponentStock, Order, OrderStatus, ReservationStatus, StockReservation
+
+BUILD = {'cpu': 'cpu_1', 'case': 'case_1'}
+
+
+def _order(db_session, number, payment_id=None):
+    order = Order(order_number=number, total_amount=100.0, full_name='Ada Lovelace', email='ada@example.com',
+                  address_line1='1 Main Street', city='London', state='LDN', postal_code='12345', country='GB',
+                  payment_id=payment_id, status=OrderStatus.PENDING.value)
+    db_session.add(order)
+    db_session.flush()
+    return order
+
+
+def _stock(db_session, **available):
+    for key, units in available.items():
+        category, component_id = key.split('__')
+        db_session.add(ComponentStock(category=category, component_id=component_id, available=units))
+    db_session.commit()
+
+
+def _available(db_session, category, component_id):
+    db_session.expire_all()
+    return db_session.get(ComponentStock, (category, component_id)).available
+
+
+def test_last_unit_is_reserved_once(db_session):
+    _stock(db_session, cpu__cpu_1=1, case__case_1=5)
+
+    first = _order(db_session, 'ORD-1')
+    reserve_stock(first, BUILD)
+    db_session.commit()
+
+    second = _order(db_session, 'ORD-2')
+    with pytest.raises(OutOfStock) as excinfo:
+        reserve_stock(second, BUILD)
+    db_session.rollback()
+
+    assert (excinfo.value.category, excinfo.value.component_id) == ('cpu', 'cpu_1')
+    assert _available(db_session, 'cpu', 'cpu_1') == 0
+    # The failed order took nothing, not even the parts that were still in stock
+    assert _available(db_session, 'case', 'case_1') == 4
+    assert StockReservation.query.count() == 2
+
+
+def test_untracked_parts_are_not_reserved(db_session):
+    _stock(db_session, cpu__cpu_1=1)
+    order = _order(db_session, 'ORD-1')
+    reserve_stock(order, {'cpu': 'cpu_1', 'ram': 'ram_untracked'})
+    db_session.commit()
+    assert [(r.category, r.component_id) for r in StockReservation.query] == [('cpu', 'cpu_1')]
+
+
+def test_release_returns_stock_once(db_session):
+    _stock(db_session, cpu__cpu_1=2)
+    order = _order(db_session, 'ORD-1')
+    reserve_stock(order, {'cpu': 'cpu_1'})
+    db_session.commit()
+    assert _available(db_session, 'cpu', 'cpu_1') == 1
+
+    # Cancel, then the expiry webhook and the release job for the same order
+    assert release_order_reservations(order.id) == 1
+    db_session.commit()
+    assert release_order_reservations(order.id) == 0
+    db_session.commit()
+    assert release_expired_reservations() == 0
+
+    assert _available(db_session, 'cpu', 'cpu_1') == 2
+
+
+def test_release_expired_reservations(db_session, monkeypatch):
+    _stock(db_session, cpu__cpu_1=3)
+    expired_sessions = []
+    monkeypatch.setattr(inventory, 'expire_checkout_session', expired_sessions.append)
+
+    stale = _order(db_session, 'ORD-1', payment_id='cs_test_stale')
+    reserve_stock(stale, {'cpu': 'cpu_1'})
+    fresh = _order(db_session, 'ORD-2', payment_id='cs_test_fresh')
+    reserve_stock(fresh, {'cpu': 'cpu_1'})
+    db_session.commit()
+    StockReservation.query.filter_by(order_id=stale.id).update(
+        {'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+    db_session.commit()
+
+    assert release_expired_reservations() == 1
+    assert release_expired_reservations() == 0
+
+    db_session.expire_all()
+    assert expired_sessions == ['cs_test_stale']
+    assert db_session.get(Order, stale.id).status == OrderStatus.CANCELED.value
+    assert db_session.get(Order, fresh.id).status == OrderStatus.PENDING.value
+    assert StockReservation.query.filter_by(order_id=stale.id).one().status == ReservationStatus.RELEASED.value
+    assert _available(db_session, 'cpu', 'cpu_1') == 2
+
+
+def test_release_keeps_orders_whose_session_cannot_be_expired(db_session, monkeypatch):
+    _stock(db_session, cpu__cpu_1=1)
+
+    def unreachable(session_id):
+        raise ConnectionError('Stripe is unreachable')
+    monkeypatch.setattr(inventory, 'expire_checkout_session', unreachable)
+
+    order = _order(db_session, 'ORD-1', payment_id='cs_test_1')
+    reserve_stock(order, {'cpu': 'cpu_1'})
+    db_session.commit()
+    StockReservation.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+    db_session.commit()
+
+    assert release_expired_reservations() == 0
+    db_session.expire_all()
+    assert db_session.get(Order, order.id).status == OrderStatus.PENDING.value
+    assert _available(db_session, 'cpu', 'cpu_1') == 0
+
+
+def test_release_commits_stock_of_orders_paid_meanwhile(db_session):
+    _stock(db_session, cpu__cpu_1=1)
+    order = _order(db_session, 'ORD-1')
+    reserve_stock(order, {'cpu': 'cpu_1'})
+    order.status = OrderStatus.PAID.value
+    db_session.commit()
+    StockReservation.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+    db_session.commit()
+
+    assert release_expired_reservations() == 0
+    db_session.expire_all()
+    assert StockReservation.query.one().status == ReservationStatus.COMMITTED.value
+    assert _available(db_session, 'cpu', 'cpu_1') == 0
+
+
+def test_late_payment_retakes_released_stock(db_session):
+    _stock(db_session, cpu__cpu_1=1)
+    order = _order(db_session, 'ORD-1')
+    reserve_stock(order, {'cpu': 'cpu_1'})
+    db_session.commit()
+    release_order_reservations(order.id)
+    db_session.commit()
+
+    commit_order_reservations(order.id)
+    commit_order_reservations(order.id)
+    db_session.commit()
+    assert _available(db_session, 'cpu', 'cpu_1') == 0
+
+
+def test_payment_intent_commits_reservations(db_session):
+    from webhook_queue import enqueue_webhook_event, process_all_pending_events
+    _stock(db_session, cpu__cpu_1=1)
+    order = _order(db_session, 'ORD-1', payment_id='cs_test_1')
+    reserve_stock(order, {'cpu': 'cpu_1'})
+    db_session.commit()
+
+    event = {'id': 'evt_1', 'type': 'payment_intent.succeeded', 'created': 1,
+             'data': {'object': {'id': 'pi_1', 'metadata': {'order_id': str(order.id)}}}}
+    enqueue_webhook_event(event, json.dumps(event))
+    process_all_pending_events()
+    assert StockReservation.query.one().status == ReservationStatus.COMMITTED.value
+    StockReservation.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+    db_session.commit()
+
+    assert release_expired_reservations() == 0
+    db_session.expire_all()
+    assert db_session.get(Order, order.id).status == OrderStatus.PAID.value
+    assert StockReservation.query.one().status == ReservationStatus.COMMITTED.value
+    assert _available(db_session, 'cpu', 'cpu_1') == 0
@@ -0,0 +1,75 @@
+import pytest
+
+from message_search import search_messages
+from models import ContactMessage
+
+
+def _message(db_session, **fields):
+    values = {'name': 'Ada Lovelace', 'email': 'ada@example.com', 'subject': 'Hello', 'message': 'Hi there'}
+    values.update(fields)
+    message = ContactMessage(**values)
+    db_session.add(message)
+    db_session.commit()
+    return message
+
+
+def _ids(query, **options):
+    return [message.id for message in search_messages(query, **options)[0]]
+
+
+def test_header_matches_outrank_body_matches(db_session):
+    in_body = _message(db_session, message='My graphics card arrived broken')
+    in_subject = _message(db_session, subject='Broken graphics card')
+    _message(db_session, subject='Shipping question')
+    assert _ids('broken') == [in_subject.id, in_body.id]
+
+
+def test_last_word_is_a_prefix(db_session):
+    message = _message(db_session, subject='Motherboard compatibility')
+    assert _ids('motherboard compat') == [message.id]
+    assert _ids('compat motherboard') == []
+
+
+@pytest.mark.parametrize('query, found', [
+    ('ada@example.com', True), ('ORD-1234ABCD', True), ('ada OR', True),
+    ('"unbalanced', False), ('NEAR(ada', False), ('*', False), ('subject:ada', False),
+])
+def test_punctuation_is_not_query_syntax(db_session, query, found):
+    message = _message(db_session, message='About order ORD-1234ABCD', email='ada@example.com')
+    assert _ids(query) == ([message.id] if found else [])
+
+
+def test_read_filter(db_session):
+    unread = _message(db_session, subject='Refund please')
+    read = _message(db_session, subject='Refund status', is_read=True)
+    assert sorted(_ids('refund')) == sorted([unread.id, read.id])
+    assert _ids('refund', is_read=False) == [unread.id]
+    assert _ids('refund', is_read=True) == [read.id]
+
+
+def test_index_follows_updates_and_deletes(db_session):
+    message = _message(db_session, subject='Warranty claim')
+    message.subject = 'Return request'
+    db_session.commit()
+    assert _ids('warranty') == []
+    assert _ids('return') == [message.id]
+
+    db_session.delete(message)
+    db_session.commit()
+    assert _ids('return') == []
+
+
+def test_highlights_escape_user_text(db_session):
+    message = _message(db_session, name='<b>Ada</b>', message='Please <script>help</script> me')
+    highlights = search_messages('ada help')[1][message.id]
+    assert highlights['name'] == '&lt;b&gt;<mark>Ada</mark>&lt;/b&gt;'
+    assert '<mark>help</mark>' in highlights['snippet']
+    assert '<script>' not in highlights['snippet']
+
+
+def test_inbox_search_page(admin_client, db_session):
+    _message(db_session, subject='Overheating CPU')
+    _message(db_session, subject='Shipping question')
+    html = admin_client.get('/admin/messages', query_string={'q': 'overheat'}).get_data(as_text=True)
+    assert '<mark>Overheating</mark> CPU' in html
+    assert 'Shipping question' not in html
@@ -0,0 +1,42 @@
+import csv
+import io
+import json
+
+from order_export import ORDER_FIELDS, stream_export
+
+
+def _order(**fields):
+    order = {field: None for field in ORDER_FIELDS}
+    order.update(order_number='ORD-1234ABCD', status='paid', total_amount=999.0, components={})
+    order.update(fields)
+    return order
+
+
+def _csv_rows(orders):
+    return list(csv.DictReader(io.StringIO(''.join(stream_export(orders, 'csv')))))
+
+
+def test_csv_neutralises_formula_cells():
+    values = ['=HYPERLINK("http://example.com","x")', '+1 555 0100', '-2+3', '@SUM(A1)', '\tTab', '\rCR']
+    rows = _csv_rows([_order(full_name=value) for value in values])
+    assert [row['full_name'] for row in rows] == ["'" + value for value in values]
+
+
+def test_csv_neutralises_component_names():
+    order = _order(components={'cpu': {'id': '=cpu', 'name': '=cmd|"/c calc"!A1'}})
+    row = _csv_rows([order])[0]
+    assert row['cpu_id'] == "'=cpu"
+    assert row['cpu'] == "'=cmd|\"/c calc\"!A1"
+
+
+def test_csv_leaves_ordinary_values_alone():
+    row = _csv_rows([_order(full_name='Ada Lovelace', city='London')])[0]
+    assert row['full_name'] == 'Ada Lovelace'
+    assert row['city'] == 'London'
+    assert row['total_amount'] == '999.0'
+
+
+def test_ndjson_is_written_as_stored():
+    order = _order(full_name='=1+1')
+    lines = ''.join(stream_export([order], 'ndjson')).splitlines()
+    assert json.loads(lines[0])['full_name'] == '=1+1'
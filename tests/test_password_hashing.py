@@ -0,0 +1,119 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import password_hashing
+from password_hashing import HashingBusy, LoginRateLimiter, verify_password
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(password_hashing, 'time', SimpleNamespace(time=clock.time))
+    return clock
+
+
+def test_limiter_allows_a_burst_then_refills(clock):
+    limiter = LoginRateLimiter(rate=1 / 6, burst=3, slots=64)
+    assert [limiter.allow('ip:1') for _ in range(4)] == [True, True, True, False]
+    # Another key has its own bucket
+    assert limiter.allow('ip:2')
+
+    clock.now += 5
+    assert not limiter.allow('ip:1')
+    clock.now += 1.5
+    assert limiter.allow('ip:1')
+    assert not limiter.allow('ip:1')
+
+    # Refills never exceed the burst
+    clock.now += 3600
+    assert [limiter.allow('ip:1') for _ in range(4)] == [True, True, True, False]
+
+
+def _slow_check(release):
+    def check(password_hash, password):
+        release.wait(5)
+        return True
+    return check
+
+
+def test_full_pool_is_busy_at_once(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(password_hashing, 'check_password_hash', _slow_check(release))
+    monkeypatch.setattr(password_hashing, '_slots', threading.BoundedSemaphore(1))
+
+    waiting = threading.Thread(target=verify_password, args=('hash', 'password'))
+    waiting.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    with pytest.raises(HashingBusy):
+        verify_password('hash', 'password')
+    assert time.monotonic() - started < 0.5
+    release.set()
+    waiting.join()
+    assert verify_password('hash', 'password')
+
+
+def test_slow_hash_times_out_but_keeps_its_slot(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(password_hashing, 'check_password_hash', _slow_check(release))
+    monkeypatch.setattr(password_hashing, '_slots', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(password_hashing, 'HASH_TIMEOUT', 0.1)
+
+    with pytest.raises(HashingBusy):
+        verify_password('hash', 'password')
+    # The timed-out hash is still running, so there is no room for another
+    with pytest.raises(HashingBusy):
+        verify_password('hash', 'password')
+    release.set()
+    time.sleep(0.1)
+    assert verify_password('hash', 'password')
+
+
+@pytest.fixture
+def login_client(db_session, monkeypatch):
+    from app import app
+    from models import User
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    monkeypatch.setattr(password_hashing, 'ip_limiter', LoginRateLimiter(rate=1 / 6, burst=10, slots=64))
+    monkeypatch.setattr(password_hashing, 'account_limiter', LoginRateLimiter(rate=1 / 60, burst=5, slots=64))
+    db_session.add(User(username='ada', email='ada@example.com',
+                        password_hash=password_hashing.generate_password_hash('correct horse')))
+    db_session.commit()
+    return app.test_client()
+
+
+def _login(client, password, email='ada@example.com'):
+    return client.post('/auth/login', data={'email': email, 'password': password})
+
+
+def test_login_is_rate_limited_per_account(login_client):
+    assert [_login(login_client, 'wrong').status_code for _ in range(5)] == [200] * 5
+    assert _login(login_client, 'correct horse').status_code == 429
+    # Another account from the same address still gets through
+    assert _login(login_client, 'wrong', email='bob@example.com').status_code == 200
+
+
+def test_login_is_rate_limited_per_address(login_client):
+    statuses = [_login(login_client, 'wrong', email=f'user{n}@example.com').status_code for n in range(11)]
+    assert statuses == [200] * 10 + [429]
+
+
+def test_hash_timeout_answers_429(login_client, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(password_hashing, 'check_password_hash', _slow_check(release))
+    monkeypatch.setattr(password_hashing, 'HASH_TIMEOUT', 0.1)
+    response = _login(login_client, 'correct horse')
+    release.set()
+    assert response.status_code == 429
+    assert b'a lot of login attempts' in response.data
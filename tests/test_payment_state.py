@@ -0,0 +1,70 @@
+import pytest
+
+from models import PaymentState, WebhookEvent
+from payment_state import get_checkout_state, is_paid, record_checkout_session
+
+
+def _session(status, payment_status, session_id='cs_test_1'):
+    return {'id': session_id, 'client_reference_id': '7', 'status': status, 'payment_status': payment_status,
+            'payment_intent': 'pi_test_1' if payment_status == 'paid' else None}
+
+
+def test_older_updates_do_not_overwrite_newer_state(db_session):
+    record_checkout_session(_session('complete', 'paid'), stripe_created=200)
+    record_checkout_session(_session('open', 'unpaid'), stripe_created=100)
+    db_session.commit()
+
+    state = db_session.get(PaymentState, 'cs_test_1')
+    assert (state.status, state.payment_status, state.stripe_created) == ('complete', 'paid', 200)
+
+    record_checkout_session(_session('expired', 'unpaid'), stripe_created=300)
+    db_session.commit()
+    db_session.expire_all()
+    assert db_session.get(PaymentState, 'cs_test_1').status == 'expired'
+
+
+@pytest.fixture
+def notified(monkeypatch):
+    import webhook_queue
+    calls = []
+    monkeypatch.setattr(webhook_queue, 'notify_webhook_worker', calls.append)
+    return calls
+
+
+def test_fallback_queues_completed_sessions(db_session, fake_stripe, notified):
+    from app import app
+    checkout_session = fake_stripe.create_session({'client_reference_id': '7'})
+    fake_stripe.complete_session(checkout_session['id'])
+
+    with app.test_request_context():
+        state = get_checkout_state(checkout_session['id'])
+        assert is_paid(state)
+        event = db_session.get(WebhookEvent, f"fallback_{checkout_session['id']}")
+        assert event.type == 'checkout.session.completed'
+        assert event.order_id == 7
+        assert len(notified) == 1
+
+        # Stored now, so Stripe is not asked again
+        requests = fake_stripe.stats['requests']
+        assert get_checkout_state(checkout_session['id']).session_id == checkout_session['id']
+        assert fake_stripe.stats['requests'] == requests
+
+
+def test_fallback_caches_open_sessions_without_queueing(db_session, fake_stripe, notified):
+    from app import app
+    checkout_session = fake_stripe.create_session({'client_reference_id': '7'})
+
+    with app.test_request_context():
+        state = get_checkout_state(checkout_session['id'])
+    assert state.status == 'open'
+    assert not is_paid(state)
+    assert WebhookEvent.query.count() == 0
+    assert notified == []
+
+
+def test_fallback_is_a_single_attempt(db_session, fake_stripe):
+    fake_stripe.fail_rate = 1.0
+    assert get_checkout_state('cs_test_unknown') is None
+    # Stripe-Should-Retry is set on the failure, but the fallback never retries
+    assert fake_stripe.stats['injected_failures'] == 1
+    assert PaymentState.query.count() == 0
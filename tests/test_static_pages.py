@@ -0,0 +1,68 @@
+import pytest
+
+from app import app, _page_cache
+
+
+@pytest.fixture
+def client():
+    _page_cache.clear()
+    return app.test_client()
+
+
+def test_anonymous_static_page_has_no_vary(client):
+    for _ in range(2):  # the render and the cached copy
+        response = client.get('/faq')
+        assert response.status_code == 200
+        assert 'Vary' not in response.headers
+        assert 'Set-Cookie' not in response.headers
+        assert response.headers['Cache-Control'] == 'public, max-age=86400'
+        assert response.headers['ETag']
+
+
+def test_anonymous_static_page_revalidates(client):
+    etag = client.get('/about').headers['ETag']
+    response = client.get('/about', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'Vary' not in response.headers
+
+
+def test_anonymous_session_gets_the_shared_page(client):
+    with client.session_transaction() as session:
+        session['cart_session_id'] = 'abc'
+    response = client.get('/faq')
+    assert response.headers['Cache-Control'] == 'public, max-age=86400'
+    assert 'Vary' not in response.headers
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_flashes_render_per_visitor(client):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'Saved for later')]
+    response = client.get('/faq')
+    assert 'Saved for later' in response.get_data(as_text=True)
+    assert 'public' not in response.headers.get('Cache-Control', '')
+    assert response.headers['Vary'] == 'Cookie'
+
+
+def test_other_pages_keep_vary(client):
+    response = client.get('/contact')
+    assert response.headers['Vary'] == 'Cookie'
+
+
+def _share_code():
+    from utils import encode_build_code, load_component_data
+    return encode_build_code({'cpu': load_component_data()['cpu'][0]['id']})
+
+
+def test_shared_build_is_public_for_anonymous_visitors(client):
+    response = client.get(f'/summary/{_share_code()}')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=3600'
+
+
+def test_shared_build_with_flashes_is_private(client):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'Saved for later')]
+    response = client.get(f'/summary/{_share_code()}')
+    assert 'Saved for later' in response.get_data(as_text=True)
+    assert response.headers['Cache-Control'] == 'private, max-age=10'
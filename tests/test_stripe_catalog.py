@@ -0,0 +1,22 @@
+from stripe_catalog import build_line_items
+from utils import load_component_data
+
+
+def _component(with_description):
+    for category, items in load_component_data().items():
+        for component in items:
+            if bool(component.get('description')) == with_description:
+                return category, component
+
+
+def test_inline_price_data_omits_empty_descriptions(db_session):
+    described_category, described = _component(True)
+    bare_category, bare = _component(False)
+    line_items = build_line_items({described_category: described['id'], bare_category: bare['id']})
+
+    products = {item['price_data']['product_data']['name']: item['price_data']['product_data']
+                for item in line_items}
+    assert len(products) == 2
+    descriptions = [product.get('description') for product in products.values()]
+    assert described['description'] in descriptions
+    assert all('description' not in product or product['description'] for product in products.values())
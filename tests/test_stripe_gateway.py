@@ -0,0 +1,79 @@
+import functools
+import time
+
+from fake_stripe import Handler
+import stripe_gateway
+from models import Order, OrderStatus
+from stripe_gateway import create_checkout_session, get_open_checkout_session
+
+PARAMS = {'mode': 'payment', 'success_url': 'https://shop.test/ok', 'cancel_url': 'https://shop.test/cancel',
+          'line_items': [{'price_data': {'currency': 'usd', 'product_data': {'name': 'PC'}, 'unit_amount': 100000},
+                          'quantity': 1}]}
+
+
+def _order(db_session):
+    order = Order(order_number='ORD-1', total_amount=1000.0, full_name='Ada Lovelace', email='ada@example.com',
+                  address_line1='1 Main Street', city='London', state='LDN', postal_code='12345', country='GB',
+                  status=OrderStatus.PENDING.value)
+    db_session.add(order)
+    db_session.commit()
+    return order
+
+
+def _pay(client, order):
+    with client.session_transaction() as session:
+        session['current_order_id'] = order.id
+    return client.get('/payment')
+
+
+def test_payment_reuses_the_open_session(db_session, fake_stripe):
+    from app import app
+    order = _order(db_session)
+    client = app.test_client()
+
+    first = _pay(client, order)
+    second = _pay(client, order)
+    assert first.status_code == second.status_code == 302
+    assert first.headers['Location'] == second.headers['Location']
+    assert fake_stripe.stats['sessions_created'] == 1
+
+    # An expired session is replaced rather than reused
+    fake_stripe.sessions[order.payment_id]['status'] = 'expired'
+    third = _pay(client, order)
+    assert third.headers['Location'] != first.headers['Location']
+    assert fake_stripe.stats['sessions_created'] == 2
+
+
+def test_identical_creates_share_an_idempotency_key(db_session, fake_stripe):
+    order = _order(db_session)
+    first = create_checkout_session(order, PARAMS)
+    second = create_checkout_session(order, PARAMS)
+    assert first.id == second.id
+    assert fake_stripe.stats['sessions_created'] == 1
+    assert fake_stripe.stats['idempotent_replays'] == 1
+
+    # Once the order points at a session, a new create for it gets a new key
+    order.payment_id = first.id
+    assert create_checkout_session(order, PARAMS).id != first.id
+
+
+def test_timed_out_create_is_retried_with_the_same_key(db_session, fake_stripe, monkeypatch):
+    order = _order(db_session)
+    monkeypatch.setattr(stripe_gateway, '_services', functools.partial(stripe_gateway._services, 0.5))
+
+    # Stripe creates the session but its first response is slower than the read timeout
+    original_send = Handler._send
+    delayed = []
+
+    def slow_first_send(handler, status, body, headers=None):
+        if handler.command == 'POST' and not delayed:
+            delayed.append(handler.path)
+            time.sleep(1.5)
+        return original_send(handler, status, body, headers)
+    monkeypatch.setattr(Handler, '_send', slow_first_send)
+
+    checkout_session = create_checkout_session(order, PARAMS)
+    assert delayed == ['/v1/checkout/sessions']
+    assert fake_stripe.stats['sessions_created'] == 1
+    assert fake_stripe.stats['idempotent_replays'] == 1
+    assert checkout_session.id in fake_stripe.sessions
@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import text
+
+import user_cache
+from models import User
+from user_cache import get_user_principal, invalidate_user_cache
+
+
+@pytest.fixture
+def user(db_session):
+    invalidate_user_cache()
+    user = User(username='ada', email='ada@example.com', password_hash='unused')
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+
+def _rename_behind_the_orm(db_session, user_id, username):
+    # Raw SQL skips the ORM events, so only a cache miss can see it
+    db_session.execute(text('UPDATE "user" SET username = :username WHERE id = :id'),
+                       {'username': username, 'id': user_id})
+    db_session.commit()
+
+
+def test_principal_is_cached(db_session, user):
+    assert get_user_principal(user.id).username == 'ada'
+    _rename_behind_the_orm(db_session, user.id, 'changed')
+    assert get_user_principal(user.id).username == 'ada'
+
+
+def test_username_and_email_changes_invalidate(db_session, user):
+    get_user_principal(user.id)
+    user.username = 'lovelace'
+    user.email = 'lovelace@example.com'
+    db_session.commit()
+    principal = get_user_principal(user.id)
+    assert (principal.username, principal.email) == ('lovelace', 'lovelace@example.com')
+
+
+def test_invalidation_waits_for_commit(db_session, user):
+    get_user_principal(user.id)
+    version = user_cache._version.value
+    user.username = 'lovelace'
+    db_session.flush()
+    assert user_cache._version.value == version
+    db_session.commit()
+    assert user_cache._version.value == version + 1
+
+
+def test_rolled_back_changes_do_not_invalidate(db_session, user):
+    get_user_principal(user.id)
+    version = user_cache._version.value
+    user.username = 'lovelace'
+    db_session.flush()
+    db_session.rollback()
+    assert user_cache._version.value == version
+    assert get_user_principal(user.id).username == 'ada'
+
+
+def test_deleted_user_is_gone(db_session, user):
+    user_id = user.id
+    get_user_principal(user_id)
+    db_session.delete(user)
+    db_session.commit()
+    assert get_user_principal(user_id) is None
+
+
+def test_entries_expire(db_session, user, monkeypatch):
+    monkeypatch.setattr(user_cache, 'USER_CACHE_TTL', 0)
+    get_user_principal(user.id)
+    _rename_behind_the_orm(db_session, user.id, 'changed')
+    assert get_user_principal(user.id).username == 'changed'
@@ -0,0 +1,92 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import webhook_queue
+from models import WebhookEvent, WebhookEventStatus
+from webhook_queue import WEBHOOK_RETRY_DELAY, enqueue_webhook_event, process_all_pending_events
+
+
+def _enqueue(event_id, event_type='test.event', created=1):
+    event = {'id': event_id, 'type': event_type, 'created': created, 'data': {'object': {}}}
+    return enqueue_webhook_event(event, json.dumps(event))
+
+
+def test_redelivered_event_is_stored_once(db_session):
+    assert _enqueue('evt_1', 'payment_intent.succeeded')
+    assert not _enqueue('evt_1', 'payment_intent.succeeded')
+    assert WebhookEvent.query.count() == 1
+
+
+def test_failed_event_waits_before_retrying(db_session, monkeypatch):
+    calls = []
+
+    def failing(event):
+        calls.append(event['id'])
+        raise RuntimeError('boom')
+    monkeypatch.setitem(webhook_queue.EVENT_HANDLERS, 'test.event', failing)
+    _enqueue('evt_1')
+
+    process_all_pending_events()
+    process_all_pending_events()
+    assert calls == ['evt_1']
+
+    event = db_session.get(WebhookEvent, 'evt_1')
+    assert event.status == WebhookEventStatus.PENDING.value
+    assert event.attempts == 1
+    assert event.last_error == 'boom'
+    assert event.next_attempt_at > datetime.utcnow() + timedelta(seconds=WEBHOOK_RETRY_DELAY - 5)
+
+    # Due again: retried, and the delay doubles
+    event.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db_session.commit()
+    process_all_pending_events()
+    assert calls == ['evt_1', 'evt_1']
+    event = db_session.get(WebhookEvent, 'evt_1')
+    assert event.attempts == 2
+    assert event.next_attempt_at > datetime.utcnow() + timedelta(seconds=2 * WEBHOOK_RETRY_DELAY - 5)
+
+
+def test_event_fails_for_good_after_max_attempts(db_session, monkeypatch):
+    def failing(event):
+        raise RuntimeError('boom')
+    monkeypatch.setitem(webhook_queue.EVENT_HANDLERS, 'test.event', failing)
+    monkeypatch.setattr(webhook_queue, 'WEBHOOK_RETRY_DELAY', 0)
+    _enqueue('evt_1')
+
+    for _ in range(webhook_queue.WEBHOOK_MAX_ATTEMPTS + 2):
+        process_all_pending_events()
+    event = db_session.get(WebhookEvent, 'evt_1')
+    assert event.status == WebhookEventStatus.FAILED.value
+    assert event.attempts == webhook_queue.WEBHOOK_MAX_ATTEMPTS
+
+
+def test_unknown_event_types_are_ignored(db_session):
+    _enqueue('evt_1', 'customer.created')
+    process_all_pending_events()
+    assert db_session.get(WebhookEvent, 'evt_1').status == WebhookEventStatus.IGNORED.value
+
+
+@pytest.mark.parametrize('body', ['[]', '"x"', '42', 'null', '{}', '{"id": "evt_1"}', '{"id": 1, "type": "x"}',
+                                  '{"id": "evt_1", "type": "x", "data": []}',
+                                  '{"id": "evt_1", "type": "x", "data": {"object": "x"}}', 'not json'])
+def test_webhook_rejects_malformed_events(db_session, monkeypatch, body):
+    from app import app
+    monkeypatch.delenv('STRIPE_WEBHOOK_SECRET', raising=False)
+    response = app.test_client().post('/webhook', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert WebhookEvent.query.count() == 0
+
+
+def test_webhook_queues_valid_events(db_session, monkeypatch):
+    import cart
+    from app import app
+    monkeypatch.delenv('STRIPE_WEBHOOK_SECRET', raising=False)
+    woken = []
+    monkeypatch.setattr(cart, 'notify_webhook_worker', woken.append)
+    body = json.dumps({'id': 'evt_1', 'type': 'customer.created', 'created': 1, 'data': {'object': {}}})
+    response = app.test_client().post('/webhook', data=body, content_type='application/json')
+    assert response.status_code == 200
+    assert WebhookEvent.query.count() == 1
+    assert len(woken) == 1
@@ -0,0 +1,110 @@
+"""
+Per-process cache of lightweight user principals.
+
+Flask-Login's user loader and admin_required both need the logged-in user on every
+request. Instead of a primary-key query each time, they read a UserPrincipal (id,
+username, email, created_at) from a small TTL/LRU cache.
+
+Invalidation: ORM events note which users a session updates or deletes, and once
+that session commits a version counter is bumped; entries filled under an older
+version are refreshed on their next lookup. Bumping only after the commit matters:
+bumped any earlier, another worker could re-read the old row and cache it under the
+new version, and the stale principal would outlive the change. The counter lives in
+shared memory created at import, so with gunicorn's preload_app every worker forked
+from the master sees the bump. Processes that do not share it (CLI commands, other
+hosts) are bounded by USER_CACHE_TTL instead.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models import db, User
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+
+# Shared between forked workers; bumped on every committed User update or delete
+_version = multiprocessing.Value('Q', 0)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Session.info key for the ids of users changed in the session's current transaction
+_CHANGED_USERS_KEY = 'user_cache_changed_ids'
+
+
+class UserPrincipal(UserMixin):
+    """Read-only snapshot of the User fields needed by request handling and templates"""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.created_at = user.created_at
+
+    def __repr__(self):
+        return f'<UserPrincipal {self.username}>'
+
+
+def get_user_principal(user_id):
+    """UserPrincipal for user_id, or None if there is no such user. Misses are not cached."""
+    if user_id is None:
+        return None
+    user_id = int(user_id)
+    version = _version.value
+    now = time.monotonic()
+
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is not None:
+            principal, entry_version, expires = entry
+            if entry_version == version and now < expires:
+                _cache.move_to_end(user_id)
+                return principal
+            del _cache[user_id]
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    principal = UserPrincipal(user)
+
+    with _cache_lock:
+        _cache[user_id] = (principal, version, now + USER_CACHE_TTL)
+        if len(_cache) > USER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return principal
+
+
+def invalidate_user_cache():
+    """Make every worker refresh its cached principals on their next lookup."""
+    with _version.get_lock():
+        _version.value += 1
+    with _cache_lock:
+        _cache.clear()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_CHANGED_USERS_KEY, set()).add(target.id)
+    else:
+        invalidate_user_cache()
+
+
+@event.listens_for(Session, 'after_commit')
+def _session_committed(session):
+    if session.info.pop(_CHANGED_USERS_KEY, None):
+        invalidate_user_cache()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _session_rolled_back(session, previous_transaction):
+    # Only the outermost rollback discards the changes; a savepoint rollback keeps the
+    # rest of the transaction, so its users stay recorded (over-invalidating is harmless)
+    if previous_transaction.parent is None:
+        session.info.pop(_CHANGED_USERS_KEY, None)
@@ -1,28 +1,108 @@
 import json
+import logging
+import os
 import functools
 import time
+import base64
+import binascii
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
 
-# Cache for component data and compatibility rules
-_component_cache = {'data': None, 'timestamp': 0}
-_rules_cache = {'data': None, 'timestamp': 0}
-CACHE_LIFETIME = 300  # Cache lifetime in seconds (5 minutes)
+# Cache for component data and compatibility rules. Files are re-read only when their
+# mtime or size changes (checked at most every CATALOG_CHECK_INTERVAL seconds), and the
+# parsed data is only replaced when the contents differ.
+_component_cache = {'data': None, 'checked': 0, 'stat': None, 'version': None, 'index': None}
+_rules_cache = {'data': None, 'checked': 0, 'stat': None, 'version': None}
+CATALOG_CHECK_INTERVAL = 30  # Seconds between file change checks
+
+# Set by freeze_catalog() when gunicorn preloads the app: workers then keep the copy
+# they share with the master, and a catalog change needs a reload (kill -HUP master)
+_catalog_frozen = False
+
+# Component categories that make up a complete build
+BUILD_CATEGORIES = ['cpu', 'motherboard', 'ram', 'gpu', 'storage', 'power_supply', 'case', 'cooling']
+
+# Build code slot order: every builder step, including the optional operating system.
+# New categories go at the end, with the previous list kept in BUILD_CODE_LEGACY_LAYOUTS.
+BUILD_CODE_CATEGORIES = BUILD_CATEGORIES + ['os']
+
+# Slot orders of older build codes that are still decoded
+BUILD_CODE_LEGACY_LAYOUTS = [BUILD_CATEGORIES]
+
+# Number of bits of the catalog version stored in a build code
+BUILD_CODE_VERSION_BITS = 16
+
+# LRU cache of rendered catalog fragments, emptied whenever the catalog version changes
+_fragment_cache = {'version': None, 'entries': OrderedDict()}
+_fragment_cache_lock = threading.Lock()
+FRAGMENT_CACHE_SIZE = 256  # Maximum number of cached fragments
+
+# Recently computed builder states, keyed by the (category, component_id) pairs of a config
+_builder_state_cache = OrderedDict()
+_builder_state_cache_lock = threading.Lock()
+BUILDER_STATE_CACHE_SIZE = 1024  # Maximum number of cached builder states
+
+# Categories whose selection feeds into the performance summary
+PERFORMANCE_CATEGORIES = ('cpu', 'gpu', 'ram')
+
+# Matches <!--sel:ID-->selected markup<!--else-->unselected markup<!--/sel--> in fragments
+_SELECTION_PATTERN = re.compile(r'<!--sel:(.*?)-->(.*?)(?:<!--else-->(.*?))?<!--/sel-->', re.S)
+
+# Re-read a JSON file into cache if it changed on disk; returns True if the data was replaced
+def _refresh_json_cache(cache, path):
+    now = time.time()
+    if cache['data'] is not None and (_catalog_frozen or now - cache['checked'] < CATALOG_CHECK_INTERVAL):
+        return False
+    cache['checked'] = now
+
+    stat = os.stat(path)
+    stat = (stat.st_mtime_ns, stat.st_size)
+    if cache['data'] is not None and stat == cache['stat']:
+        return False
+    cache['stat'] = stat
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+    version = hashlib.sha1(raw).hexdigest()[:12]
+    if cache['data'] is not None and version == cache['version']:
+        # Touched but unchanged: keep the parsed copy (and any pages shared with the master)
+        return False
+    cache['data'] = json.loads(raw)
+    cache['version'] = version
+    return True
 
 # Load component data with caching
 def load_component_data():
-    current_time = time.time()
-    if _component_cache['data'] is None or current_time - _component_cache['timestamp'] > CACHE_LIFETIME:
-        with open('static/data/components.json', 'r') as f:
-            _component_cache['data'] = json.load(f)
-            _component_cache['timestamp'] = current_time
+    if _refresh_json_cache(_component_cache, 'static/data/components.json'):
+        _component_cache['index'] = {
+            category: {c['id']: position for position, c in enumerate(items)}
+            for category, items in _component_cache['data'].items()
+        }
     return _component_cache['data']
 
+# Stop checking the catalog files for changes (called once the preloaded master has warmed them)
+def freeze_catalog():
+    global _catalog_frozen
+    load_component_data()
+    load_compatibility_rules()
+    _catalog_frozen = True
+
+# Get a short hash identifying the currently loaded component catalog
+def get_catalog_version():
+    load_component_data()
+    return _component_cache['version']
+
+# Get the {category: {component_id: position}} index of the current catalog
+def get_component_index():
+    load_component_data()
+    return _component_cache['index']
+
 # Load compatibility rules with caching
 def load_compatibility_rules():
-    current_time = time.time()
-    if _rules_cache['data'] is None or current_time - _rules_cache['timestamp'] > CACHE_LIFETIME:
-        with open('static/data/compatibility_rules.json', 'r') as f:
-            _rules_cache['data'] = json.load(f)
-            _rules_cache['timestamp'] = current_time
+    _refresh_json_cache(_rules_cache, 'static/data/compatibility_rules.json')
     return _rules_cache['data']
 
 # Helper function to get component data by ID efficiently 
@@ -98,4 +178,177 @@ def calculate_total_price(config):
         if component:
             total += component.get('price', 0)
     
-    return total
\ No newline at end of file
+    return total
+
+# Leading bits of the catalog version, embedded in build codes
+def _catalog_version_tag():
+    version = get_catalog_version()
+    return int(version, 16) >> (len(version) * 4 - BUILD_CODE_VERSION_BITS)
+
+# Bit width needed to store "catalog position + 1" for a category (0 means not selected)
+def _build_code_widths(components, categories=BUILD_CODE_CATEGORIES):
+    return [len(components.get(category, [])).bit_length() for category in categories]
+
+# Encode a configuration as a compact, URL-safe build code
+def encode_build_code(config):
+    components = load_component_data()
+    index = get_component_index()
+    widths = _build_code_widths(components)
+
+    value = _catalog_version_tag()
+    for category, width in zip(BUILD_CODE_CATEGORIES, widths):
+        position = index.get(category, {}).get(config.get(category)) if config else None
+        value = (value << width) | (0 if position is None else position + 1)
+
+    total_bits = BUILD_CODE_VERSION_BITS + sum(widths)
+    packed = value.to_bytes((total_bits + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(packed).decode('ascii').rstrip('=')
+
+# Unpack the slots of a build code laid out as categories, or None if it doesn't fit
+# that layout or was created against a different catalog version
+def _decode_build_slots(packed, components, categories):
+    widths = _build_code_widths(components, categories)
+    if len(packed) != (BUILD_CODE_VERSION_BITS + sum(widths) + 7) // 8:
+        return None
+
+    value = int.from_bytes(packed, 'big')
+    config = {}
+    for category, width in reversed(list(zip(categories, widths))):
+        slot = value & ((1 << width) - 1)
+        value >>= width
+        if slot:
+            items = components.get(category, [])
+            if slot > len(items):
+                return None
+            config[category] = items[slot - 1]['id']
+
+    if value != _catalog_version_tag():
+        return None
+    return config
+
+# Decode a build code back into a configuration, or None if it is invalid or
+# was created against a different catalog version
+def decode_build_code(code):
+    if not code:
+        return None
+
+    try:
+        packed = base64.urlsafe_b64decode(code + '=' * (-len(code) % 4))
+    except (binascii.Error, ValueError):
+        return None
+
+    components = load_component_data()
+    for categories in [BUILD_CODE_CATEGORIES] + BUILD_CODE_LEGACY_LAYOUTS:
+        config = _decode_build_slots(packed, components, categories)
+        if config is not None:
+            # Keep the usual category order for templates that iterate the config
+            return {category: config[category] for category in BUILD_CODE_CATEGORIES if category in config}
+    return None
+
+# Get a rendered fragment from the LRU cache, calling render() on a miss.
+# Keys are combined with the catalog version so a catalog reload invalidates them.
+# The lock only covers the cache itself; two threads missing the same key both render.
+def get_cached_fragment(key, render):
+    version = get_catalog_version()
+    entries = _fragment_cache['entries']
+    with _fragment_cache_lock:
+        if _fragment_cache['version'] != version:
+            entries.clear()
+            _fragment_cache['version'] = version
+
+        fragment = entries.get(key)
+        if fragment is not None:
+            entries.move_to_end(key)
+            return fragment
+
+    fragment = render()
+    with _fragment_cache_lock:
+        if _fragment_cache['version'] == version:
+            entries[key] = fragment
+            if len(entries) > FRAGMENT_CACHE_SIZE:
+                entries.popitem(last=False)
+    return fragment
+
+# Inject per-user selection state into a cached fragment by resolving its sel markers
+def apply_selection(fragment, selected_id):
+    def choose(match):
+        if match.group(1) == selected_id:
+            return match.group(2)
+        return match.group(3) or ''
+    return _SELECTION_PATTERN.sub(choose, fragment)
+
+# Get compatibility issues, total price, per-category subtotals and the performance
+# summary for a configuration in one call. When the caller says which category
+# changed (and what it was before), the previous state is reused where possible.
+def get_builder_state(config, changed=None, previous=None):
+    config = {category: component_id for category, component_id in (config or {}).items() if component_id}
+    key = (get_catalog_version(), tuple(sorted(config.items())))
+    with _builder_state_cache_lock:
+        state = _builder_state_cache.get(key)
+        if state is not None:
+            _builder_state_cache.move_to_end(key)
+            return state
+
+    base = None
+    if changed:
+        base_config = dict(config)
+        if previous:
+            base_config[changed] = previous
+        else:
+            base_config.pop(changed, None)
+        with _builder_state_cache_lock:
+            base = _builder_state_cache.get((key[0], tuple(sorted(base_config.items()))))
+
+    components = load_component_data()
+    if base is not None:
+        # Only the changed category's subtotal needs a catalog lookup
+        subtotals = {category: price for category, price in base['subtotals'].items() if category != changed}
+        categories = [changed] if changed in config else []
+    else:
+        subtotals = {}
+        categories = list(config)
+    for category in categories:
+        component = get_component_by_id(components, category, config[category])
+        if component:
+            subtotals[category] = component.get('price', 0)
+
+    if base is not None and changed not in PERFORMANCE_CATEGORIES:
+        performance = base['performance']
+    else:
+        performance = None
+        if 'cpu' in config and 'gpu' in config:
+            try:
+                # Lazy import for better performance
+                from benchmarks import get_performance_summary
+                performance = get_performance_summary(config)
+            except Exception as e:
+                logging.error(f"Error retrieving performance summary: {str(e)}")
+
+    issues = check_compatibility(config)
+    state = {
+        'compatible': len(issues) == 0,
+        'issues': issues,
+        'total': sum(subtotals.values()),
+        'subtotals': subtotals,
+        'performance': performance,
+    }
+
+    with _builder_state_cache_lock:
+        _builder_state_cache[key] = state
+        if len(_builder_state_cache) > BUILDER_STATE_CACHE_SIZE:
+            _builder_state_cache.popitem(last=False)
+    return state
+
+# Opaque keyset pagination cursor for the last row on a page: base64url of [created_at, id]
+def encode_keyset_cursor(row):
+    raw = json.dumps([row.created_at.isoformat(), row.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+# Returns (created_at, id), or None if the cursor is malformed
+def decode_keyset_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        return None
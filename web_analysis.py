@@ -1,6 +1,7 @@
-import trafilatura
-
 def get_website_text_content(url):
+    # Imported lazily: trafilatura is heavy and only needed when this script runs
+    import trafilatura
+    
     # Send a request to the website
     downloaded = trafilatura.fetch_url(url)
     if downloaded:
@@ -13,11 +14,12 @@ urls = [
     "https://www.pcspecialist.co.uk"
 ]
 
-for url in urls:
-    print(f"\n=== Analyzing {url} ===\n")
-    content = get_website_text_content(url)
-    if content:
-        print(f"Content length: {len(content)} characters")
-        print(f"Preview: {content[:500]}...")
-    else:
-        print(f"Failed to retrieve content from {url}")
\ No newline at end of file
+if __name__ == '__main__':
+    for url in urls:
+        print(f"\n=== Analyzing {url} ===\n")
+        content = get_website_text_content(url)
+        if content:
+            print(f"Content length: {len(content)} characters")
+            print(f"Preview: {content[:500]}...")
+        else:
+            print(f"Failed to retrieve content from {url}")
@@ -0,0 +1,240 @@
+"""
+Durable queue for Stripe webhook events.
+
+The /webhook endpoint only verifies the signature and inserts the event into
+webhook_event, keyed by the Stripe event id, then answers 200. A redelivered event
+hits the primary key and costs a single no-op INSERT. The state of checkout
+sessions is also recorded right away in payment_state (see payment_state.py).
+
+A background thread in each web process (started when the gunicorn worker boots,
+see gunicorn.conf.py) processes pending events in batches. Batches are taken
+oldest first, but workers skip each other's locked rows, so two events for one
+order can be applied by different workers in either order, and a retried event
+runs after newer ones. Correctness doesn't depend on the order: each event is
+applied in its own savepoint with the order row locked, and handlers only ever
+move an order's status forward, so a late or repeated event can't roll an order
+back and applying an event twice changes nothing. One bad event never blocks the
+rest; failed events are retried up to WEBHOOK_MAX_ATTEMPTS times, after a delay
+that doubles from WEBHOOK_RETRY_DELAY.
+
+Events left pending by a restart are picked up within WEBHOOK_POLL_INTERVAL of
+the workers booting; `flask --app main process-webhooks` applies them by hand.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Order, OrderStatus, WebhookEvent, WebhookEventStatus
+from payment_state import record_checkout_session
+from inventory import commit_order_reservations, release_order_reservations
+
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_RETRY_DELAY = 30  # Seconds before the first retry; doubles after each failure
+WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', 5))
+
+# Short pause after a wake-up so a burst of deliveries is processed as one batch
+WEBHOOK_BATCH_WINDOW = 0.2
+
+# How far each status is along the order lifecycle; canceled and refunded are final
+STATUS_PROGRESS = {
+    OrderStatus.PENDING.value: 0,
+    OrderStatus.PAID.value: 1,
+    OrderStatus.PROCESSING.value: 2,
+    OrderStatus.SHIPPED.value: 3,
+    OrderStatus.DELIVERED.value: 4,
+    OrderStatus.CANCELED.value: 5,
+    OrderStatus.REFUNDED.value: 5,
+}
+
+
+def _event_order_id(event):
+    obj = event.get('data', {}).get('object', {})
+    order_id = obj.get('client_reference_id') or (obj.get('metadata') or {}).get('order_id')
+    try:
+        return int(order_id) if order_id else None
+    except (TypeError, ValueError):
+        return None
+
+
+def enqueue_webhook_event(event, payload):
+    """Store a verified event unless it is already stored. Returns True if it was new."""
+    values = {
+        'id': event['id'],
+        'type': event['type'],
+        'stripe_created': int(event.get('created') or time.time()),
+        'order_id': _event_order_id(event),
+        'payload': payload if isinstance(payload, str) else payload.decode('utf-8'),
+        'status': WebhookEventStatus.PENDING.value,
+        'attempts': 0,
+        'received_at': datetime.utcnow(),
+    }
+    insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    result = db.session.execute(insert(WebhookEvent).values(**values).on_conflict_do_nothing(index_elements=['id']))
+    is_new = result.rowcount == 1
+
+    # Checkout session state is cached at once for the success page (see payment_state.py)
+    if is_new and event['type'].startswith('checkout.session.'):
+        record_checkout_session(event['data']['object'], values['stripe_created'])
+    db.session.commit()
+    return is_new
+
+
+def _advance_status(order, status):
+    if STATUS_PROGRESS.get(status, 0) > STATUS_PROGRESS.get(order.status, 0):
+        order.status = status
+
+
+def _lock_order(order_id):
+    return db.session.get(Order, order_id, with_for_update=True) if order_id else None
+
+
+def _checkout_session_completed(event):
+    session = event['data']['object']
+    order = _lock_order(_event_order_id(event))
+    if not order and session.get('id'):
+        order = Order.query.filter_by(payment_id=session['id']).with_for_update().first()
+    if not order:
+        logging.warning(f"Webhook {event['id']}: no order for checkout session {session.get('id')}")
+        return
+
+    _advance_status(order, OrderStatus.PAID.value)
+    if order.status != OrderStatus.CANCELED.value:
+        commit_order_reservations(order.id)
+
+    # Record the payment intent in place of the checkout session
+    if session.get('payment_intent'):
+        order.payment_id = session['payment_intent']
+
+    shipping = session.get('shipping')
+    if shipping:
+        if shipping.get('address'):
+            addr = shipping['address']
+            order.address_line1 = addr.get('line1', '')
+            order.address_line2 = addr.get('line2', '')
+            order.city = addr.get('city', '')
+            order.state = addr.get('state', '')
+            order.postal_code = addr.get('postal_code', '')
+            order.country = addr.get('country', '')
+        if shipping.get('name'):
+            order.full_name = shipping['name']
+
+    logging.info(f"Order {order.order_number} was paid (webhook {event['id']})")
+
+
+def _checkout_session_expired(event):
+    session = event['data']['object']
+    order = _lock_order(_event_order_id(event))
+    if not order or order.payment_id != session.get('id') or order.status != OrderStatus.PENDING.value:
+        # Paid since, or the customer went back to /payment and started a new session
+        return
+    release_order_reservations(order.id)
+    _advance_status(order, OrderStatus.CANCELED.value)
+    logging.info(f"Order {order.order_number} was canceled, its checkout session expired (webhook {event['id']})")
+
+
+def _payment_intent_succeeded(event):
+    order = _lock_order(_event_order_id(event))
+    if not order:
+        return
+    _advance_status(order, OrderStatus.PAID.value)
+    # This can arrive before checkout.session.completed; keep the release job off the stock
+    if order.status != OrderStatus.CANCELED.value:
+        commit_order_reservations(order.id)
+    logging.info(f"Order {order.order_number} was paid (webhook {event['id']})")
+
+
+EVENT_HANDLERS = {
+    'checkout.session.completed': _checkout_session_completed,
+    'checkout.session.expired': _checkout_session_expired,
+    'payment_intent.succeeded': _payment_intent_succeeded,
+}
+
+
+def process_pending_events(batch_size=WEBHOOK_BATCH_SIZE):
+    """Process one batch of due pending events, oldest first. Returns the batch size."""
+    now = datetime.utcnow()
+    events = WebhookEvent.query \
+        .filter(WebhookEvent.status == WebhookEventStatus.PENDING.value,
+                or_(WebhookEvent.next_attempt_at.is_(None), WebhookEvent.next_attempt_at <= now)) \
+        .order_by(WebhookEvent.stripe_created, WebhookEvent.id) \
+        .limit(batch_size).with_for_update(skip_locked=True).all()
+
+    for event in events:
+        handler = EVENT_HANDLERS.get(event.type)
+        if handler is None:
+            event.status = WebhookEventStatus.IGNORED.value
+            event.processed_at = datetime.utcnow()
+            continue
+
+        event.attempts += 1
+        try:
+            with db.session.begin_nested():
+                handler(event.get_payload())
+        except Exception as e:
+            logging.exception(f"Webhook {event.id} ({event.type}) failed, attempt {event.attempts}")
+            event.last_error = str(e)
+            if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                event.status = WebhookEventStatus.FAILED.value
+            else:
+                event.next_attempt_at = now + timedelta(seconds=WEBHOOK_RETRY_DELAY * 2 ** (event.attempts - 1))
+            continue
+        event.status = WebhookEventStatus.PROCESSED.value
+        event.processed_at = datetime.utcnow()
+        event.last_error = None
+        event.next_attempt_at = None
+
+    db.session.commit()
+    return len(events)
+
+
+def process_all_pending_events(batch_size=WEBHOOK_BATCH_SIZE):
+    """Process batches until a partial batch is reached. Returns the number of events handled."""
+    total = 0
+    while True:
+        count = process_pending_events(batch_size)
+        total += count
+        if count < batch_size:
+            return total
+
+
+_wake = threading.Event()
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def _run_worker(app):
+    while True:
+        _wake.wait(WEBHOOK_POLL_INTERVAL)
+        _wake.clear()
+        time.sleep(WEBHOOK_BATCH_WINDOW)
+        with app.app_context():
+            try:
+                process_all_pending_events()
+            except Exception:
+                logging.exception("Webhook worker failed to process a batch")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def start_webhook_worker(app):
+    """Start this process's webhook worker unless it is running."""
+    global _worker, _worker_pid
+    with _worker_lock:
+        # Threads do not survive fork, so each worker process starts its own
+        if _worker is None or _worker_pid != os.getpid() or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, args=(app,), name='webhook-worker', daemon=True)
+            _worker.start()
+            _worker_pid = os.getpid()
+
+
+def notify_webhook_worker(app):
+    """Wake this process's webhook worker, starting it if needed."""
+    start_webhook_worker(app)
+    _wake.set()